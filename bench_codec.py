@@ -0,0 +1,52 @@
+import timeit
+
+from message import Message, DATA
+
+ITERATIONS = 200000
+REPEAT = 5
+GROUP_NAME = 'distributed_systems'
+USERNAME = 'dimitris'
+CONTENT = 'the quick brown fox jumps over the lazy dog'
+
+message = Message(CONTENT, GROUP_NAME, USERNAME, 42, DATA, 3735928559, -1234567890123)
+
+
+# the text format of group messages before the binary wire format
+def text_encode():
+    return " ".join((str(message.serial_no), "in", message.group_name,
+                     message.username, "says::", message.message_content))
+
+
+def text_decode(received_msg):
+    tokens = received_msg.split()
+    return Message(' '.join(tokens[5:]), tokens[2], tokens[3], int(tokens[0]))
+
+
+def binary_encode():
+    return message.encode()
+
+
+def binary_decode(received_msg):
+    return Message.decode(received_msg)
+
+
+def measure(function, *args):
+    elapsed = min(timeit.repeat(lambda: function(*args), repeat=REPEAT, number=ITERATIONS))
+    return elapsed / ITERATIONS * 10 ** 6
+
+
+def main():
+    text_msg = text_encode()
+    # datagrams are decoded in place from the receive buffer
+    binary_msg = memoryview(bytearray(binary_encode()))
+
+    print 'Group message codec, best of %d x %d iterations' % (REPEAT, ITERATIONS)
+    print '%-8s %12s %12s %8s' % ('format', 'encode (us)', 'decode (us)', 'bytes')
+    print '%-8s %12.3f %12.3f %8d' % ('text', measure(text_encode),
+                                      measure(text_decode, text_msg), len(text_msg))
+    print '%-8s %12.3f %12.3f %8d' % ('binary', measure(binary_encode),
+                                      measure(binary_decode, binary_msg), len(binary_msg))
+
+
+if __name__ == "__main__":
+    main()
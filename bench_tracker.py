@@ -0,0 +1,173 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+from channel import ControlChannel, PUSH_REQUEST_ID
+from event_loop import EventLoop
+from failure_detector import HEARTBEAT_INTERVAL
+from group import Group
+from sharded_tracker import ShardedTracker
+from tracker import Tracker
+
+HOST = '127.0.0.1'
+# seconds the load runs before and while it is measured
+WARMUP = 2.0
+DURATION = 5.0
+# groups the members join and leave, spread across the shards by name
+GROUPS = 256
+# clock ticks per second of the CPU times in /proc/<pid>/stat
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def find_free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind((HOST, 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def run_tracker(port, shards):
+    # the tracker prints the members it removes once the load stops
+    sys.stdout = open(os.devnull, 'w')
+    if shards:
+        ShardedTracker(host=HOST, port=port, shards=shards).connect()
+    else:
+        Tracker(host=HOST, port=port).connect()
+
+
+# user and system CPU seconds used by a process
+def cpu_seconds(pid):
+    with open('/proc/%d/stat' % pid) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return float(int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+# the tracker process and its shards
+def tracker_processes(pid):
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat:
+                if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except IOError:
+            continue
+    return pids
+
+
+class LoadMember:
+    """
+    A member registered with the tracker that joins and leaves groups in a
+    loop, sending its next command as soon as the previous one is replied to.
+    Unless forward is set, the commands of a group are sent straight to the
+    shard owning it, as the client does.
+    """
+
+    def __init__(self, loop, port, username, first_group, forward, counter):
+        self.counter = counter
+        self.control = ControlChannel.connect(HOST, port, loop, on_push=self.ignore)
+        self.member_id = self.control.call('\t'.join(('register', HOST, '0', '0', username)))
+        self.shards = []
+        shards = self.control.call('\t'.join((self.member_id, '!sh')))
+        for address in shards.split('\t') if shards and not forward else ():
+            ip, shard_port = address.split(',')
+            shard = ControlChannel.connect(ip, int(shard_port), loop, on_push=self.ignore)
+            shard.call('attach\t' + ','.join((self.member_id, username, HOST, '0', '0')))
+            self.shards.append(shard)
+        self.group = first_group
+        self.joined = False
+        # the front end no longer sees the commands sent to the shards
+        loop.call_every(HEARTBEAT_INTERVAL, self.control.send, PUSH_REQUEST_ID, 'heartbeat')
+
+    def ignore(self, payload):
+        pass
+
+    def next_command(self, reply=None):
+        if reply is not None:
+            self.counter[0] += 1
+        if self.joined:
+            command = '!e'
+        else:
+            self.group = (self.group + 1) % GROUPS
+            command = '!j'
+        self.joined = not self.joined
+        group_name = 'bench%d' % self.group
+        control = self.control
+        if self.shards:
+            control = self.shards[Group.shard_of(group_name, len(self.shards))]
+        control.request('\t'.join((self.member_id, command, group_name)), self.next_command)
+
+
+def run_load(index, port, members, forward, start, results):
+    loop = EventLoop()
+    counter = [0]
+    load = [LoadMember(loop, port, 'load-%d-%d' % (index, member), index * members + member,
+                       forward, counter) for member in range(members)]
+    for member in load:
+        member.next_command()
+    # replies are counted within the measurement window only
+    while time.time() < start:
+        loop.run_once(start - time.time())
+    counter[0] = 0
+    end = start + DURATION
+    while time.time() < end:
+        loop.run_once(end - time.time())
+    results.put(counter[0])
+
+
+def measure(shards, args):
+    port = find_free_port()
+    tracker = multiprocessing.Process(target=run_tracker, args=(port, shards))
+    tracker.start()
+    time.sleep(1.0)
+    results = multiprocessing.Queue()
+    start = time.time() + WARMUP + 0.1 * args.members * args.processes / 50
+    loads = [multiprocessing.Process(target=run_load,
+                                     args=(index, port, args.members, args.forward, start, results))
+             for index in range(args.processes)]
+    for load in loads:
+        load.start()
+    while time.time() < start:
+        time.sleep(0.01)
+    pids = tracker_processes(tracker.pid)
+    cpu_before = [cpu_seconds(pid) for pid in pids]
+    commands = sum(results.get() for _ in loads)
+    cpu = [cpu_seconds(pid) - before for pid, before in zip(pids, cpu_before)]
+    for load in loads:
+        load.join()
+    tracker.terminate()
+    tracker.join()
+    return commands, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the group commands a tracker serves per second')
+    parser.add_argument('--shards', default='0,1,2,4',
+                        help='comma separated shard counts to measure, 0 is the single process tracker')
+    parser.add_argument('--processes', type=int, default=4, help='processes generating the load')
+    parser.add_argument('--members', type=int, default=50, help='members registered by each process')
+    parser.add_argument('--forward', action='store_true',
+                        help='send the group commands through the front end instead of the shards')
+    args = parser.parse_args()
+
+    print 'Group commands (!j/!e) of %d members over %.0f s, %d core(s)' % (
+        args.processes * args.members, DURATION, multiprocessing.cpu_count())
+    # on a host with fewer cores than tracker processes the processes share
+    # the cores, capacity is the throughput with a core per tracker process
+    print '%-7s %12s %14s %16s %14s' % ('shards', 'cmd/s', 'front end (s)', 'busiest shard (s)',
+                                       'capacity cmd/s')
+    for shards in [int(count) for count in args.shards.split(',')]:
+        commands, cpu = measure(shards, args)
+        busiest = max(cpu[1:]) if len(cpu) > 1 else 0.0
+        print '%-7d %12.0f %14.2f %16.2f %14.0f' % (shards, commands / DURATION, cpu[0], busiest,
+                                                    commands / max(cpu))
+
+
+if __name__ == "__main__":
+    main()
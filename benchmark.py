@@ -0,0 +1,258 @@
+import argparse
+import json
+import multiprocessing
+import socket
+import time
+
+from client import Client
+from metrics import MetricsAggregator, PERCENTILES
+from runtime import ClientRuntime
+from sharded_tracker import ShardedTracker
+from tracker import Tracker
+
+HOST = '127.0.0.1'
+# seconds between two checks of a client's progress
+POLL_INTERVAL = 0.01
+# seconds to wait for the members of a group to join
+JOIN_TIMEOUT = 10
+
+
+# return a port of the given type that is free on the local host
+def find_free_port(sock_type=socket.SOCK_STREAM):
+    sock = socket.socket(socket.AF_INET, sock_type)
+    sock.bind((HOST, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_tracker(port, shards):
+    if shards:
+        ShardedTracker(host=HOST, port=port, shards=shards).connect()
+    else:
+        Tracker(host=HOST, port=port).connect()
+
+
+class BenchmarkDriver:
+    """
+    Drives a client from the timers of its event loop: the client joins its
+    group, waits for the group to be complete, sends messages at a fixed rate
+    and reports its metrics once every message of the group has been delivered
+    to it. The client keeps serving the protocol (proposals, NACKs) until the
+    benchmark stops every client, so that no member leaves too early.
+    """
+
+    def __init__(self, client, group_name, args, results, stop, close=None):
+        self.client = client
+        # quits with the client once the benchmark is over
+        self.close = close if close is not None else client.close
+        self.group_name = group_name
+        self.messages = args.messages
+        self.rate = args.rate
+        self.payload = 'x' * args.size
+        self.expected_deliveries = args.messages * args.group_size
+        self.timeout = args.timeout
+        self.join_timeout = args.join_timeout
+        self.results = results
+        self.stop = stop
+        self.sent = 0
+        # messages owed to the send rate but not yet sent
+        self.credit = 0.0
+        self.first_send = None
+        self.last_send = None
+        self.deadline = None
+        self.reported = False
+
+    def start(self):
+        self.client.join(self.group_name)
+        self.client.select(self.group_name)
+        self.deadline = time.time() + self.join_timeout
+        self.client.loop.call_later(POLL_INTERVAL, self.wait_for_group)
+
+    def wait_for_group(self):
+        if self.client.group_ready():
+            self.first_send = self.last_send = time.time()
+            self.deadline = self.first_send + self.timeout
+            self.client.loop.call_later(POLL_INTERVAL, self.send_messages)
+        elif time.time() > self.deadline:
+            self.report('group incomplete')
+        else:
+            self.client.loop.call_later(POLL_INTERVAL, self.wait_for_group)
+
+    # send the messages owed since the last call, a burst per poll interval
+    # keeps the rate accurate beyond the resolution of the timers
+    def send_messages(self):
+        now = time.time()
+        self.credit += (now - self.last_send) * self.rate
+        self.last_send = now
+        while self.credit >= 1 and self.sent < self.messages:
+            self.client.send(self.payload)
+            self.sent += 1
+            self.credit -= 1
+        if self.sent < self.messages:
+            self.client.loop.call_later(POLL_INTERVAL, self.send_messages)
+        else:
+            self.client.loop.call_later(POLL_INTERVAL, self.wait_for_deliveries)
+
+    def wait_for_deliveries(self):
+        if self.client.metrics.total_messages_received >= self.expected_deliveries:
+            self.report('complete')
+        elif time.time() > self.deadline:
+            self.report('timeout')
+        else:
+            self.client.loop.call_later(POLL_INTERVAL, self.wait_for_deliveries)
+
+    def report(self, status):
+        if not self.reported:
+            self.reported = True
+            self.client.collect_metrics()
+            self.results.put({'username': self.client.member.username,
+                              'status': status,
+                              'sent': self.sent,
+                              'delivered': self.client.metrics.total_messages_received,
+                              'expected_deliveries': self.expected_deliveries,
+                              'first_send': self.first_send,
+                              'last_delivery': self.client.metrics.end_time,
+                              'snapshot': self.client.metrics.snapshot()})
+        if self.stop.is_set():
+            self.close()
+        else:
+            self.client.loop.call_later(POLL_INTERVAL, self.report, status)
+
+
+def run_client(index, mode, tracker_port, args, results, stop):
+    # the clients run headless, their deliveries are only counted
+    client = Client(HOST, find_free_port(socket.SOCK_DGRAM), mode, transport=args.transport,
+                    batch_delay=args.batch_delay, min_group_size=args.group_size)
+    client.connect(HOST, tracker_port, 'bench-%s-%d' % (mode.lower(), index))
+    group_name = 'bench%d' % (index // args.group_size)
+    driver = BenchmarkDriver(client, group_name, args, results, stop)
+    client.loop.call_later(0, driver.start)
+    client.loop.run()
+
+
+# host the clients first to last - 1 in a single process on a shared event loop
+def run_clients(first, last, mode, tracker_port, args, results, stop):
+    runtime = ClientRuntime(HOST, shared_socket=args.shared_socket)
+
+    def close(client):
+        runtime.remove_client(client)
+        if not runtime.clients:
+            runtime.close()
+
+    # the registration and join of a client block the shared loop, so the
+    # clients are started one per loop iteration and the clients started
+    # before keep serving the protocol and sending heartbeats in between
+    def start_client(index):
+        client = runtime.add_client(HOST, tracker_port, 'bench-%s-%d' % (mode.lower(), index), mode,
+                                    transport=args.transport, batch_delay=args.batch_delay,
+                                    min_group_size=args.group_size)
+        group_name = 'bench%d' % (index // args.group_size)
+        BenchmarkDriver(client, group_name, args, results, stop,
+                        lambda: close(client)).start()
+        if index + 1 < last:
+            runtime.loop.call_later(0, start_client, index + 1)
+
+    runtime.loop.call_later(0, start_client, first)
+    runtime.run()
+
+
+def run_benchmark(mode, args):
+    """
+    Run a tracker and the clients of a single ordering mode as separate
+    processes and return the merged report of the clients.
+    """
+    tracker_port = find_free_port()
+    tracker = multiprocessing.Process(target=run_tracker, args=(tracker_port, args.tracker_shards))
+    tracker.start()
+    time.sleep(0.5)
+
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    if args.clients_per_process > 1:
+        clients = [multiprocessing.Process(target=run_clients,
+                                           args=(first, min(first + args.clients_per_process, args.clients),
+                                                 mode, tracker_port, args, results, stop))
+                   for first in range(0, args.clients, args.clients_per_process)]
+    else:
+        clients = [multiprocessing.Process(target=run_client,
+                                           args=(index, mode, tracker_port, args, results, stop))
+                   for index in range(args.clients)]
+    for client in clients:
+        client.start()
+    reports = [results.get(timeout=args.timeout + args.join_timeout + 30) for _ in range(args.clients)]
+    stop.set()
+    for client in clients:
+        client.join(5)
+        if client.is_alive():
+            client.terminate()
+    tracker.terminate()
+    tracker.join()
+
+    aggregator = MetricsAggregator()
+    for report in reports:
+        aggregator.update(report['username'], report['snapshot'])
+    merged = aggregator.aggregate([report['username'] for report in reports])
+    latency = merged['latency']
+    sent = sum(report['sent'] for report in reports)
+    delivered = sum(report['delivered'] for report in reports)
+    start = min(report['first_send'] for report in reports if report['first_send'] is not None)
+    end = max(report['last_delivery'] for report in reports)
+    duration = max(end - start, 1e-9)
+    result = {'mode': mode,
+              'status': 'complete' if all(report['status'] == 'complete' for report in reports)
+              else 'incomplete',
+              'messages_sent': sent,
+              'messages_delivered': delivered,
+              'expected_deliveries': sum(report['expected_deliveries'] for report in reports),
+              'duration_s': duration,
+              'send_throughput': sent / duration,
+              'delivery_throughput': delivered / duration,
+              'datagrams_sent': merged['sent'],
+              'latency_ms': dict(('p%g' % percentile, latency.percentile(percentile) / 10.0 ** 3)
+                                 for percentile in PERCENTILES),
+              'counters': merged['counters']}
+    result['latency_ms']['mean'] = latency.mean() / 10 ** 3
+    result['latency_ms']['max'] = latency.max / 10.0 ** 3
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a tracker and N clients on localhost '
+                                                 'and report throughput and latency as JSON.')
+    parser.add_argument('--clients', type=int, default=5, help='number of clients')
+    parser.add_argument('--group-size', type=int, default=5, help='members of each group')
+    parser.add_argument('--messages', type=int, default=200, help='messages sent by each client')
+    parser.add_argument('--rate', type=float, default=100.0, help='messages per second of each client')
+    parser.add_argument('--size', type=int, default=64, help='message size in bytes')
+    parser.add_argument('--modes', default='FIFO,CAUSAL,TOTAL_ORDER,SEQUENCER', help='comma separated ordering modes')
+    parser.add_argument('--transport', default='UNICAST', choices=('UNICAST', 'MULTICAST'))
+    parser.add_argument('--batch-delay', type=float, default=None,
+                        help='seconds messages are batched for (no batching by default)')
+    parser.add_argument('--tracker-shards', type=int, default=0,
+                        help='processes the groups are sharded across (single process tracker by default)')
+    parser.add_argument('--clients-per-process', type=int, default=1,
+                        help='clients hosted by each process on a shared event loop')
+    parser.add_argument('--shared-socket', action='store_true',
+                        help='clients hosted by a process share a single UDP socket')
+    parser.add_argument('--join-timeout', type=float, default=JOIN_TIMEOUT,
+                        help='seconds to wait for the members of a group to join')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='seconds to wait for the deliveries of each mode')
+    parser.add_argument('--output', help='file the JSON report is written to (stdout by default)')
+    args = parser.parse_args()
+    if args.clients % args.group_size != 0:
+        parser.error('the number of clients must be a multiple of the group size')
+
+    report = {'config': vars(args),
+              'results': [run_benchmark(mode, args) for mode in args.modes.split(',')]}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print output
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
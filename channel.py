@@ -0,0 +1,276 @@
+import errno
+import os
+import select
+import socket
+import struct
+import time
+
+# every frame starts with the payload length and the request ID it refers to
+FRAME_HEADER = struct.Struct('!II')
+# request ID of frames that are not a reply to a request (e.g. notifications)
+PUSH_REQUEST_ID = 0
+# seconds to wait for the reply of a synchronous request
+REQUEST_TIMEOUT = 5
+# bytes read from the socket at once into the buffer of a connection, a frame
+# larger than that is read directly into a buffer of its own length
+READ_SIZE = 65536
+# largest frame payload in bytes, a peer announcing a larger frame is
+# misbehaving and its connection is closed
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FramedConnection:
+    """
+    Long-lived non-blocking TCP connection exchanging length-prefixed frames
+    tagged with a request ID. Received frames are passed to on_frame(connection,
+    request_id, payload) and on_close(connection) is called once the peer has
+    closed the connection.
+
+    Small frames are read in bulk into a preallocated buffer. Once the header
+    of a frame larger than the buffer has arrived, the rest of its payload is
+    read straight into a buffer of the payload's length, so a large reply (e.g.
+    the members of a big group) is neither truncated nor copied piecewise.
+    """
+
+    def __init__(self, sock, loop, on_frame, on_close=None):
+        self.socket = sock
+        self.socket.setblocking(0)
+        self.loop = loop
+        self.on_frame = on_frame
+        self.on_close = on_close
+        # buffer the socket is read into and bytes received but not yet parsed
+        # into complete frames
+        self.read_buffer = bytearray(READ_SIZE)
+        self.read_view = memoryview(self.read_buffer)
+        self.in_buffer = bytearray()
+        # the large frame being read: its request ID, payload buffer, a view of
+        # the buffer and the number of bytes received (None between frames)
+        self.large_frame = None
+        # complete frames waiting to be dispatched
+        self.frames = []
+        # bytes of queued frames not yet accepted by the kernel
+        self.out_buffer = bytearray()
+        self.closed = False
+        # whether the connection waits for the socket to become writable
+        self.writing = False
+        self.peer = sock.getpeername()
+        self.loop.add_reader(self.socket, self.handle_read)
+
+    def send(self, request_id, payload):
+        """
+        Queue a frame for sending
+        :raises ValueError: if the payload is larger than MAX_FRAME_SIZE bytes
+        """
+        if len(payload) > MAX_FRAME_SIZE:
+            raise ValueError('frame of %d bytes exceeds the maximum frame size' % len(payload))
+        if self.closed:
+            return
+        self.out_buffer += FRAME_HEADER.pack(len(payload), request_id)
+        self.out_buffer += payload
+        # try to write immediately and wait for the socket to become
+        # writable only if the kernel buffer is full
+        if not self.writing:
+            self.handle_write()
+
+    def handle_write(self):
+        try:
+            while self.out_buffer:
+                sent = self.socket.send(self.out_buffer)
+                del self.out_buffer[:sent]
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.close()
+                return
+        if self.out_buffer and not self.writing:
+            self.writing = True
+            self.loop.add_writer(self.socket, self.handle_write)
+        elif not self.out_buffer and self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.socket)
+
+    def handle_read(self):
+        while not self.closed:
+            large_frame = self.large_frame
+            if large_frame is not None:
+                view = large_frame[2][large_frame[3]:]
+            else:
+                view = self.read_view
+            try:
+                nbytes = self.socket.recv_into(view)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                nbytes = 0
+            if not nbytes:
+                self.dispatch_frames()
+                self.close()
+                return
+            if large_frame is not None:
+                large_frame[3] += nbytes
+                if large_frame[3] == len(large_frame[1]):
+                    self.large_frame = None
+                    self.frames.append((large_frame[0], str(large_frame[1])))
+            else:
+                self.in_buffer += self.read_view[:nbytes]
+                self.parse_frames()
+        self.dispatch_frames()
+
+    # cut the complete frames from the received bytes, the frame they end with
+    # is read into a buffer of its own if it is larger than the read buffer
+    def parse_frames(self):
+        offset = 0
+        while len(self.in_buffer) - offset >= FRAME_HEADER.size:
+            length, request_id = FRAME_HEADER.unpack_from(self.in_buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                self.close()
+                return
+            start = offset + FRAME_HEADER.size
+            end = start + length
+            if len(self.in_buffer) < end:
+                if length > READ_SIZE:
+                    payload = bytearray(length)
+                    received = len(self.in_buffer) - start
+                    payload[:received] = self.in_buffer[start:]
+                    self.large_frame = [request_id, payload, memoryview(payload), received]
+                    offset = len(self.in_buffer)
+                break
+            self.frames.append((request_id, str(self.in_buffer[start:end])))
+            offset = end
+        del self.in_buffer[:offset]
+
+    def dispatch_frames(self):
+        # complete frames are taken from the connection before being
+        # dispatched, so handlers may safely read from the connection again
+        frames, self.frames = self.frames, []
+        for request_id, payload in frames:
+            if self.closed:
+                return
+            self.on_frame(self, request_id, payload)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove_reader(self.socket)
+        self.loop.remove_writer(self.socket)
+        self.socket.close()
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class ControlChannel(FramedConnection):
+    """
+    Client side of the control connection to the tracker. Requests are tagged
+    with increasing IDs so that several of them can be in flight and their
+    replies are matched to the request regardless of the order they arrive.
+    Frames that are not replies are passed to on_push(payload).
+    """
+
+    def __init__(self, sock, loop, on_push=None, on_close=None):
+        FramedConnection.__init__(self, sock, loop, self.dispatch_frame, on_close)
+        self.on_push = on_push
+        self.next_request_id = PUSH_REQUEST_ID
+        # dictionary with key = <request-id> and value = <reply callback>
+        self.pending = {}
+        # whether a synchronous request is waiting for its reply
+        self.calling = False
+
+    @classmethod
+    def connect(cls, host, port, loop, on_push=None, on_close=None):
+        sock = socket.create_connection((host, port), REQUEST_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock, loop, on_push, on_close)
+
+    @classmethod
+    def connect_async(cls, host, port, loop, on_connect, on_error, on_push=None, on_close=None):
+        """
+        Open a connection without blocking the event loop: on_connect(channel)
+        is called once it is established, or on_error(error) with a socket.error
+        if it fails or is not established within REQUEST_TIMEOUT seconds.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        # the outcome is reported once the socket becomes writable
+        code = sock.connect_ex((host, port))
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            loop.call_later(0, on_error, socket.error(code, os.strerror(code)))
+            return
+
+        def connected():
+            loop.remove_writer(sock)
+            timer.cancel()
+            code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                sock.close()
+                on_error(socket.error(code, os.strerror(code)))
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            on_connect(cls(sock, loop, on_push, on_close))
+
+        def timed_out():
+            loop.remove_writer(sock)
+            sock.close()
+            on_error(socket.timeout('connection to tracker timed out'))
+
+        timer = loop.call_later(REQUEST_TIMEOUT, timed_out)
+        loop.add_writer(sock, connected)
+
+    def request(self, payload, callback=None):
+        """
+        Send a request without waiting for its reply, callback(reply)
+        is called when the reply arrives. Returns the request ID.
+        """
+        self.next_request_id += 1
+        request_id = self.next_request_id
+        self.pending[request_id] = callback
+        self.send(request_id, payload)
+        return request_id
+
+    def call(self, payload, timeout=REQUEST_TIMEOUT):
+        """
+        Send a request and block until its reply arrives, frames received
+        meanwhile are dispatched as usual. Raises socket.timeout if the
+        reply does not arrive within timeout seconds.
+        """
+        replies = []
+        self.request(payload, replies.append)
+        deadline = time.time() + timeout
+        self.calling = True
+        # poll rather than select, which fails on the descriptors above 1023
+        # of a process hosting many clients
+        poller = select.poll()
+        try:
+            while not replies:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.closed:
+                    raise socket.timeout('no reply from tracker')
+                mask = select.POLLIN | (select.POLLOUT if self.out_buffer else 0)
+                poller.register(self.socket, mask)
+                try:
+                    events = poller.poll(remaining * 1000.0)
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    events = []
+                ready = events[0][1] if events else 0
+                if ready & select.POLLOUT:
+                    self.handle_write()
+                if ready & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                    self.handle_read()
+        finally:
+            self.calling = False
+        return replies[0]
+
+    def dispatch_frame(self, connection, request_id, payload):
+        if request_id in self.pending:
+            callback = self.pending.pop(request_id)
+            if callback is not None:
+                callback(payload)
+        elif self.on_push is not None:
+            if self.calling:
+                # pushes sent after the reply may refer to state the caller
+                # builds from it, so they are handled once the call returns
+                self.loop.call_later(0, self.on_push, payload)
+            else:
+                self.on_push(payload)
@@ -1,175 +1,780 @@
+import errno
+import json
 import socket
 import sys
 import re
-import select
 import time
 import random
+from collections import deque
 
+from channel import ControlChannel, PUSH_REQUEST_ID
+from event_loop import EventLoop
+from failure_detector import HEARTBEAT_INTERVAL
+from fragment import Reassembler, split_datagram, MAX_DATAGRAM_SIZE, MAX_MESSAGE_SIZE
 from member import Member
 from group import Group
-from message import Message
-from metrics import Metrics
-
+from holdback import FifoHoldback, CausalHoldback, TotalOrderHoldback, SequencerHoldback
+from message import Message, DATA, PROPOSE, FINAL, NACK, BATCH, ORDER, ORDER_NACK, FRAGMENT, \
+    SESSION, START, HEADER_SIZE, unpack_header
+from metrics import Metrics, read_udp_drops
+from reliability import RetransmitRing, ReceiveWindow, NACK_DELAY, NACK_INTERVAL, NACK_RETRIES, \
+    MAX_NACK_SERIALS, TAIL_INTERVAL, TAIL_ROUNDS
+
+# default number of members a group should have before messages are sent to it
+GROUP_SIZE = 5
+# seconds to wait for the priority proposals of a message in total ordering
+# mode before retransmitting it to the members that have not proposed yet
+PROPOSAL_TIMEOUT = 0.5
+# number of retransmissions after which a message is counted as overdue, it is
+# still retransmitted until the silent members propose or leave the group
+PROPOSAL_RETRIES = 3
+# seconds a held back message may wait for its final priority in total ordering
+# mode before the proposal is sent again to recover a lost final priority
+FINAL_TIMEOUT = 0.5
+# seconds a message may wait for a dependency in causal ordering mode before the
+# dependency is given up on, e.g. a message of a member that has left the group
+# or that was sent before this client joined, lost messages are recovered sooner
+DEPENDENCY_TIMEOUT = 1.0
+# seconds between two checks for the stamps missing in sequencer mode, a stamp
+# still missing at the next check is requested from the sequencer again
+ORDER_TIMEOUT = 0.1
+# seconds a new sequencer collects the stamps of the failed one from the other
+# members before it stamps messages
+TAKEOVER_DELAY = 2 * ORDER_TIMEOUT
+# most datagrams of a stream held until the serial number it starts at is
+# known, the later ones are requested once it is
+MAX_HELD_DATAGRAMS = 1024
+# size of the buffer datagrams are received into, the largest UDP payload
+RECEIVE_BUFFER_SIZE = 65535
+# most datagrams read from a socket per wakeup, so that a flood on one socket
+# does not starve user input and timers
+MAX_DATAGRAMS_PER_WAKEUP = 1024
+# requested kernel buffer sizes of the UDP sockets in bytes (the kernel caps
+# them at net.core.rmem_max and net.core.wmem_max)
+SOCKET_RCVBUF = 4 * 1024 * 1024
+SOCKET_SNDBUF = 1024 * 1024
+# largest batch of messages in bytes, sized to fit in a single Ethernet frame
+BATCH_MAX_BYTES = 1400
+# largest number of messages in a batch
+BATCH_MAX_MESSAGES = 64
+# seconds between two snapshots of the client's metrics pushed to the tracker
+METRICS_INTERVAL = 5
+# seconds between two attempts to reconnect to the tracker and seconds after
+# which a client that cannot reach the tracker gives up
+RECONNECT_INTERVAL = 0.5
+RECONNECT_TIMEOUT = 30
 
 class Client:
 
-    def __init__(self, ip, udp_port, mode='FIFO'):
+    def __init__(self, ip, udp_port, mode='FIFO', transport='UNICAST', nack_delay=NACK_DELAY,
+                 nack_retries=NACK_RETRIES, rcvbuf=SOCKET_RCVBUF, sndbuf=SOCKET_SNDBUF,
+                 batch_delay=None, batch_max_bytes=BATCH_MAX_BYTES,
+                 batch_max_messages=BATCH_MAX_MESSAGES, min_group_size=GROUP_SIZE,
+                 loop=None, udp_socket=None, receive_buffer=None,
+                 max_datagram_size=MAX_DATAGRAM_SIZE, metrics_interval=METRICS_INTERVAL):
         self.member = Member(None, None, ip, udp_port, self.generate_random_port())
-        self.udp_socket = None
-        self.tcp_socket = None
+        # the member ID assigned by the tracker as carried in messages
+        self.sender_id = None
+        # a UDP socket shared by the clients hosted in one process is read by
+        # their ClientRuntime, which passes each client its datagrams
+        self.udp_socket = udp_socket
+        self.owns_udp_socket = udp_socket is None
         self.tracker_ip = None
         self.tracker_port = None
+        # persistent connection carrying commands to the tracker and its replies
+        self.control = None
+        # connections to the shards of a sharded tracker indexed by shard (None
+        # until connected), the commands of a group are sent to the shard owning
+        # it, which pushes the group's notifications over the same connection
+        self.shard_controls = []
+        # time after which reconnecting to the tracker is given up
+        self.reconnect_deadline = None
         self.input_fd = None
-        if (mode != 'FIFO') and (mode != 'TOTAL_ORDER'):
-            print 'Unsupported message ordering mode'
-            sys.exit(3)
-        else:
-            self.mode = mode
+        # periodic jobs of the client, cancelled when it quits
+        self.timers = []
+        # event loop dispatching user input, network messages and timers,
+        # possibly shared with other clients hosted in the same process
+        self.owns_loop = loop is None
+        self.loop = loop if loop is not None else EventLoop()
+        # whether reading user input is paused until the selected group is complete
+        self.input_paused = False
+        # number of members the selected group needs before user input is read
+        self.min_group_size = min_group_size
+        if mode not in ('FIFO', 'CAUSAL', 'TOTAL_ORDER', 'SEQUENCER'):
+            raise ValueError('Unsupported message ordering mode')
+        self.mode = mode
+        # messages are sent to each member of a group (UNICAST) or as a single
+        # datagram to the multicast address of the group (MULTICAST)
+        if (transport != 'UNICAST') and (transport != 'MULTICAST'):
+            raise ValueError('Unsupported transport mode')
+        self.transport = transport
+        # sockets receiving the messages sent to the multicast address of each
+        # group with key = <group_name> and value = <socket>
+        self.multicast_sockets = {}
         # dictionary of all groups this client belongs to
         self.group_list = {}
+        # the same groups with key = <group-id> to resolve incoming messages
+        self.groups_by_id = {}
+        # usernames of the members of those groups with key = <member-id>
+        self.usernames = {}
         # the group client has selected to send messages
         self.current_group = None
-        # serial number of message sent by client
+        # total number of messages sent by client
         self.message_num = 0
-        # lamport vector implementation for FIFO ordering implemented as a dictionary
-        # with key = <(username, group_name)> and value = <message-serial-no>
-        self.lamport_dict = {}
-        # buffer storing messages waiting to be delivered
-        self.messages_buffer = []
-        # lamport timestamp to support total ordering operation mode
-        self.lamport_timestamp = 0
-        # performance metrics
+        # serial number of the last message sent by client to each group
+        # with key = <group_name> and value = <message-serial-no>
+        self.group_serials = {}
+        # hold-back queue implementing FIFO ordering per (sender, group), which
+        # also orders the messages proposed in total ordering mode and the
+        # messages stamped in sequencer mode
+        self.fifo_holdback = FifoHoldback()
+        # hold-back queue implementing causal ordering with a vector clock per
+        # group, and the dependencies it was missing at the last check
+        self.causal_holdback = CausalHoldback()
+        self.stalled_dependencies = set()
+        # ISIS hold-back queues supporting total ordering operation mode
+        # with key = <group-id> and value = <TotalOrderHoldback>
+        self.total_holdback = {}
+        # priorities proposed for the messages this client has sent in total
+        # ordering mode with key = <message-id> and value = dictionary with the
+        # member IDs that have not proposed yet and the largest proposal so far
+        self.pending_proposals = {}
+        # hold-back queues of the sequencer ordering mode with key = <group-id> and
+        # value = <SequencerHoldback>, the stamps received kept to serve requests of
+        # members that missed them with key = <group-id> and value = <RetransmitRing>,
+        # the last sequence number this client stamped as the sequencer of a group,
+        # the takeovers of groups whose sequencer has failed with value = <Timer>
+        # and the (sequence number, requests) a group was stalled at the last check
+        self.sequencer_holdback = {}
+        self.order_rings = {}
+        self.order_serials = {}
+        self.takeovers = {}
+        self.stalled_orders = {}
+        # IDs of the messages waiting for their final priority at the last check
+        # with key = <group-id>, those still waiting at the next check are stalled
+        self.stalled_messages = {}
+        # datagrams this client has sent to each group kept for retransmission
+        # with key = <group-id> and value = <RetransmitRing>, DATA messages and
+        # final priorities are kept apart since they share serial numbers
+        self.retransmit_rings = {}
+        self.final_rings = {}
+        # serial number of the last message sent to each group and the number of
+        # times it was announced so that receivers detect its loss, with key =
+        # <group-id> and value = [<serial-no>, <announcements>]
+        self.tail_serials = {}
+        # received serial numbers of each stream for duplicate and gap detection
+        # with key = <(sender-id, group-id)> and value = <ReceiveWindow>
+        self.receive_windows = {}
+        # streams of the members that were in a group when this client joined it,
+        # the messages they sent before are not delivered to this client, so such
+        # a stream starts at the serial number its sender announces in a START
+        # message, until then its datagrams are held and the start requested
+        # with key = <(sender-id, group-id)> and value = dictionary with the
+        # datagrams held, the lowest and highest serial numbers seen, the
+        # requests sent and the timer of the next one
+        self.joined_streams = set()
+        self.start_requests = {}
+        # serial number the stream of this client starts at for each member that
+        # joined a group after it with key = <(member-id, group-id)>
+        self.stream_starts = {}
+        # seconds to wait for a missing message before requesting it and number
+        # of requests before giving up on it, trading recovery latency for traffic
+        self.nack_delay = nack_delay
+        self.nack_retries = nack_retries
+        # kernel buffer sizes of the UDP sockets, a larger receive buffer
+        # absorbs bursts that arrive faster than the client reads them
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        # preallocated buffer every datagram is received into and decoded
+        # from in place, instead of allocating a string per datagram (clients
+        # sharing an event loop may share it, a datagram is handled at once)
+        if receive_buffer is None:
+            receive_buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.receive_buffer = receive_buffer
+        self.receive_view = memoryview(self.receive_buffer)
+        # datagrams dropped by the kernel on the UDP sockets already closed
+        self.closed_socket_drops = 0
+        # messages sent to a group within batch_delay seconds are packed into a
+        # single datagram of at most batch_max_bytes and batch_max_messages,
+        # trading that delay for fewer datagrams (None sends every message at once)
+        self.batch_delay = batch_delay
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_max_messages = batch_max_messages
+        # messages waiting to be sent in a batch with key = <group-id> and value =
+        # dictionary with their datagrams, their size and the timer flushing them
+        self.batches = {}
+        # datagrams larger than max_datagram_size are split into fragments, those
+        # received from the other members are reassembled, the fragment ID of
+        # the last datagram fragmented that is not a DATA message
+        self.max_datagram_size = max_datagram_size
+        self.fragment_id = 0
+        self.reassembler = Reassembler()
+        # callbacks every delivered Message is handed to, print_message renders
+        # the messages on the terminal of an interactive client
+        self.delivery_callbacks = []
+        # callbacks called once the client has closed, with the error that
+        # closed it (None if closed by close()), and whether it has closed
+        self.close_callbacks = []
+        self.closed = False
+        # performance metrics, pushed to the tracker every metrics_interval
+        # seconds (None if the host of the client pushes them, see ClientRuntime)
         self.metrics = Metrics()
+        self.metrics_interval = metrics_interval
 
 
 
     def register(self, server_ip, server_port, input_fd=sys.stdin, username=None):
         """
-        Register client to the messenger application
+        Register client to the messenger application and serve the commands
+        and messages of the user read from input_fd until the user quits
         :param server_ip:   tracker's IP address
         :param server_port: the port tracker is listening to
         :param input_fd:    the file descriptor of the input stream (stdin is default)
         :param username:    client's username - skips username validation
         """
-        self.tracker_ip = server_ip
-        self.tracker_port = server_port
         self.input_fd = input_fd
-        
-        # initialize UDP socket for group messages
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.bind((self.member.ip, self.member.udp_port))
-        # initialize TCP socket listening for group change notifications from tracker
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tcp_socket.setblocking(0)
-        self.tcp_socket.bind((self.member.ip, self.member.tcp_port))
-        self.tcp_socket.listen(1)
+        self.add_delivery_callback(self.print_message)
+        self.add_close_callback(self.exit_on_error)
 
         valid_username = False
 
         while not valid_username:
             if username is None:
                 username = raw_input('Enter your username: ')
-            # check if the username is valid (matches specific regex)
-            if re.match("^[a-zA-Z0-9_.-]+$", username) is None:
-                print "Username is invalid, please try again."
-                username = None
-                continue
-
-            # generate registration message and send to tracker
-            formatted_message = "\t".join(("register", self.member.ip, str(self.member.udp_port),
-                                           str(self.member.tcp_port), username))
-            reply = self.send_to_server(formatted_message)
-            # check if username already exists
-            if reply == "username taken":
-                print "Username already exists, please try again."
-                username = None
-                continue
-            else:
+            try:
+                self.connect(server_ip, server_port, username)
                 valid_username = True
-                self.member.id = reply
-                self.member.username = username
+            except ValueError as e:
+                print "%s, please try again." % e
+                username = None
+            except socket.error as e:
+                print 'Tracker unreachable: %s' % e
+                sys.exit(1)
 
         print 'Successfully registered to messenger application!'
         sys.stderr.write('[%s] > ' % self.member.username)
         self.run()
 
 
+    def connect(self, server_ip, server_port, username):
+        """
+        Register client to the messenger application without a terminal. The
+        client is then driven by join(), select(), send() and leave() and its
+        deliveries are consumed with messages() or add_delivery_callback()
+        :param server_ip:   tracker's IP address
+        :param server_port: the port tracker is listening to
+        :param username:    client's username
+        :raises ValueError: if the username is invalid or already taken
+        :raises socket.error: if the tracker is unreachable or does not reply
+        """
+        # check if the username is valid (matches specific regex)
+        if re.match("^[a-zA-Z0-9_.-]+$", username) is None:
+            raise ValueError("Username is invalid")
+        self.tracker_ip = server_ip
+        self.tracker_port = server_port
+
+        if self.udp_socket is None:
+            # initialize UDP socket for group messages
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind((self.member.ip, self.member.udp_port))
+            # port 0 binds the socket to any free port
+            self.member.udp_port = self.udp_socket.getsockname()[1]
+            self.configure_udp_socket(self.udp_socket)
+            if self.transport == 'MULTICAST':
+                # multicast datagrams leave through the interface of the client,
+                # are looped back to the members on this host and stay in the LAN
+                self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                           socket.inet_aton(self.member.ip))
+                self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+                self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        if self.control is None:
+            # open the control connection used for every command to the tracker,
+            # it also carries group change notifications and heartbeats
+            self.control = ControlChannel.connect(self.tracker_ip, self.tracker_port, self.loop,
+                                                  on_push=self.handle_server_notification,
+                                                  on_close=self.handle_tracker_disconnect)
+
+        # generate registration message and send to tracker
+        formatted_message = "\t".join(("register", self.member.ip, str(self.member.udp_port),
+                                       str(self.member.tcp_port), username))
+        reply = self.send_to_server(formatted_message)
+        # check if username already exists
+        if reply == "username taken":
+            raise ValueError("Username already exists")
+        self.member.id = reply
+        self.member.username = username
+        self.sender_id = int(reply)
+        self.attach_shards(self.send_to_server("\t".join((self.member.id, '!sh'))), blocking=True)
+        self.start()
+        return self.member.id
+
+
+    # receive the messages of the groups and schedule the periodic jobs of the
+    # client on its event loop
+    def start(self):
+        if self.owns_udp_socket:
+            self.loop.add_reader(self.udp_socket, self.handle_udp_message, self.udp_socket)
+        self.timers = [
+            # heartbeats let the tracker detect that this client has failed
+            self.loop.call_every(HEARTBEAT_INTERVAL, self.send_heartbeat)]
+        # the tracker merges the metrics of all clients into a live view
+        if self.metrics_interval is not None:
+            self.timers.append(self.loop.call_every(self.metrics_interval, self.push_metrics))
+        if self.mode == 'TOTAL_ORDER':
+            self.timers.append(self.loop.call_every(FINAL_TIMEOUT, self.check_stalled_TOTAL))
+        else:
+            self.timers.append(self.loop.call_every(TAIL_INTERVAL, self.retransmit_tails))
+        if self.mode == 'CAUSAL':
+            self.timers.append(self.loop.call_every(DEPENDENCY_TIMEOUT, self.check_stalled_CAUSAL))
+        elif self.mode == 'SEQUENCER':
+            self.timers.append(self.loop.call_every(ORDER_TIMEOUT, self.check_stalled_SEQUENCER))
+
 
     def run(self):
-            # loop forever waiting for incoming messages from other clients and waiting for
-            # user to submit a message and/or a command from stdin (all those operations
-            # are non-blocking due to the use of select() function
-            sockets_list = [self.input_fd, self.udp_socket, self.tcp_socket]
-            counter=0
+        # loop forever waiting for incoming messages from other clients and waiting for
+        # user to submit a message and/or a command from stdin, the event loop blocks
+        # until one of them is ready or a timer is due
+        self.loop.add_reader(self.input_fd, self.handle_user_input)
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.collect_metrics()
+            self.metrics.print_info()
+            sys.exit(0)
+
+
+    def add_delivery_callback(self, callback):
+        """
+        Hand every message delivered from now on to callback(message), the
+        Message carries the group_name, username and message_content
+        """
+        self.delivery_callbacks.append(callback)
+
+
+    def remove_delivery_callback(self, callback):
+        self.delivery_callbacks.remove(callback)
+
+
+    def add_close_callback(self, callback):
+        """
+        Call callback(error) once the client has closed, error describes the
+        failure that closed the client, e.g. the tracker being unreachable for
+        longer than RECONNECT_TIMEOUT, or is None if close() was called
+        """
+        self.close_callbacks.append(callback)
+
+
+    # an interactive client exits once a failure has closed it
+    def exit_on_error(self, error):
+        if error is not None:
+            sys.stderr.write('\n%s\n' % error)
+            self.metrics.print_info()
+            sys.exit(1)
+
+
+    def messages(self, timeout=None):
+        """
+        Iterate over the delivered messages, the event loop of the client runs
+        while no message is pending. The iteration ends once no message has
+        been delivered for timeout seconds (never if timeout is None).
+        """
+        pending = deque()
+        self.add_delivery_callback(pending.append)
+        try:
             while True:
-                counter = counter + 1
-                try:
-                    readers, writers, errors = select.select(sockets_list, [], [], 0)
-                except KeyboardInterrupt:
-                    self.metrics.print_info()
-                    sys.exit(0)
-
-                # if there are not any messages received from network then deliver
-                # the messages we already have by total ordering
-
-                if counter>500 and (not readers) and self.mode == 'TOTAL_ORDER':
-                    self.deliver_messages_TOTAL()
-
-                for sock in readers:
-                    counter=0
-                    # if self.mode == 'TOTAL_ORDER':
-                        # time.sleep(0.001)
-                    # the user has entered a command for the tracker or a message for a group
-                    if sock == self.input_fd:
-                        # ensure that all clients are up and running
-                        if self.current_group is not None and len(self.current_group.members_list) != 5:
-                            continue
-                        text = self.input_fd.readline()
-                        if text == "":
-                            sockets_list.remove(self.input_fd)
-                            continue
-                        self.decode_and_forward(text)
-                        sys.stderr.write('[%s] > ' % self.member.username)
-
-                    # the udp socket listening for chat messages has available data to read
-                    # so a member from the groups the user belongs to, has written a message
-                    # that is printed to the stdout
-                    elif sock == self.udp_socket:
-                        sock.settimeout(5)
-                        try:
-                            received_msg = sock.recv(4096)
-                        except socket.error:
-                            print "Timeout Happened"
-                            sock.shutdown(socket.SHUT_RDWR)
-                            sock.close()
-                            sys.exit(1)
-                        if self.mode == 'FIFO':
-                            self.handle_incoming_message_FIFO(received_msg)
-                        elif self.mode == 'TOTAL_ORDER':
-                            self.handle_incoming_message_TOTAL(received_msg)
-
-
-                    # the TCP socket is listening for server to notify asynchronously that
-                    # a member has entered or left a group that the client belongs to
-                    elif sock == self.tcp_socket:
-                        # accept an incoming connection from tracker
-                        sockfd, addr = self.tcp_socket.accept()
-                        # set the socket to non-blocking
-                        # TODO - socket should be non-blocking (but is bug prone)
-                        sockfd.setblocking(1)
-                        self.handle_server_notification(sockfd)
-
-                    # unreachable state
-                    else:
-                        print 'This should never be displayed [1].'
+                deadline = None if timeout is None else time.time() + timeout
+                while not pending:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self.loop.run_once(remaining)
+                yield pending.popleft()
+        finally:
+            self.remove_delivery_callback(pending.append)
+
+
+    # the user has entered a command for the tracker or a message for a group
+    def handle_user_input(self):
+        # ensure that all clients are up and running, input is paused
+        # until the tracker notifies us that the group is complete
+        if not self.group_ready():
+            self.loop.remove_reader(self.input_fd)
+            self.input_paused = True
+            return
+        text = self.input_fd.readline()
+        if text == "":
+            self.loop.remove_reader(self.input_fd)
+            return
+        self.decode_and_forward(text)
+        if not self.closed:
+            sys.stderr.write('[%s] > ' % self.member.username)
+
+
+    # check whether all clients of the selected group are up and running
+    def group_ready(self):
+        return (self.current_group is None or
+                len(self.current_group.members) >= self.min_group_size)
+
+
+    # make a UDP socket non-blocking and set its kernel buffer sizes
+    def configure_udp_socket(self, udp_socket):
+        udp_socket.setblocking(0)
+        if self.rcvbuf is not None:
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf is not None:
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+
+    # the udp socket listening for chat messages has available data to read
+    # so members from the groups the user belongs to have written messages,
+    # every datagram queued on the socket is read in a single wakeup
+    def handle_udp_message(self, udp_socket):
+        for _ in xrange(MAX_DATAGRAMS_PER_WAKEUP):
+            try:
+                nbytes, address = udp_socket.recvfrom_into(self.receive_buffer)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # e.g. an ICMP port unreachable for a datagram sent to a member
+                # that has failed, the socket itself is still usable
+                self.metrics.increment('udp_receive_errors')
+                continue
+            self.handle_datagram(self.receive_view[:nbytes], address)
+
+
+    # send a datagram without blocking, a datagram the kernel cannot queue is
+    # dropped like one lost in the network and recovered the same way, as is a
+    # datagram split into fragments if any of them is lost
+    def send_datagram(self, datagram, address):
+        if len(datagram) > self.max_datagram_size:
+            self.send_fragments(datagram, address)
+            return
+        try:
+            self.udp_socket.sendto(datagram, address)
+        except socket.error:
+            self.metrics.increment('udp_send_errors')
+
+
+    # a DATA message is fragmented with its serial number as the fragment ID,
+    # so a retransmission completes the fragments of the lost copies
+    def send_fragments(self, datagram, address):
+        header = unpack_header(datagram)
+        if header[1] == DATA:
+            fragment_id = header[5]
+        else:
+            self.fragment_id += 1
+            fragment_id = self.fragment_id
+        for fragment in split_datagram(datagram, self.sender_id, fragment_id,
+                                       self.max_datagram_size):
+            try:
+                self.udp_socket.sendto(fragment, address)
+            except socket.error:
+                self.metrics.increment('udp_send_errors')
+            self.metrics.increment('fragments_sent')
+
+
+    # decode a received datagram and pass it to the handler of its type
+    def handle_datagram(self, datagram, address):
+        try:
+            message = Message.decode(datagram)
+        except ValueError:
+            self.metrics.increment('malformed_messages')
+            return
+        # ignore messages of groups the client does not belong to
+        group = self.groups_by_id.get(message.group_id)
+        if group is None:
+            return
+        # names are not carried on the wire, they are resolved from the IDs
+        message.group_name = group.name
+        message.username = self.usernames.get(message.sender_id, str(message.sender_id))
+
+        if message.msg_type == DATA:
+            stream = (message.sender_id, message.group_id)
+            if stream in self.joined_streams:
+                self.hold_until_start(stream, message.serial_no, address, datagram)
+                return
+            # duplicates are dropped before reaching the ordering protocols
+            if not self.accept_message(message, address):
+                if self.mode == 'TOTAL_ORDER':
+                    self.handle_duplicate_TOTAL(message, address)
+                return
+            if self.mode == 'FIFO':
+                self.handle_incoming_message_FIFO(message)
+            elif self.mode == 'CAUSAL':
+                self.handle_incoming_message_CAUSAL(message)
+            elif self.mode == 'SEQUENCER':
+                self.handle_incoming_message_SEQUENCER(message)
+            elif self.mode == 'TOTAL_ORDER':
+                self.handle_incoming_message_TOTAL(message, address)
+        elif message.msg_type == PROPOSE:
+            self.handle_proposal(message, address)
+        elif message.msg_type == FINAL:
+            self.handle_final_priority(message)
+        elif message.msg_type == NACK:
+            self.handle_nack(message, address)
+        elif message.msg_type == ORDER:
+            self.handle_order(message)
+        elif message.msg_type == ORDER_NACK:
+            self.handle_order_nack(message, address)
+        elif message.msg_type == BATCH:
+            # the messages of a batch are handled as if received one by one
+            for datagram in Message.split_batch(datagram):
+                self.handle_datagram(datagram, address)
+        elif message.msg_type == FRAGMENT:
+            self.handle_fragment(message, datagram, address)
+        elif message.msg_type == SESSION:
+            self.announce_message((message.sender_id, message.group_id), message.serial_no, address)
+        elif message.msg_type == START:
+            self.handle_stream_start(message, address)
+
+
+    # a message is handled once all of its fragments have arrived, until then
+    # the fragments of a DATA message announce it to the window of its stream
+    # so that it is requested like a lost message if it does not complete
+    def handle_fragment(self, fragment, datagram, address):
+        try:
+            message = self.reassembler.add(datagram)
+        except ValueError:
+            self.metrics.increment('malformed_messages')
+            return
+        if message is not None:
+            self.handle_datagram(message, address)
+            return
+        if unpack_header(datagram)[2] == DATA:
+            self.announce_message((fragment.sender_id, fragment.group_id), fragment.serial_no,
+                                  address)
+
+
+    # record the receipt of a message in the window of its stream and return
+    # whether it is new, a gap in the serial numbers schedules a NACK
+    def accept_message(self, message, address):
+        stream = (message.sender_id, message.group_id)
+        window = self.receive_windows.get(stream)
+        if window is None:
+            window = self.receive_windows[stream] = ReceiveWindow()
+        window.address = address
+        if not window.accept(message.serial_no):
+            if window.in_window(message.serial_no):
+                self.metrics.increment('duplicates_dropped')
+            else:
+                # dropped for now, it is requested again once the window slides
+                self.metrics.increment('window_overflows')
+            return False
+        if window.has_gap() and window.nack_timer is None:
+            window.nack_timer = self.loop.call_later(self.nack_delay, self.send_nack, stream)
+        return True
+
+
+    # request the missing messages of a stream from their sender, after
+    # nack_retries requests without progress the messages are given up on
+    def send_nack(self, stream):
+        window = self.receive_windows.get(stream)
+        if window is None:
+            return
+        window.nack_timer = None
+        if not window.has_gap():
+            return
+        if window.base != window.nack_base:
+            window.nack_base = window.base
+            window.nack_attempts = 0
+        if window.nack_attempts >= self.nack_retries:
+            skipped = window.give_up()
+            self.metrics.increment('nack_gaps_skipped', len(skipped))
+            if self.mode == 'FIFO':
+                for serial_no in skipped:
+                    for message in self.fifo_holdback.skip(stream[0], stream[1], serial_no):
+                        self.deliver_message(message)
+            elif self.mode == 'TOTAL_ORDER':
+                for serial_no in skipped:
+                    for message in self.fifo_holdback.skip(stream[0], stream[1], serial_no):
+                        self.propose_TOTAL(message, window.address)
+            elif self.mode == 'SEQUENCER':
+                for serial_no in skipped:
+                    for message in self.fifo_holdback.skip(stream[0], stream[1], serial_no):
+                        self.hold_back_SEQUENCER(message)
+            elif self.mode == 'CAUSAL':
+                for serial_no in skipped:
+                    for message in self.causal_holdback.skip(stream[0], stream[1], serial_no):
+                        self.deliver_message(message)
+            return
+        window.nack_attempts += 1
+        nack = Message(None, None, None, 0, NACK, stream[1], stream[0])
+        nack.missing = window.missing(MAX_NACK_SERIALS)
+        self.send_datagram(nack.encode(), window.address)
+        self.metrics.total_messages_sent += 1
+        self.metrics.increment('nacks_sent')
+        window.nack_timer = self.loop.call_later(NACK_INTERVAL, self.send_nack, stream)
+
+
+    # retransmit the requested messages that are still in the retransmit ring
+    def handle_nack(self, nack, address):
+        ring = self.retransmit_rings.get(nack.group_id)
+        if ring is None or nack.sender_id != self.sender_id:
+            return
+        for serial_no in nack.missing:
+            datagram = ring.get(serial_no)
+            if datagram is None:
+                self.metrics.increment('nacks_unavailable')
+                continue
+            self.send_datagram(datagram, address)
+            self.metrics.total_messages_sent += 1
+            self.metrics.increment('nacks_served')
+
+
+    # the loss of the last message sent to a group goes unnoticed until the next
+    # one arrives, so its serial number is announced with a SESSION message every
+    # TAIL_INTERVAL, up to TAIL_ROUNDS times while the sender is idle, and the
+    # receivers that missed it request it (in total ordering mode the sender
+    # retransmits unproposed messages)
+    def retransmit_tails(self):
+        for group_id, ring in self.retransmit_rings.items():
+            group = self.groups_by_id.get(group_id)
+            if group is None:
+                continue
+            tail = self.tail_serials.get(group_id)
+            if tail is None or tail[0] != ring.last_serial:
+                tail = self.tail_serials[group_id] = [ring.last_serial, 0]
+            elif tail[1] == TAIL_ROUNDS:
+                continue
+            tail[1] += 1
+            # the sender does not know whether any receiver missed the tail
+            if tail[1] == TAIL_ROUNDS:
+                self.metrics.increment('tail_announcements_stopped')
+            session = Message(None, None, None, ring.last_serial, SESSION, group_id, self.sender_id)
+            datagram = session.encode()
+            target_addresses = self.group_addresses(group)
+            for target_address in target_addresses:
+                self.send_datagram(datagram, target_address)
+            self.metrics.total_messages_sent += len(target_addresses)
+            self.metrics.increment('tail_announcements')
+
+
+    # a message of a stream is known to have been sent, e.g. it was announced or
+    # some of its fragments have arrived, so it is requested if it does not arrive
+    # (the stream of a member that joined after this client starts at 1)
+    def announce_message(self, stream, serial_no, address=None):
+        window = self.receive_windows.get(stream)
+        if window is None:
+            if stream in self.joined_streams:
+                self.hold_until_start(stream, serial_no, address)
+                return
+            group = self.groups_by_id.get(stream[1])
+            if address is None or group is None or not group.has_member(str(stream[0])):
+                return
+            window = self.receive_windows[stream] = ReceiveWindow()
+            window.address = address
+        if window.announce(serial_no) and window.nack_timer is None:
+            window.nack_timer = self.loop.call_later(self.nack_delay, self.send_nack, stream)
+
+
+    # hold a datagram of a stream that started before this client joined until
+    # its sender tells the serial number it starts at, which is requested at
+    # once and then every NACK_INTERVAL, after nack_retries requests the stream
+    # starts at the lowest serial number received as if it were the first
+    def hold_until_start(self, stream, serial_no, address, datagram=None):
+        request = self.start_requests.get(stream)
+        if request is None:
+            request = self.start_requests[stream] = {'datagrams': [], 'lowest': serial_no,
+                                                     'highest': serial_no, 'attempts': 0,
+                                                     'timer': None, 'address': address}
+            self.request_stream_start(stream)
+        request['lowest'] = min(request['lowest'], serial_no)
+        request['highest'] = max(request['highest'], serial_no)
+        if datagram is not None and len(request['datagrams']) < MAX_HELD_DATAGRAMS:
+            request['datagrams'].append(datagram.tobytes())
+
+
+    def request_stream_start(self, stream):
+        request = self.start_requests.get(stream)
+        if request is None:
+            return
+        request['timer'] = None
+        if request['attempts'] >= self.nack_retries:
+            self.metrics.increment('stream_starts_unknown')
+            self.start_stream(stream, request['lowest'], request['address'])
+            return
+        request['attempts'] += 1
+        self.send_stream_start(stream[0], stream[1], 0, request['address'])
+        request['timer'] = self.loop.call_later(NACK_INTERVAL, self.request_stream_start, stream)
+
+
+    # tell a member the serial number the stream of this client starts at for
+    # it (0 requests the start of the member's stream)
+    def send_stream_start(self, member_id, group_id, serial_no, address):
+        start = Message(None, None, None, 0, START, group_id, member_id)
+        start.priority = serial_no
+        start.proposer_id = self.sender_id
+        self.send_datagram(start.encode(), address)
+        self.metrics.total_messages_sent += 1
+
+
+    # answer a request for the start of this client's stream, or start the
+    # stream of the member that sent it at the announced serial number
+    def handle_stream_start(self, start, address):
+        if start.sender_id != self.sender_id:
+            return
+        if start.priority == 0:
+            serial_no = self.stream_starts.get((start.proposer_id, start.group_id))
+            if serial_no is not None:
+                self.send_stream_start(start.proposer_id, start.group_id, serial_no, address)
+            return
+        stream = (start.proposer_id, start.group_id)
+        if stream in self.joined_streams:
+            self.start_stream(stream, start.priority, address)
+
+
+    # start delivering a stream at the given serial number and handle the
+    # datagrams held until then
+    def start_stream(self, stream, serial_no, address):
+        self.joined_streams.discard(stream)
+        window = self.receive_windows[stream] = ReceiveWindow()
+        window.base = window.highest = serial_no - 1
+        window.address = address
+        if self.mode == 'CAUSAL':
+            for message in self.causal_holdback.start(stream[0], stream[1], serial_no):
+                self.deliver_message(message)
+        else:
+            self.fifo_holdback.start(stream[0], stream[1], serial_no)
+        request = self.drop_start_request(stream)
+        if request is None:
+            return
+        for datagram in request['datagrams']:
+            self.handle_datagram(memoryview(datagram), request['address'])
+        self.announce_message(stream, request['highest'])
+
+
+    def drop_start_request(self, stream):
+        request = self.start_requests.pop(stream, None)
+        if request is not None and request['timer'] is not None:
+            request['timer'].cancel()
+        return request
+
+
+    # forget the stream of a member that left a group
+    def drop_receive_window(self, sender_id, group_id):
+        window = self.receive_windows.pop((sender_id, group_id), None)
+        if window is not None and window.nack_timer is not None:
+            window.nack_timer.cancel()
+
+
+    # notify the tracker that this client is alive
+    def send_heartbeat(self):
+        self.control.send(PUSH_REQUEST_ID, 'heartbeat')
+
+
+    # push a snapshot of the client's metrics to the tracker, udp_table is the
+    # kernel table of the UDP sockets if already read (see collect_metrics)
+    def push_metrics(self, udp_table=None):
+        self.collect_metrics(udp_table)
+        snapshot = json.dumps(self.metrics.snapshot(), separators=(',', ':'))
+        self.control.send(PUSH_REQUEST_ID, 'metrics\t' + snapshot)
 
 
     # list all available groups in the messenger chat
     def list_groups(self, message):
         command = message.split()[0]
         formatted_message = "\t".join((str(self.member.id), command))
-        reply = self.send_to_server(formatted_message)
-        print 'groups: ' + reply
+        self.send_to_server_async(formatted_message, lambda reply: self.print_reply('groups: ' + reply))
 
 
     # list members of certain group
@@ -177,23 +782,93 @@ class Client:
         command = message.split()[0]
         group_name = message.split()[1]
         formatted_message = "\t".join((str(self.member.id), command, group_name))
-        reply = self.send_to_server(formatted_message)
-        print 'members: ' + reply
+        self.send_to_server_async(formatted_message, lambda reply: self.print_reply('members: ' + reply),
+                                  group_name)
 
 
     # join selected group
     def join_group(self, message):
-        command = message.split()[0]
-        group_name = message.split()[1]
-        formatted_message = "\t".join((str(self.member.id), command, group_name))
-        reply = self.send_to_server(formatted_message)
+        try:
+            self.join(message.split()[1])
+        except ValueError as e:
+            self.print_reply(str(e))
+        except socket.error:
+            self.print_reply('join failed: no reply from tracker')
+
+
+    def join(self, group_name):
+        """
+        Join a group, creating it if it does not exist, and return it
+        :raises ValueError: if the group name is invalid or its group ID is
+                            the ID of another group
+        :raises socket.error: if the tracker does not reply
+        """
+        if re.match("^[\w-]+$", group_name) is None:
+            raise ValueError("Group name '%s' is invalid" % group_name)
+        if group_name in self.group_list:
+            return self.group_list[group_name]
+        formatted_message = "\t".join((str(self.member.id), '!j', group_name))
+        reply = self.send_to_server(formatted_message, group_name)
+        if reply == "group id taken":
+            raise ValueError("Group name '%s' has the group ID of another group" % group_name)
+        # the members of the group are followed by its multicast address
+        members_reply, _, multicast_info = reply.partition("\n")
         multicast_group = Group(group_name)
-        members_details = reply.split("\t")
+        members_details = members_reply.split("\t")
         for m in members_details:
             member_info = m.split(",")
             mem = Member(member_info[0], member_info[1], member_info[2], member_info[3], member_info[4])
             multicast_group.add_member(mem)
+            self.usernames[int(mem.id)] = mem.username
+            if mem.id != self.member.id:
+                self.joined_streams.add((int(mem.id), multicast_group.id))
         self.group_list[group_name] = multicast_group
+        self.groups_by_id[multicast_group.id] = multicast_group
+        if self.transport == 'MULTICAST' and multicast_info:
+            multicast_addr, multicast_port = multicast_info.split(",")
+            multicast_group.multicast_addr = multicast_addr
+            multicast_group.multicast_port = int(multicast_port)
+            self.join_multicast_group(multicast_group)
+        return multicast_group
+
+
+    # join the multicast address assigned to the group by the tracker with a
+    # socket bound to it, if multicast is not available on this host the
+    # messages of the group are sent to each member over unicast instead
+    def join_multicast_group(self, group):
+        if group.name in self.multicast_sockets:
+            return
+        membership = socket.inet_aton(group.multicast_addr) + socket.inet_aton(self.member.ip)
+        multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # members running on the same host share the port of the group
+            multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            multicast_socket.bind((group.multicast_addr, group.multicast_port))
+            multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except socket.error as e:
+            print 'Multicast not available (%s), group %s falls back to unicast' % (e, group.name)
+            multicast_socket.close()
+            return
+        self.configure_udp_socket(multicast_socket)
+        self.multicast_sockets[group.name] = multicast_socket
+        self.loop.add_reader(multicast_socket, self.handle_udp_message, multicast_socket)
+
+
+    # stop receiving the messages sent to the multicast address of the group
+    def leave_multicast_group(self, group_name):
+        multicast_socket = self.multicast_sockets.pop(group_name, None)
+        if multicast_socket is not None:
+            self.loop.remove_reader(multicast_socket)
+            self.closed_socket_drops += read_udp_drops([multicast_socket]) or 0
+            multicast_socket.close()
+
+
+    # the addresses a message to the group is sent to, the multicast address of
+    # the group if the client has joined it or else the address of every member
+    def group_addresses(self, group):
+        if group.name in self.multicast_sockets:
+            return [(group.multicast_addr, group.multicast_port)]
+        return group.get_addresses()
 
 
     # exit selected group.
@@ -201,177 +876,739 @@ class Client:
         if not self.group_list:
             print 'No available groups exist.'
         else:
-            command = message.split()[0]
-            group_name = message.split()[1]
-            formatted_message = "\t".join((str(self.member.id), command, group_name))
-            reply = self.send_to_server(formatted_message)
-            # TODO - error handle a reply different than 'EXIT_GROUP OK'
-
-            if group_name in self.group_list.keys():
-                del self.group_list[group_name]
-                if (self.current_group is not None) and (group_name == self.current_group.name):
-                    self.current_group = None
-            else:
-                print "You don\'t belong in group '%s'." % group_name
+            try:
+                self.leave(message.split()[1])
+            except ValueError as e:
+                print e
 
 
-    # warn tracker that you quit chat service, free udp/tcp port and exit
+    def leave(self, group_name):
+        """
+        Leave a group, the messages still batched for it are sent first
+        :raises ValueError: if the client does not belong to the group
+        """
+        if group_name not in self.group_list:
+            raise ValueError("You don't belong in group '%s'." % group_name)
+        # messages still waiting in a batch are sent while we are a member
+        self.flush_batch(self.group_list[group_name].id)
+        formatted_message = "\t".join((str(self.member.id), '!e', group_name))
+        self.send_to_server_async(formatted_message, self.handle_exit_group_reply, group_name)
+
+        group = self.group_list.pop(group_name)
+        del self.groups_by_id[group.id]
+        self.leave_multicast_group(group_name)
+        self.total_holdback.pop(group.id, None)
+        self.stalled_messages.pop(group.id, None)
+        self.fifo_holdback.remove_group(group.id)
+        self.causal_holdback.remove_group(group.id)
+        self.sequencer_holdback.pop(group.id, None)
+        self.order_rings.pop(group.id, None)
+        self.order_serials.pop(group.id, None)
+        self.stalled_orders.pop(group.id, None)
+        takeover = self.takeovers.pop(group.id, None)
+        if takeover is not None:
+            takeover.cancel()
+        self.retransmit_rings.pop(group.id, None)
+        self.final_rings.pop(group.id, None)
+        self.tail_serials.pop(group.id, None)
+        # the members remove the stream of this client, so a rejoin starts it over
+        self.group_serials.pop(group_name, None)
+        for message_id in self.pending_proposals.keys():
+            if message_id[0] == group.id:
+                self.pending_proposals.pop(message_id)['timer'].cancel()
+        for stream in self.receive_windows.keys():
+            if stream[1] == group.id:
+                self.drop_receive_window(*stream)
+        for stream in list(self.joined_streams):
+            if stream[1] == group.id:
+                self.joined_streams.discard(stream)
+                self.drop_start_request(stream)
+        for stream in self.stream_starts.keys():
+            if stream[1] == group.id:
+                del self.stream_starts[stream]
+        if (self.current_group is not None) and (group_name == self.current_group.name):
+            self.current_group = None
+
+
+    def handle_exit_group_reply(self, reply):
+        if reply != "EXIT_GROUP OK":
+            self.print_reply('exit group failed: ' + reply)
+
+
+    # warn tracker that you quit chat service, free udp/tcp port and stop
+    # the event loop, so that run() returns
     def quit(self, message):
-        tokens = message.split()
-        formatted_message = "\t".join((str(self.member.id), tokens[0]))
-        reply = self.send_to_server(formatted_message)
-        # TODO - error handle a reply different than 'QUIT OK'
-
-        self.udp_socket.close()
-        self.tcp_socket.close()
+        self.close()
         print '\nTerminating messenger application ...\n'
 
         # print performance analytics information
         self.metrics.print_info()
-        sys.exit(0)
+
+
+    def close(self, error=None):
+        """
+        Quit the messenger application: the tracker removes the client from
+        its groups, the sockets are closed and the event loop is stopped
+        :param error: the failure closing the client, passed to the close callbacks
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for group_id in self.batches.keys():
+            self.flush_batch(group_id)
+        formatted_message = "\t".join((str(self.member.id), '!q'))
+        if not self.control.closed:
+            try:
+                reply = self.send_to_server(formatted_message)
+                # TODO - error handle a reply different than 'QUIT OK'
+            except socket.error:
+                # the tracker removes the client once its heartbeats stop
+                pass
+
+        # metrics are collected while the sockets are still open
+        self.collect_metrics()
+        self.control.on_close = None
+        self.control.close()
+        for control in self.shard_controls:
+            if control is not None:
+                control.close()
+        for timer in self.timers:
+            timer.cancel()
+        for pending in self.pending_proposals.values():
+            pending['timer'].cancel()
+        for stream in self.start_requests.keys():
+            self.drop_start_request(stream)
+        if self.owns_udp_socket:
+            self.loop.remove_reader(self.udp_socket)
+            self.udp_socket.close()
+        for group_name in self.multicast_sockets.keys():
+            self.leave_multicast_group(group_name)
+        if self.owns_loop:
+            self.loop.stop()
+        for callback in self.close_callbacks:
+            callback(error)
 
 
     # select group to send next messages. The selected group
     # is stored in  current_group private variable
     def select_group(self, message):
-        group_name = message.split()[1]
-        if group_name in self.group_list.keys():
-            self.current_group = self.group_list[group_name]
-        else:
-            print "You don't belong in group '%s'." % group_name
+        try:
+            self.select(message.split()[1])
+        except ValueError as e:
+            print e
 
 
-    # send data to server and return reply. Used in
-    # other functions to automate this process
-    def send_to_server(self, message):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((self.tracker_ip, self.tracker_port))
+    def select(self, group_name):
+        """
+        Select the group send() sends messages to by default
+        :raises ValueError: if the client does not belong to the group
+        """
+        if group_name not in self.group_list:
+            raise ValueError("You don't belong in group '%s'." % group_name)
+        self.current_group = self.group_list[group_name]
+
+
+    # send data to server and return reply, raises socket.error if the
+    # tracker does not reply in time. Used in other functions to automate
+    # this process, the command of a group is sent to the shard owning it
+    def send_to_server(self, message, group_name=None):
         self.metrics.total_messages_sent += 1
-        s.send(message)
-        s.settimeout(5)
-        try:
-            reply = s.recv(4096)
-        except socket.error:
-            sys.stderr.write("socket timeout")
-            s.shutdown(socket.SHUT_RDWR)
-            s.close()
-            sys.exit(0)
-        s.shutdown(socket.SHUT_RDWR)
-        s.close()
-        return reply
+        return self.control_of(group_name).call(message)
 
 
-    def handle_server_notification(self, socket):
-        message = socket.recv(4096)
-        if message:
-            # debug message to print the message sent by tracker
-            # print 'Tracker [' + str(socket.getpeername()) + '] sent notification "' + str(message) + '"'
-            notification = message.split("\t")
+    # send data to server without waiting for the reply, the callback
+    # is called with the reply once it arrives
+    def send_to_server_async(self, message, callback, group_name=None):
+        self.metrics.total_messages_sent += 1
+        self.control_of(group_name).request(message, callback)
+
+
+    # the connection the commands of a group are sent over, the tracker forwards
+    # the commands of a shard the client is not connected to
+    def control_of(self, group_name):
+        if group_name is not None and self.shard_controls:
+            control = self.shard_controls[Group.shard_of(group_name, len(self.shard_controls))]
+            if control is not None and not control.closed:
+                return control
+        return self.control
+
+
+    # connect to the shards of a sharded tracker listed in reply as '<ip>,<port>'
+    # (none if the tracker is not sharded), in place of the previous ones
+    def attach_shards(self, reply, blocking=False):
+        for control in self.shard_controls:
+            if control is not None:
+                control.close()
+        addresses = [address.split(",") for address in reply.split("\t") if "," in address]
+        self.shard_controls = [None] * len(addresses)
+        for index, (ip, port) in enumerate(addresses):
+            if blocking:
+                control = ControlChannel.connect(ip, int(port), self.loop,
+                                                 on_push=self.handle_server_notification)
+                self.handle_shard_connect(index, control)
+            else:
+                ControlChannel.connect_async(
+                    ip, int(port), self.loop,
+                    lambda control, index=index: self.handle_shard_connect(index, control),
+                    self.handle_shard_error, on_push=self.handle_server_notification)
+
+
+    # the shard learns which member the connection belongs to
+    def handle_shard_connect(self, index, control):
+        if self.closed or index >= len(self.shard_controls) or self.shard_controls[index] is not None:
+            control.close()
+            return
+        member_info = ",".join((self.member.id, self.member.username, self.member.ip,
+                                str(self.member.udp_port), str(self.member.tcp_port)))
+        control.request("attach\t" + member_info)
+        self.shard_controls[index] = control
+
+
+    # the commands of the groups of a shard the client could not connect to
+    # are forwarded by the tracker
+    def handle_shard_error(self, error):
+        self.metrics.increment('shard_connect_errors')
+
+
+    # the tracker closed the control connection, e.g. because it restarts, the
+    # client keeps exchanging messages with its groups meanwhile and reconnects
+    # to resume its registration instead of registering and joining again
+    def handle_tracker_disconnect(self, connection):
+        sys.stderr.write('\nConnection to tracker lost, reconnecting ...\n')
+        self.reconnect_deadline = time.time() + RECONNECT_TIMEOUT
+        self.loop.call_later(RECONNECT_INTERVAL, self.reconnect)
+
+
+    # the connection is opened without blocking, so the client keeps serving
+    # its groups while the tracker is unreachable
+    def reconnect(self):
+        if self.closed:
+            return
+        ControlChannel.connect_async(self.tracker_ip, self.tracker_port, self.loop,
+                                     self.handle_reconnect, self.handle_reconnect_error,
+                                     on_push=self.handle_server_notification,
+                                     on_close=self.handle_tracker_disconnect)
+
+
+    def handle_reconnect_error(self, error):
+        if self.closed:
+            return
+        if time.time() < self.reconnect_deadline:
+            self.loop.call_later(RECONNECT_INTERVAL, self.reconnect)
+            return
+        self.close('Connection to tracker lost')
+
+
+    # resume the registration once connected again
+    def handle_reconnect(self, control):
+        if self.closed:
+            control.on_close = None
+            control.close()
+            return
+        self.control = control
+        formatted_message = "\t".join(("resume", self.member.ip, str(self.member.udp_port),
+                                       str(self.member.tcp_port), self.member.username,
+                                       str(self.member.id)))
+        self.send_to_server_async(formatted_message, self.handle_resume_reply)
+        # the shards of a restarted tracker listen on other ports, meanwhile
+        # the commands of the groups are forwarded by the tracker
+        self.send_to_server_async("\t".join((str(self.member.id), '!sh')), self.attach_shards)
+
+
+    # the tracker either kept the registration of the client and replies with
+    # the current members of its groups or it registered the client again
+    # (member IDs derive from usernames, so the ID is unchanged), in which case
+    # the client joins its groups again
+    def handle_resume_reply(self, reply):
+        if reply == "username taken":
+            self.close('Username taken by another client while reconnecting')
+            return
+        lines = reply.split("\n")
+        group_members = {}
+        if lines[0] == 'RESUME OK':
+            for line in lines[1:]:
+                members = line.split("\t")
+                group_members[members[0]] = members[1:]
+        for group_name, group in self.group_list.items():
+            if group_name in group_members:
+                self.sync_group_members(group, group_members.pop(group_name))
+            else:
+                formatted_message = "\t".join((str(self.member.id), '!j', group_name))
+                self.send_to_server_async(formatted_message,
+                                          lambda reply, group=group: self.handle_rejoin_reply(group, reply),
+                                          group_name)
+        # the client left these groups while the tracker was unreachable
+        for group_name in group_members:
+            formatted_message = "\t".join((str(self.member.id), '!e', group_name))
+            self.send_to_server_async(formatted_message, self.handle_exit_group_reply, group_name)
+        self.print_reply('Reconnected to tracker')
+
+
+    def handle_rejoin_reply(self, group, reply):
+        if self.group_list.get(group.name) is not group:
+            return
+        # a group with the same ID was created while the tracker was unreachable
+        if reply == "group id taken":
+            self.print_reply("Group name '%s' has the group ID of another group" % group.name)
+            self.leave(group.name)
+            return
+        members_reply, _, multicast_info = reply.partition("\n")
+        # the other members are rejoining as well, so those not listed yet are kept
+        self.sync_group_members(group, members_reply.split("\t"), remove_missing=False)
+        # a tracker that lost its state assigns the group a new multicast address
+        if self.transport == 'MULTICAST' and multicast_info:
+            multicast_addr, multicast_port = multicast_info.split(",")
+            if (multicast_addr, int(multicast_port)) != (group.multicast_addr, group.multicast_port):
+                self.leave_multicast_group(group.name)
+                group.multicast_addr = multicast_addr
+                group.multicast_port = int(multicast_port)
+                self.join_multicast_group(group)
+
+
+    # bring the client's view of a group in line with the members listed by
+    # the tracker, changes missed while disconnected are applied as if notified
+    def sync_group_members(self, group, members_details, remove_missing=True):
+        members = [Member(*member_info.split(",")) for member_info in members_details if member_info]
+        if remove_missing:
+            member_ids = set(member.id for member in members)
+            for member_id in [member_id for member_id in group.members if member_id not in member_ids]:
+                self.remove_group_member(group, member_id)
+        for member in members:
+            if not group.has_member(member.id):
+                self.add_group_member(group, member)
+        self.resume_user_input()
+
+
+    # print a reply of the tracker and prompt the user for next command/message
+    def print_reply(self, text):
+        sys.stderr.write('\r%s\n[%s] > ' % (text, self.member.username))
+
+
+    # the tracker pushes asynchronously over the control connection that members
+    # have entered or left groups that the client belongs to, each line of the
+    # batched notification describes one change
+    def handle_server_notification(self, message):
+        for line in message.split("\n"):
+            notification = line.split("\t")
             operation = notification[0]
             group_name = notification[1]
-            group = self.group_list[group_name]
+            group = self.group_list.get(group_name)
+            # the client may have left the group in the meantime
+            if group is None:
+                continue
             member_info = notification[2].split(',')
 
             # add the new member to client's group view in order to be
             # able to send him messages
             if operation == 'add':
-                new_member = Member(member_info[0], member_info[1], member_info[2],
-                                    member_info[3], member_info[4])
-                group.add_member(new_member)
+                self.add_group_member(group, Member(member_info[0], member_info[1], member_info[2],
+                                                    member_info[3], member_info[4]))
             # remove the member from client's group view
             elif operation == 'remove':
-                member_name = member_info[1]
-                group.remove_member_by_name(member_name)
+                self.remove_group_member(group, member_info[0])
             else:
-                print '[handle_server_notification] Operation not supported'
-                sys.exit(2)
+                self.metrics.increment('unsupported_notifications')
+        self.resume_user_input()
+
+
+    # the stream of this client starts at its next message for a new member,
+    # which is told so since the messages sent before do not reach it, while
+    # the stream of the new member starts at 1 (a member rejoining under the
+    # same username has the same ID, so what is left of its earlier stream is
+    # dropped unless its new messages have arrived already)
+    def add_group_member(self, group, member):
+        group.add_member(member)
+        self.usernames[int(member.id)] = member.username
+        if member.id != self.member.id:
+            if (int(member.id), group.id) not in self.receive_windows:
+                self.fifo_holdback.remove_stream(int(member.id), group.id)
+            serial_no = self.group_serials.get(group.name, 0) + 1
+            self.stream_starts[(int(member.id), group.id)] = serial_no
+            self.send_stream_start(int(member.id), group.id, serial_no,
+                                   (member.ip, int(member.udp_port)))
+
+
+    def remove_group_member(self, group, member_id):
+        sequencer_id = self.sequencer_of(group)
+        group.remove_member_by_id(member_id)
+        self.drop_receive_window(int(member_id), group.id)
+        self.joined_streams.discard((int(member_id), group.id))
+        self.drop_start_request((int(member_id), group.id))
+        self.stream_starts.pop((int(member_id), group.id), None)
+        self.fifo_holdback.remove_stream(int(member_id), group.id)
+        if self.mode == 'TOTAL_ORDER':
+            self.handle_member_departure_TOTAL(group.id, int(member_id))
+        elif self.mode == 'CAUSAL':
+            for message in self.causal_holdback.remove_member(group.id, int(member_id)):
+                self.deliver_message(message)
+        elif self.mode == 'SEQUENCER':
+            self.handle_member_departure_SEQUENCER(group, int(member_id), sequencer_id)
+
+
+    # resume reading user input once the selected group is complete
+    def resume_user_input(self):
+        if self.input_paused and self.group_ready():
+            self.input_paused = False
+            self.loop.add_reader(self.input_fd, self.handle_user_input)
 
 
     # check incoming message and ensure that the message is not delivered
     # unless it ensures FIFO ordering, if the message should not be
     # delivered then it is stored in the associated buffer according to
     # its group
-    def handle_incoming_message_FIFO(self, received_msg):
-        # each message received should be in the following form
-        # <message-number> in <group-name> <username> says:: <message-content>
-        message = self.parse_incoming_message(received_msg)
-
-        # tuple associated with the incoming message (username,group_name)
-        tup = (message.username, message.group_name)
-
-        # if it is the first message received from this client then we should
-        # initialize this (user,group) tuple's with a serial number of zero
-        if tup not in self.lamport_dict.keys():
-            self.lamport_dict[tup] = 0
-
-        # serial number received by this message's (user,group) tuple
-        last_serial = self.lamport_dict[tup]
-
-        # if the serial number of the message received is the expected i.e the serial
-        # number we have last received by this message's (user,group) tuple then
-        # we accept the message and deliver it to the application (print to stdout)
-        if message.serial_no == last_serial + 1:
-            self.print_message(message)
-            # add the delivering time of the message with specific message ID only
-            # if it was sent from this client
-            if message.username == self.member.username:
-                delivering_time = time.time()
-                self.metrics.latency_list[message.get_id()].append(delivering_time)
-            self.metrics.total_messages_received += 1
-            # increment serial number of this (group,username) tuple's
-            self.lamport_dict[tup] = self.lamport_dict[tup] + 1
-            # check if there are any messages in the buffer waiting for the recently
-            # received message to be delivered and cascade deliver those messages
-            updates_available = True
-            while updates_available:
-                for waiting_msg in self.messages_buffer:
-                    if ((waiting_msg.username, waiting_msg.group_name) == tup) and \
-                            (waiting_msg.serial_no == message.serial_no + 1):
-                        self.print_message(waiting_msg)
-                        # add the delivering time of the message with specific message ID
-                        delivering_time = time.time()
-                        self.metrics.latency_list[waiting_msg.get_id()].append(delivering_time)
-                        self.metrics.total_messages_received += 1
-                        self.messages_buffer.remove(waiting_msg)
-                        continue
-                updates_available = False
-
-        # if the serial number of the message received is greater than the expected
-        # then the message should be appended to the buffer
-        elif message.serial_no > last_serial + 1:
-            self.messages_buffer.append(message)
-
-        # if the serial number of the message received is less than the expected
-        # then the message should be rejected
-        else:
-            sys.stderr.write('A message is rejected due to smaller serial_no than expected')
-
+    def handle_incoming_message_FIFO(self, message):
+        # the hold-back queue returns the message itself along with any buffered
+        # messages of the same (sender, group) that were waiting for it,
+        # or nothing if the message is out of order or a duplicate
+        for deliverable in self.push_holdback(self.fifo_holdback, message):
+            self.deliver_message(deliverable)
+
+
+    # causal ordering: a message is held back until its sender's previous message
+    # and the messages its vector clock depends on have been delivered
+    def handle_incoming_message_CAUSAL(self, message):
+        for deliverable in self.push_holdback(self.causal_holdback, message):
+            self.deliver_message(deliverable)
+
+
+    # push a message to a hold-back queue and return the messages it delivers, a
+    # message the queue has no room for is forgotten by the window of its stream
+    # and requested again, as it would otherwise be lost without leaving a gap
+    def push_holdback(self, holdback, message):
+        overflows = holdback.overflows
+        deliverable = holdback.push(message)
+        if holdback.overflows != overflows:
+            stream = (message.sender_id, message.group_id)
+            window = self.receive_windows.get(stream)
+            if window is not None:
+                window.forget(message.serial_no)
+                if window.nack_timer is None:
+                    window.nack_timer = self.loop.call_later(self.nack_delay, self.send_nack, stream)
+        return deliverable
+
+
+    # sequencer ordering: the oldest member of a group stamps the messages of the
+    # group with consecutive sequence numbers in the order it receives them (the
+    # messages of each sender in FIFO order) and multicasts the stamps as ORDER
+    # messages, members deliver the messages by ascending sequence number
+    def handle_incoming_message_SEQUENCER(self, message):
+        for fifo_message in self.push_holdback(self.fifo_holdback, message):
+            self.hold_back_SEQUENCER(fifo_message)
+
+
+    def hold_back_SEQUENCER(self, message):
+        group = self.groups_by_id[message.group_id]
+        if self.sequencer_of(group) == self.sender_id and group.id not in self.takeovers:
+            self.send_order(group, message)
+        holdback = self.sequencer_holdback.setdefault(group.id, SequencerHoldback())
+        for deliverable in holdback.add_message(message):
+            self.deliver_message(deliverable)
+
+
+    # the sequencer of a group is its oldest member, so every member agrees on it
+    # from its own view of the group and the next oldest takes over on failure
+    def sequencer_of(self, group):
+        for member_id in group.members:
+            return int(member_id)
+        return None
+
+
+    # stamp a message with the next sequence number of its group
+    def send_order(self, group, message):
+        seq = self.order_serials.get(group.id, 0) + 1
+        self.order_serials[group.id] = seq
+        order = Message(None, group.name, None, message.serial_no, ORDER, group.id, message.sender_id)
+        order.priority = seq
+        order.proposer_id = self.sender_id
+        encoded_order = order.encode()
+        self.order_rings.setdefault(group.id, RetransmitRing()).store(seq, encoded_order)
+        # stamps are batched along with the messages of the sequencer
+        if self.batch_delay is not None:
+            self.add_to_batch(group.id, encoded_order)
+            return
+        target_addresses = self.group_addresses(group)
+        for target_address in target_addresses:
+            self.send_datagram(encoded_order, target_address)
+        self.metrics.total_messages_sent += len(target_addresses)
+
+
+    def handle_order(self, order):
+        # every member keeps the stamps to serve them to a new sequencer
+        self.order_rings.setdefault(order.group_id, RetransmitRing()).store(order.priority,
+                                                                            order.encode())
+        holdback = self.sequencer_holdback.setdefault(order.group_id, SequencerHoldback())
+        # the message was delivered already if it has left the FIFO hold-back
+        # queue and is no longer held back
+        delivered = order.serial_no <= self.fifo_holdback.last_delivered.get(
+            (order.sender_id, order.group_id), 0)
+        for message in holdback.add_order(order.priority, order.get_id(), delivered):
+            self.deliver_message(message)
+
+
+    # serve the stamps a member has requested from this client
+    def handle_order_nack(self, request, address):
+        ring = self.order_rings.get(request.group_id)
+        if ring is None or request.sender_id != self.sender_id:
+            return
+        for seq in request.missing:
+            datagram = ring.get(seq)
+            if datagram is not None:
+                self.send_datagram(datagram, address)
+                self.metrics.total_messages_sent += 1
+                self.metrics.increment('orders_served')
 
-    def handle_incoming_message_TOTAL(self, received_msg):
-        # each message received should be in the following form
-        # <message-number> in <group-name> <username> says:: <message-content>
-        message = self.parse_incoming_message(received_msg)
 
-        # for every receiving message, we update our local lamport timestamp
-        self.lamport_timestamp = max(self.lamport_timestamp, message.serial_no) + 1
+    def send_order_nack(self, group, member_id, seqs):
+        address = group.addresses_by_id.get(member_id)
+        if address is None:
+            return
+        request = Message(None, None, None, 0, ORDER_NACK, group.id, member_id)
+        request.missing = seqs
+        self.send_datagram(request.encode(), address)
+        self.metrics.total_messages_sent += 1
+        self.metrics.increment('order_nacks_sent')
 
-        # add the receiving message to buffer until we start delivering messages
-        self.messages_buffer.append(message)
 
+    # a group whose next message has not been delivered since the last check is
+    # missing a stamp, requested from the sequencer, or the message of a stamp,
+    # requested from its sender, and after nack_retries requests it is given up on
+    def check_stalled_SEQUENCER(self):
+        for group_id, holdback in self.sequencer_holdback.items():
+            group = self.groups_by_id.get(group_id)
+            if group is None or not holdback.stalled():
+                self.stalled_orders.pop(group_id, None)
+                continue
+            previous = self.stalled_orders.get(group_id)
+            if previous is None or previous[0] != holdback.next_seq:
+                self.stalled_orders[group_id] = (holdback.next_seq, 0)
+                continue
+            requests = previous[1]
+            if requests >= self.nack_retries and holdback.next_seq <= holdback.highest:
+                self.stalled_orders.pop(group_id)
+                for message in holdback.skip():
+                    self.deliver_message(message)
+                continue
+            self.stalled_orders[group_id] = (holdback.next_seq, requests + 1)
+            msg_id = holdback.orders.get(holdback.next_seq)
+            if msg_id is not None:
+                address = group.addresses_by_id.get(msg_id[1])
+                if address is not None:
+                    nack = Message(None, None, None, 0, NACK, group_id, msg_id[1])
+                    nack.missing = [msg_id[2]]
+                    self.send_datagram(nack.encode(), address)
+                    self.metrics.total_messages_sent += 1
+                    self.metrics.increment('nacks_sent')
+            elif group_id not in self.takeovers:
+                # the stamps of the last messages may have been lost as well, or
+                # the first ones if no message has been delivered yet
+                unstamped = min(len(holdback.messages) - len(holdback.stamps), MAX_NACK_SERIALS)
+                seqs = holdback.missing(MAX_NACK_SERIALS) or range(
+                    holdback.next_seq, holdback.next_seq + unstamped)
+                if holdback.delivered == 0:
+                    seqs += range(max(1, holdback.next_seq - unstamped), holdback.next_seq)
+                self.send_order_nack(group, self.sequencer_of(group), seqs)
+
+
+    def handle_member_departure_SEQUENCER(self, group, member_id, sequencer_id):
+        holdback = self.sequencer_holdback.get(group.id)
+        if holdback is not None:
+            for message in holdback.discard_sender(member_id):
+                self.deliver_message(message)
+        if member_id == sequencer_id and self.sequencer_of(group) == self.sender_id:
+            self.take_over_sequencer(group)
+
+
+    # the sequencer has failed and this client is the oldest member left: the
+    # stamps the failed sequencer sent beyond those this client has received are
+    # requested from every member, then the messages that were not stamped are
+    def take_over_sequencer(self, group):
+        holdback = self.sequencer_holdback.setdefault(group.id, SequencerHoldback())
+        highest = max(holdback.highest, self.order_serials.get(group.id, 0))
+        seqs = holdback.missing(MAX_NACK_SERIALS) + range(highest + 1, highest + 1 + MAX_NACK_SERIALS)
+        for member_id in group.addresses_by_id.keys():
+            if member_id != self.sender_id:
+                self.send_order_nack(group, member_id, seqs)
+        self.takeovers[group.id] = self.loop.call_later(TAKEOVER_DELAY, self.finish_takeover, group.id)
+        self.metrics.increment('sequencer_takeovers')
+
+
+    def finish_takeover(self, group_id):
+        self.takeovers.pop(group_id, None)
+        group = self.groups_by_id.get(group_id)
+        if group is None or self.sequencer_of(group) != self.sender_id:
+            return
+        holdback = self.sequencer_holdback.setdefault(group_id, SequencerHoldback())
+        ring = self.order_rings.get(group_id)
+        self.order_serials[group_id] = max(holdback.highest, self.order_serials.get(group_id, 0),
+                                           ring.last_serial if ring is not None else 0)
+        for message in holdback.unstamped():
+            self.send_order(group, message)
+
+
+    # a dependency still missing since the last check will not arrive, e.g. it
+    # was sent by a member that has left the group or before this client joined
+    # the group, so it is given up on
+    def check_stalled_CAUSAL(self):
+        missing = self.causal_holdback.missing_dependencies()
+        for group_id, member_id, counter in missing & self.stalled_dependencies:
+            for message in self.causal_holdback.give_up(group_id, member_id, counter):
+                self.deliver_message(message)
+        self.stalled_dependencies = missing
+
+
+    # ISIS total ordering: a received message is held back with a proposed
+    # priority that is sent to its sender, the sender agrees on the largest
+    # proposal of the group members and multicasts it as the final priority,
+    # then messages are delivered by ascending final priority. The messages of
+    # each sender are proposed in FIFO order, so a later message of a sender
+    # never gets a lower priority than an earlier one that was lost
+    def handle_incoming_message_TOTAL(self, message, address):
+        for fifo_message in self.push_holdback(self.fifo_holdback, message):
+            self.propose_TOTAL(fifo_message, address)
+
+
+    def propose_TOTAL(self, message, address):
+        holdback = self.total_holdback.setdefault(message.group_id, TotalOrderHoldback())
+        priority = holdback.propose(message, self.sender_id)
+        self.send_proposal(message, priority, address)
+
+
+    # reply to the sender of a message with the proposed priority, the
+    # sender may not be in our view of the group yet if it just joined
+    def send_proposal(self, message, priority, address):
+        proposal = Message(None, message.group_name, message.username, message.serial_no,
+                           PROPOSE, message.group_id, message.sender_id)
+        proposal.priority = priority
+        proposal.proposer_id = self.sender_id
+        self.send_datagram(proposal.encode(), address)
+        self.metrics.total_messages_sent += 1
 
 
-    # parse incoming message to extract important information
-    # in order to implement a message ordering scheme
-    def parse_incoming_message(self, received_msg):
-        # each message received should be in the following form
-        # <message-number> in <group-name> <username> says:: <message-content>
-        tokens = received_msg.split()
-        message_serial = int(tokens[0])
-        group_name = tokens[2]
-        username = tokens[3]
-        message_content = ' '.join(tokens[5:])
-        message = Message(message_content, group_name, username, message_serial)
-        return message
+    # the sender retransmits a message whose proposal it has not received, so
+    # the proposal is sent again if the message is still held back
+    def handle_duplicate_TOTAL(self, message, address):
+        holdback = self.total_holdback.get(message.group_id)
+        if holdback is not None and message.get_id() in holdback.entries:
+            self.send_proposal(message, holdback.propose(message, self.sender_id), address)
+
+
+    # the final priority of a message held back since the last check may have
+    # been lost, so the proposal is sent again to its sender which replies
+    # with the final priority if it has already been agreed
+    def check_stalled_TOTAL(self):
+        for group_id, holdback in self.total_holdback.items():
+            previous = self.stalled_messages.get(group_id, ())
+            waiting = holdback.waiting()
+            for message in waiting:
+                window = self.receive_windows.get((message.sender_id, group_id))
+                if message.get_id() in previous and window is not None:
+                    self.send_proposal(message, holdback.propose(message, self.sender_id), window.address)
+                    self.metrics.increment('final_requests')
+            self.stalled_messages[group_id] = set(message.get_id() for message in waiting)
+
+
+    # collect the priority proposed by a group member for a message sent by
+    # this client and multicast the agreed priority once everyone has proposed
+    def handle_proposal(self, proposal, address):
+        message_id = proposal.get_id()
+        pending = self.pending_proposals.get(message_id)
+        if pending is None:
+            # the priority has been agreed already, but the member
+            # has not received it, so it is sent again
+            final_ring = self.final_rings.get(proposal.group_id)
+            datagram = final_ring.get(proposal.serial_no) if final_ring is not None else None
+            if datagram is not None:
+                self.send_datagram(datagram, address)
+                self.metrics.total_messages_sent += 1
+                self.metrics.increment('finals_served')
+            return
+        if proposal.proposer_id not in pending['waiting']:
+            return
+        pending['waiting'].discard(proposal.proposer_id)
+        pending['agreed'] = max(pending['agreed'], (proposal.priority, proposal.proposer_id))
+        if not pending['waiting']:
+            self.send_final_priority(message_id)
+
+
+    # the proposals of some members did not arrive in time, so the message is
+    # retransmitted to them (proposing again for a message is idempotent) until
+    # they propose or are removed from the group, as agreeing without them
+    # could order the message differently at the members that missed it
+    def proposal_timeout(self, message_id):
+        pending = self.pending_proposals.get(message_id)
+        group = self.groups_by_id.get(message_id[0])
+        if pending is None or group is None:
+            return
+        pending['retries'] += 1
+        if pending['retries'] == PROPOSAL_RETRIES:
+            self.metrics.increment('proposals_overdue')
+        message = Message(pending['content'], group.name, self.member.username, message_id[2],
+                          DATA, group.id, self.sender_id)
+        encoded_message = message.encode()
+        # members sharing an address receive a single copy
+        target_addresses = set(group.addresses_by_id.get(member_id) for member_id in pending['waiting'])
+        target_addresses.discard(None)
+        for target_address in target_addresses:
+            self.send_datagram(encoded_message, target_address)
+        self.metrics.total_messages_sent += len(target_addresses)
+        pending['timer'] = self.loop.call_later(PROPOSAL_TIMEOUT, self.proposal_timeout, message_id)
+
+
+    def send_final_priority(self, message_id):
+        pending = self.pending_proposals.pop(message_id)
+        pending['timer'].cancel()
+        group = self.groups_by_id.get(message_id[0])
+        if group is None:
+            return
+        final = Message(None, group.name, self.member.username, message_id[2],
+                        FINAL, group.id, self.sender_id)
+        final.priority, final.proposer_id = pending['agreed']
+        encoded_final = final.encode()
+        self.final_rings.setdefault(group.id, RetransmitRing()).store(final.serial_no, encoded_final)
+        target_addresses = self.group_addresses(group)
+        for target_address in target_addresses:
+            self.send_datagram(encoded_final, target_address)
+        self.metrics.total_messages_sent += len(target_addresses)
+
+
+    # mark the message as deliverable with its final priority and deliver
+    # every message at the head of the hold-back queue that is deliverable
+    def handle_final_priority(self, final):
+        holdback = self.total_holdback.get(final.group_id)
+        if holdback is None:
+            return
+        for message in holdback.finalize(final.get_id(), final.priority, final.proposer_id):
+            self.deliver_message(message)
+
+
+    # a member left the group, so stop waiting for its proposals and drop its
+    # messages whose priority will never be agreed
+    def handle_member_departure_TOTAL(self, group_id, member_id):
+        for message_id in self.pending_proposals.keys():
+            pending = self.pending_proposals[message_id]
+            if message_id[0] == group_id and member_id in pending['waiting']:
+                pending['waiting'].discard(member_id)
+                # the priority is agreed without the proposal of the departed member
+                if not pending['waiting']:
+                    self.metrics.increment('forced_agreements')
+                    self.send_final_priority(message_id)
+        holdback = self.total_holdback.get(group_id)
+        if holdback is not None:
+            for message in holdback.discard_sender(member_id):
+                self.deliver_message(message)
+
+
+    # deliver the message to the application and record its delivery
+    def deliver_message(self, message):
+        for callback in self.delivery_callbacks:
+            callback(message)
+        # consider each message as it was the last one
+        self.metrics.end_time = time.time()
+        # record the latency of the message only if it was sent from this client
+        if message.sender_id == self.sender_id:
+            self.metrics.message_delivered(message.get_id())
+        else:
+            self.metrics.message_delivered()
 
 
     # print the message to the stdout and prompt the user for next command/message
@@ -382,69 +1619,153 @@ class Client:
         sys.stderr.write('\r%s' % formatted_message)
         # prompt user for next command/message
         sys.stderr.write('\n[%s] > ' % self.member.username)
-        # consider each message as it was the last one
-        self.metrics.end_time = time.time()
 
 
     # send multicast message to selected group
     def send_message(self, message_content):
-        if self.current_group is not None:
+        # the line terminator of the user input is not part of the message
+        try:
+            self.send(message_content.rstrip('\r\n'))
+        except ValueError as e:
+            print e
+
+
+    def send(self, message_content, group_name=None):
+        """
+        Multicast a message to a group of the client
+        :param group_name: the group (the selected one if None)
+        :raises ValueError: if no such group has been joined or selected, or
+                            the message is larger than MAX_MESSAGE_SIZE bytes
+        """
+        if len(message_content) > MAX_MESSAGE_SIZE:
+            raise ValueError('Messages are limited to %d bytes.' % MAX_MESSAGE_SIZE)
+        if group_name is not None:
+            if group_name not in self.group_list:
+                raise ValueError("You don't belong in group '%s'." % group_name)
+            group = self.group_list[group_name]
+        else:
+            group = self.current_group
+        if group is not None:
             # update serial number of messages sent by this client
             self.message_num = self.message_num + 1
-
+            group_name = group.name
+            self.group_serials[group_name] = self.group_serials.get(group_name, 0) + 1
 
             # if it is the first sent message, then store time to calculate
             # performance metrics
             if self.message_num == 1:
                 self.metrics.start_time = time.time()
 
-
-            # send message to all members of the group
-            for member in self.current_group.members_list:
-                target_address = (member.ip, int(member.udp_port))
-
-                if self.mode == 'FIFO':
-                    msg_timestamp = self.message_num
-                elif self.mode == 'TOTAL_ORDER':
-                    msg_timestamp = self.lamport_timestamp
-
-                # assert that every message sent to other clients should match the following form
-                # <message-timestamp> in <group-name> <username> says:: <message-content>
-                formatted_message = " ".join((str(msg_timestamp), "in", self.current_group.name,
-                                              self.member.username, "says::", message_content))
-                # uniquely identify this message by this tuple to calculate metrics for it
-                message_id = (self.current_group.name, self.member.username, msg_timestamp)
-                # evaluate time that this message was sent
-                start_time = time.time()
-                self.udp_socket.sendto(formatted_message, target_address)
-                # add the sending time of the message with specific message ID
-                self.metrics.latency_list[message_id] = [start_time]
-                self.metrics.total_messages_sent += 1
+            # the message is encoded once and the same datagram is sent to the
+            # multicast address of the group or the cached addresses of its members
+            message = Message(message_content, group_name, self.member.username,
+                              self.group_serials[group_name], DATA, group.id, self.sender_id)
+            # the message depends on every message delivered before it is sent
+            if self.mode == 'CAUSAL':
+                message.clock = self.causal_holdback.dependencies(group.id, self.sender_id)
+            encoded_message = message.encode()
+            message_id = message.get_id()
+            # keep the datagram to serve negative acknowledgements of receivers
+            self.retransmit_rings.setdefault(group.id, RetransmitRing()).store(
+                message.serial_no, encoded_message)
+
+            # in total ordering mode, wait for every member of the group to
+            # propose a priority for this message
+            if self.mode == 'TOTAL_ORDER':
+                self.pending_proposals[message_id] = {
+                    'waiting': set(group.addresses_by_id),
+                    'agreed': (0, 0),
+                    'content': message_content,
+                    'retries': 0,
+                    'timer': self.loop.call_later(PROPOSAL_TIMEOUT, self.proposal_timeout, message_id)}
+
+            # add the sending time of the message with specific message ID
+            self.metrics.message_sent(message_id)
+            if self.batch_delay is not None:
+                self.add_to_batch(group.id, encoded_message)
+                return
+            target_addresses = self.group_addresses(group)
+            for target_address in target_addresses:
+                self.send_datagram(encoded_message, target_address)
+            self.metrics.total_messages_sent += len(target_addresses)
         else:
-            print 'No group to send selected. use !w <group name> to choose'
-
-
-    def deliver_messages_TOTAL(self):
-        # sorts the messages by implementing total ordering, we deliver Ti
-        # iff for every j ((Ti < Tj) or (Ti = Tj and username_i < username_j))
-        if self.messages_buffer:
-            self.messages_buffer.sort(key=lambda x: (-x.serial_no, x.username))
-        for msg in reversed(self.messages_buffer):
-            self.print_message(msg)
-            if msg.username == self.member.username:
-                # add the delivering time of the message with specific message ID
-                delivering_time = time.time()
-                # store performance metrics
-                self.metrics.latency_list[msg.get_id()].append(delivering_time)
-            self.metrics.total_messages_received += 1
-        self.messages_buffer = []
-
+            raise ValueError('No group to send selected. use !w <group name> to choose')
+
+
+    # queue an encoded message in the batch of its group, the batch is sent
+    # once it is full or batch_delay seconds after its first message
+    def add_to_batch(self, group_id, encoded_message):
+        batch = self.batches.get(group_id)
+        if batch is not None and batch['size'] + len(encoded_message) > self.batch_max_bytes:
+            self.flush_batch(group_id)
+            batch = None
+        if batch is None:
+            batch = self.batches[group_id] = {
+                'datagrams': [],
+                'size': HEADER_SIZE,
+                'timer': self.loop.call_later(self.batch_delay, self.flush_batch, group_id)}
+        batch['datagrams'].append(encoded_message)
+        batch['size'] += len(encoded_message)
+        if len(batch['datagrams']) >= self.batch_max_messages or batch['size'] >= self.batch_max_bytes:
+            self.flush_batch(group_id)
+
+
+    # send the messages queued for a group, a single message is sent as is
+    def flush_batch(self, group_id):
+        batch = self.batches.pop(group_id, None)
+        group = self.groups_by_id.get(group_id)
+        if batch is None or group is None:
+            return
+        batch['timer'].cancel()
+        datagrams = batch['datagrams']
+        if len(datagrams) == 1:
+            datagram = datagrams[0]
+        else:
+            datagram = Message.encode_batch(group_id, self.sender_id, datagrams)
+        self.metrics.increment('batched_messages', len(datagrams))
+        self.metrics.increment('batches_sent')
+        target_addresses = self.group_addresses(group)
+        for target_address in target_addresses:
+            self.send_datagram(datagram, target_address)
+        self.metrics.total_messages_sent += len(target_addresses)
+
+
+    # gather the statistics of the client's components into its metrics, the
+    # drops of the UDP sockets are looked up in udp_table if given, as returned
+    # by read_udp_table()
+    def collect_metrics(self, udp_table=None):
+        if self.mode == 'CAUSAL':
+            self.metrics.counters.update(self.causal_holdback.stats())
+        else:
+            self.metrics.counters.update(self.fifo_holdback.stats())
+        self.metrics.counters.update(self.reassembler.stats())
+        if self.total_holdback:
+            self.metrics.counters['isis_max_depth'] = max(
+                holdback.max_depth for holdback in self.total_holdback.values())
+        if self.sequencer_holdback:
+            self.metrics.counters['sequencer_max_depth'] = max(
+                holdback.max_depth for holdback in self.sequencer_holdback.values())
+            self.metrics.counters['sequencer_skipped'] = sum(
+                holdback.skipped for holdback in self.sequencer_holdback.values())
+        # datagrams lost because they arrived faster than the client read them
+        # (those of a shared socket are left to the runtime reading it)
+        sockets = self.multicast_sockets.values()
+        if self.owns_udp_socket:
+            sockets.append(self.udp_socket)
+        drops = read_udp_drops(sockets, udp_table)
+        if drops is not None:
+            self.metrics.counters['udp_kernel_drops'] = self.closed_socket_drops + drops
+        self.metrics.counters['udp_rcvbuf'] = self.udp_socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.metrics.counters['udp_sndbuf'] = self.udp_socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
 
 
     # decode user's input and forward to responsible function
     def decode_and_forward(self, message_content):
 
-        if re.match('\s*!lg\s*', message_content):
+        # commands for the tracker wait until it is reachable again
+        if self.control.closed and re.match('\s*!(lg|lm|j|e)\s', message_content + ' '):
+            self.print_reply('tracker unreachable, reconnecting ...')
+        elif re.match('\s*!lg\s*', message_content):
             self.list_groups(message_content)
         elif re.match('\s*!lm\s+[\w\d_-]+$\s*', message_content):
             self.list_members(message_content)
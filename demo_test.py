@@ -7,6 +7,8 @@ from client import Client
 SERVER_HOSTNAME = 'distrib-1'
 SERVER_PORT = 50000
 MODE = 'TOTAL_ORDER'
+# seconds messages replayed from the input file are batched for (None disables batching)
+BATCH_DELAY = 0.005
 
 
 # generate random port from 10000-50000
@@ -24,7 +26,7 @@ def main():
     # find tracker ip based on its hostname
     tracker_ip = socket.gethostbyname(SERVER_HOSTNAME)
 
-    client = Client(client_ip, port, MODE)
+    client = Client(client_ip, port, MODE, batch_delay=BATCH_DELAY)
     if len(sys.argv) == 2:
         input_file = sys.argv[1]
         input_fd = open(input_file, 'r')
@@ -0,0 +1,190 @@
+import errno
+import heapq
+import itertools
+import select
+import time
+
+# event masks shared by epoll and poll
+if hasattr(select, 'epoll'):
+    READ_EVENTS = select.EPOLLIN | select.EPOLLPRI | select.EPOLLHUP | select.EPOLLERR
+    WRITE_EVENTS = select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR
+else:
+    READ_EVENTS = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+    WRITE_EVENTS = select.POLLOUT | select.POLLHUP | select.POLLERR
+
+
+class Timer:
+
+    def __init__(self, deadline, interval, callback, args):
+        self.deadline = deadline
+        # repeat period of the timer in seconds (None for one-shot timers)
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    # prevent the timer from firing (again)
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    Single-threaded event loop multiplexing file descriptors with epoll (or
+    poll where epoll is not available) and running timers. The loop blocks
+    until a descriptor is ready or the earliest timer is due, so an idle
+    process does not consume any CPU.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            # epoll expects its timeout in seconds
+            self.timeout_scale = 1.0
+        else:
+            self.poller = select.poll()
+            # poll expects its timeout in milliseconds
+            self.timeout_scale = 1000.0
+        # dictionary with key = <fd> and value = [<file object>, <read handler>,
+        # <write handler>] where each handler is a (callback, args) tuple or None
+        self.handlers = {}
+        # descriptors that cannot be polled (e.g. regular files) and are
+        # therefore always considered ready for reading
+        self.always_ready = set()
+        # heap of (deadline, sequence number, timer) tuples
+        self.timers = []
+        self.sequence = itertools.count()
+        self.running = False
+
+    def add_reader(self, fileobj, callback, *args):
+        self.update_handler(fileobj, 1, (callback, args))
+
+    def remove_reader(self, fileobj):
+        self.update_handler(fileobj, 1, None)
+
+    def add_writer(self, fileobj, callback, *args):
+        self.update_handler(fileobj, 2, (callback, args))
+
+    def remove_writer(self, fileobj):
+        self.update_handler(fileobj, 2, None)
+
+    def update_handler(self, fileobj, index, handler):
+        fd = fileobj if isinstance(fileobj, (int, long)) else fileobj.fileno()
+        entry = self.handlers.get(fd)
+        if entry is None:
+            if handler is None:
+                return
+            entry = self.handlers[fd] = [fileobj, None, None]
+            registered = False
+        else:
+            registered = fd not in self.always_ready
+        entry[index] = handler
+
+        mask = 0
+        if entry[1] is not None:
+            mask |= READ_EVENTS
+        if entry[2] is not None:
+            mask |= WRITE_EVENTS
+
+        if mask == 0:
+            del self.handlers[fd]
+            if fd in self.always_ready:
+                self.always_ready.discard(fd)
+            elif registered:
+                self.poller.unregister(fd)
+        elif fd in self.always_ready:
+            pass
+        elif registered:
+            self.poller.modify(fd, mask)
+        else:
+            try:
+                self.poller.register(fd, mask)
+            except (IOError, OSError) as e:
+                # regular files cannot be polled but never block on reading
+                if e.errno != errno.EPERM:
+                    raise
+                self.always_ready.add(fd)
+
+    def call_later(self, delay, callback, *args):
+        """
+        Schedule callback(*args) to run once after delay seconds and
+        return a Timer that can be cancelled.
+        """
+        timer = Timer(time.time() + delay, None, callback, args)
+        heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """
+        Schedule callback(*args) to run every interval seconds and
+        return a Timer that can be cancelled.
+        """
+        timer = Timer(time.time() + interval, interval, callback, args)
+        heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+        return timer
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        self.running = False
+
+    def run_once(self, timeout=None):
+        """
+        Wait for ready descriptors or due timers (at most timeout seconds if
+        given) and dispatch their callbacks.
+        """
+        # drop cancelled timers so they do not shorten the wait
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+
+        if self.always_ready:
+            wait = 0
+        elif self.timers:
+            wait = max(0.0, self.timers[0][0] - time.time())
+            if timeout is not None:
+                wait = min(wait, timeout)
+        else:
+            wait = timeout
+
+        if wait is None:
+            poll_timeout = -1 if self.timeout_scale == 1.0 else None
+        else:
+            poll_timeout = wait * self.timeout_scale
+
+        try:
+            events = self.poller.poll(poll_timeout)
+        except (IOError, OSError, select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+
+        for fd in list(self.always_ready):
+            events.append((fd, READ_EVENTS))
+
+        for fd, mask in events:
+            # read handlers run first and may unregister the descriptor
+            entry = self.handlers.get(fd)
+            if entry is not None and entry[1] is not None and mask & READ_EVENTS:
+                callback, args = entry[1]
+                callback(*args)
+            entry = self.handlers.get(fd)
+            if entry is not None and entry[2] is not None and mask & WRITE_EVENTS:
+                callback, args = entry[2]
+                callback(*args)
+
+        self.run_timers()
+
+    def run_timers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, sequence, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                # schedule the next run relative to the deadline to avoid drift
+                timer.deadline = max(deadline + timer.interval, now)
+                heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+            timer.callback(*timer.args)
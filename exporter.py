@@ -0,0 +1,105 @@
+import errno
+import socket
+
+# largest HTTP request accepted, scrape requests are a few hundred bytes
+MAX_REQUEST_SIZE = 8192
+# content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class HttpConnection:
+    """
+    Non-blocking connection of a scraper, it reads a single request and
+    closes once the response has been written.
+    """
+
+    def __init__(self, sock, loop, handle_request):
+        self.socket = sock
+        self.socket.setblocking(0)
+        self.loop = loop
+        self.handle_request = handle_request
+        self.in_buffer = bytearray()
+        self.out_buffer = bytearray()
+        self.loop.add_reader(self.socket, self.handle_read)
+
+    def handle_read(self):
+        try:
+            data = self.socket.recv(MAX_REQUEST_SIZE)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data or len(self.in_buffer) + len(data) > MAX_REQUEST_SIZE:
+            self.close()
+            return
+        self.in_buffer += data
+        if '\r\n\r\n' not in self.in_buffer and '\n\n' not in self.in_buffer:
+            return
+        self.loop.remove_reader(self.socket)
+        request_line = str(self.in_buffer).split('\n', 1)[0].split()
+        self.out_buffer += self.handle_request(*request_line[:2])
+        self.loop.add_writer(self.socket, self.handle_write)
+
+    def handle_write(self):
+        try:
+            sent = self.socket.send(self.out_buffer)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            sent = len(self.out_buffer)
+        del self.out_buffer[:sent]
+        if not self.out_buffer:
+            self.close()
+
+    def close(self):
+        self.loop.remove_reader(self.socket)
+        self.loop.remove_writer(self.socket)
+        self.socket.close()
+
+
+class MetricsExporter:
+    """
+    Minimal HTTP server running on the tracker's event loop that exposes the
+    merged metrics of the cluster to scrapers: GET /metrics returns them in
+    the Prometheus text format and GET /metrics.json as a JSON document.
+    """
+
+    def __init__(self, loop, host, port, render_prometheus, render_json):
+        self.loop = loop
+        self.render_prometheus = render_prometheus
+        self.render_json = render_json
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.setblocking(0)
+        self.socket.bind((host, port))
+        self.socket.listen(16)
+        self.loop.add_reader(self.socket, self.accept)
+
+    def accept(self):
+        try:
+            sock, addr = self.socket.accept()
+        except socket.error:
+            return
+        HttpConnection(sock, self.loop, self.handle_request)
+
+    # return the HTTP response to a request
+    def handle_request(self, method=None, path=None):
+        if method != 'GET':
+            return self.response('405 Method Not Allowed', 'text/plain', 'method not allowed\n')
+        if path == '/metrics':
+            return self.response('200 OK', PROMETHEUS_CONTENT_TYPE, self.render_prometheus())
+        if path == '/metrics.json':
+            return self.response('200 OK', 'application/json', self.render_json())
+        return self.response('404 Not Found', 'text/plain', 'not found\n')
+
+    @staticmethod
+    def response(status, content_type, body):
+        # names in the snapshots decoded from JSON are unicode
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        return ('HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s'
+                % (status, content_type, len(body), body))
+
+    def close(self):
+        self.loop.remove_reader(self.socket)
+        self.socket.close()
@@ -0,0 +1,128 @@
+import math
+import time
+from collections import deque
+
+# seconds between two consecutive heartbeats of a client
+HEARTBEAT_INTERVAL = 1.0
+# suspicion level above which a member is considered failed
+PHI_THRESHOLD = 8.0
+# number of heartbeat inter-arrival times kept for each member
+WINDOW_SIZE = 100
+# lower bound of the standard deviation of inter-arrival times in seconds,
+# prevents very regular heartbeats from making the detector hair-triggered
+MIN_STD_DEVIATION = 0.1
+# seconds of missing heartbeats tolerated on top of the mean inter-arrival
+# time, absorbs busy clients and short network hiccups without flapping
+ACCEPTABLE_PAUSE = 3.0
+
+
+class MemberLiveness:
+
+    def __init__(self, now, expected_interval):
+        self.first_heartbeat = now
+        self.last_heartbeat = now
+        self.heartbeats = 1
+        # inter-arrival times of the most recent heartbeats, seeded with the
+        # expected interval so that a fresh member is not suspected at once
+        self.intervals = deque([expected_interval, expected_interval], WINDOW_SIZE)
+        self.interval_sum = 2 * expected_interval
+        self.interval_squares = 2 * expected_interval ** 2
+
+    def add_interval(self, interval):
+        if len(self.intervals) == self.intervals.maxlen:
+            oldest = self.intervals[0]
+            self.interval_sum -= oldest
+            self.interval_squares -= oldest ** 2
+        self.intervals.append(interval)
+        self.interval_sum += interval
+        self.interval_squares += interval ** 2
+
+    def mean(self):
+        return self.interval_sum / len(self.intervals)
+
+    def std_deviation(self):
+        mean = self.mean()
+        variance = max(0.0, self.interval_squares / len(self.intervals) - mean ** 2)
+        return max(math.sqrt(variance), MIN_STD_DEVIATION)
+
+
+class PhiAccrualFailureDetector:
+    """
+    Phi accrual failure detector (Hayashibara et al.). Instead of a binary
+    timeout it outputs a suspicion level phi for every member, derived from
+    the distribution of the member's recent heartbeat inter-arrival times, so
+    members with jittery links are given more slack than members whose
+    heartbeats are regular. A member is suspected once phi exceeds a threshold.
+    """
+
+    def __init__(self, threshold=PHI_THRESHOLD, expected_interval=HEARTBEAT_INTERVAL,
+                 acceptable_pause=ACCEPTABLE_PAUSE):
+        self.threshold = threshold
+        self.expected_interval = expected_interval
+        self.acceptable_pause = acceptable_pause
+        # dictionary with key = <member-id> and value = <MemberLiveness>
+        self.members = {}
+
+    def heartbeat(self, member_id, now=None):
+        if now is None:
+            now = time.time()
+        liveness = self.members.get(member_id)
+        if liveness is None or liveness.heartbeats == 0:
+            self.members[member_id] = MemberLiveness(now, self.expected_interval)
+            return
+        liveness.add_interval(now - liveness.last_heartbeat)
+        liveness.last_heartbeat = now
+        liveness.heartbeats += 1
+
+    def restore(self, member_id, grace_period, now=None):
+        """
+        Track a member restored from a previous run of the tracker that has not
+        reconnected yet. It is not suspected for grace_period seconds and its
+        first heartbeat starts its history afresh.
+        """
+        if now is None:
+            now = time.time()
+        liveness = MemberLiveness(now + grace_period, self.expected_interval)
+        liveness.heartbeats = 0
+        self.members[member_id] = liveness
+
+    def remove(self, member_id):
+        self.members.pop(member_id, None)
+
+    def phi(self, member_id, now=None):
+        if now is None:
+            now = time.time()
+        liveness = self.members.get(member_id)
+        if liveness is None:
+            return 0.0
+        elapsed = now - liveness.last_heartbeat
+        mean = liveness.mean() + self.acceptable_pause
+        y = (elapsed - mean) / liveness.std_deviation()
+        # phi is already far beyond any sensible threshold at the bounds,
+        # clamping keeps the exponential within floating point range
+        y = max(-15.0, min(15.0, y))
+        # logistic approximation of the cumulative normal distribution
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def suspects(self, now=None):
+        """
+        Return the IDs of the members whose suspicion level exceeds the threshold.
+        """
+        if now is None:
+            now = time.time()
+        return [member_id for member_id in self.members
+                if self.phi(member_id, now) > self.threshold]
+
+    def stats(self, member_id, now=None):
+        if now is None:
+            now = time.time()
+        liveness = self.members[member_id]
+        return {'heartbeats': liveness.heartbeats,
+                'uptime': now - liveness.first_heartbeat,
+                'last_heartbeat': now - liveness.last_heartbeat,
+                'mean_interval': liveness.mean(),
+                'std_deviation': liveness.std_deviation(),
+                'phi': self.phi(member_id, now)}
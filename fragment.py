@@ -0,0 +1,141 @@
+import struct
+import time
+from collections import OrderedDict
+
+from message import WIRE_VERSION, FRAGMENT, HEADER, HEADER_SIZE, unpack_header
+
+# largest datagram sent as is, the largest UDP payload over IPv4, larger ones
+# are split into FRAGMENT datagrams (a size fitting in an Ethernet frame avoids
+# IP fragmentation on networks dropping IP fragments, for more datagrams)
+MAX_DATAGRAM_SIZE = 65507
+# largest message a client sends or reassembles in bytes
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+# seconds the fragments of a message may take to arrive, a message missing
+# fragments by then is dropped and recovered like a lost datagram
+REASSEMBLY_TIMEOUT = 2.0
+# largest number of bytes reserved for the messages being reassembled
+MAX_REASSEMBLY_BYTES = 16 * 1024 * 1024
+# payload prefix of a FRAGMENT datagram: the offset of its chunk in the
+# message and the length of the whole message
+FRAGMENT_HEADER = struct.Struct('!II')
+
+
+def split_datagram(datagram, sender_id, fragment_id, max_size=MAX_DATAGRAM_SIZE):
+    """
+    Split an encoded message into FRAGMENT datagrams of at most max_size bytes,
+    each carrying the group ID and type of the message (as its flags), the
+    sender's ID and a fragment ID, so receivers reassemble it into the original
+    bytes. The fragments of a message are identified by these four fields:
+    copies of a message fragmented with the same ID (e.g. the serial number of
+    a retransmitted DATA message) fill in each other's missing fragments.
+    The fragments are yielded one at a time from a single buffer.
+    """
+    msg_type, group_id = unpack_header(datagram)[1:4:2]
+    chunk_size = max_size - HEADER_SIZE - FRAGMENT_HEADER.size
+    total = len(datagram)
+    view = memoryview(datagram)
+    buffer = bytearray(max_size)
+    buffer_view = memoryview(buffer)
+    start = HEADER_SIZE + FRAGMENT_HEADER.size
+    for offset in xrange(0, total, chunk_size):
+        chunk = view[offset:offset + chunk_size]
+        HEADER.pack_into(buffer, 0, WIRE_VERSION, FRAGMENT, msg_type, group_id, sender_id,
+                         fragment_id, FRAGMENT_HEADER.size + len(chunk))
+        FRAGMENT_HEADER.pack_into(buffer, HEADER_SIZE, offset, total)
+        buffer_view[start:start + len(chunk)] = chunk
+        yield buffer_view[:start + len(chunk)]
+
+
+class Reassembler:
+    """
+    Reassembles the messages split into FRAGMENT datagrams. The chunks of a
+    message are copied into a buffer of its length, allocated when its first
+    fragment arrives, and the message is returned as a view of that buffer
+    once every byte has arrived. A message none of whose fragments has arrived
+    for timeout seconds is dropped, as are the least recently updated
+    messages when the buffers would exceed max_bytes in total.
+    """
+
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT, max_message_size=MAX_MESSAGE_SIZE,
+                 max_bytes=MAX_REASSEMBLY_BYTES):
+        self.timeout = timeout
+        self.max_message_size = min(max_message_size, max_bytes)
+        self.max_bytes = max_bytes
+        # incomplete messages in the order their last fragment arrived with key =
+        # <(sender-id, group-id, message type, fragment-id)> and value = [buffer,
+        # view of the buffer, offsets received, bytes received, deadline]
+        self.partial = OrderedDict()
+        # bytes of the buffers of the incomplete messages
+        self.bytes = 0
+        self.reassembled = 0
+        self.expired = 0
+        self.evicted = 0
+        self.oversized = 0
+
+    def add(self, datagram):
+        """
+        Add a FRAGMENT datagram (a memoryview) and return a view of the message
+        it completes or None if fragments of that message are still missing.
+
+        :raises ValueError: if the fragment is truncated or inconsistent
+        """
+        now = time.time()
+        self.expire(now)
+        try:
+            msg_type, group_id, sender_id, fragment_id, length = unpack_header(datagram)[2:7]
+            offset, total = FRAGMENT_HEADER.unpack_from(datagram, HEADER_SIZE)
+        except struct.error:
+            raise ValueError('truncated fragment header')
+        end = HEADER_SIZE + length
+        if len(datagram) < end or length < FRAGMENT_HEADER.size:
+            raise ValueError('truncated fragment')
+        chunk = datagram[HEADER_SIZE + FRAGMENT_HEADER.size:end]
+        if offset + len(chunk) > total:
+            raise ValueError('fragment beyond the end of its message')
+        key = (sender_id, group_id, msg_type, fragment_id)
+        entry = self.partial.get(key)
+        if entry is None:
+            if total > self.max_message_size:
+                self.oversized += 1
+                return None
+            while self.bytes + total > self.max_bytes:
+                self.drop(next(iter(self.partial)))
+                self.evicted += 1
+            buffer = bytearray(total)
+            entry = self.partial[key] = [buffer, memoryview(buffer), set(), 0, now + self.timeout]
+            self.bytes += total
+        elif len(entry[0]) != total:
+            raise ValueError('fragments disagree on the length of their message')
+        else:
+            entry[4] = now + self.timeout
+            self.partial[key] = self.partial.pop(key)
+        if offset in entry[2]:
+            return None
+        entry[2].add(offset)
+        entry[1][offset:offset + len(chunk)] = chunk
+        entry[3] += len(chunk)
+        if entry[3] < total:
+            return None
+        self.drop(key)
+        self.reassembled += 1
+        return entry[1]
+
+    # the incomplete messages are kept in the order of their last fragment, so
+    # the expired ones are at the front
+    def expire(self, now):
+        while self.partial:
+            key, entry = next(self.partial.iteritems())
+            if entry[4] > now:
+                break
+            self.drop(key)
+            self.expired += 1
+
+    def drop(self, key):
+        entry = self.partial.pop(key)
+        self.bytes -= len(entry[0])
+
+    def stats(self):
+        return {'fragments_reassembled': self.reassembled,
+                'fragments_expired': self.expired,
+                'fragments_evicted': self.evicted,
+                'fragments_oversized': self.oversized}
@@ -1,55 +1,98 @@
 
 
+import random
+import zlib
+from collections import OrderedDict
+
+
 class Group:
 
     def __init__(self, group_name):
         self.name = group_name
-        self.members_list = []
+        # ID identifying the group in messages instead of its name
+        self.id = self.generate_group_id(group_name)
+        # members in the order they joined with key = <member-id>, and
+        # the ID of every member with key = <username>, so that members are
+        # added, removed and looked up without scanning the group
+        self.members = OrderedDict()
+        self.member_names = {}
+        # UDP address of every member with key = <numeric member-id>, the
+        # list of addresses messages are sent to is rebuilt lazily once the
+        # membership changed (None until then)
+        self.addresses_by_id = {}
+        self.addresses = None
+        # multicast address and port assigned to the group by the tracker,
+        # members may send a message as a single datagram to it
+        self.multicast_addr = None
+        self.multicast_port = None
+
+    # derive the group ID from its name, so that every client
+    # agrees on it without asking the tracker
+    @staticmethod
+    def generate_group_id(group_name):
+        return zlib.crc32(group_name) & 0xffffffff
+
+    # index of the shard of a sharded tracker that owns a group, derived from
+    # its name so that the tracker and its clients agree on it
+    @staticmethod
+    def shard_of(group_name, shards):
+        return zlib.crc32(group_name) % shards
 
     # add a specific member to the group
     def add_member(self, member):
-        if member not in self.members_list:
-            self.members_list.append(member)
+        if member.id not in self.members:
+            self.members[member.id] = member
+            self.member_names[member.username] = member.id
+            self.addresses_by_id[int(member.id)] = (member.ip, int(member.udp_port))
+            self.addresses = None
 
     # remove a member from the group
     def remove_member(self, member):
-        if member in self.members_list:
-            self.members_list.remove(member)
+        self.remove_member_by_id(member.id)
 
     # remove a member given its username
     def remove_member_by_name(self, username):
-        for member in self.members_list:
-            if member.username == username:
-                self.members_list.remove(member)
+        member_id = self.member_names.get(username)
+        if member_id is not None:
+            self.remove_member_by_id(member_id)
+
+    # remove a member given its ID, returns the removed member (None if
+    # it was not a member of the group)
+    def remove_member_by_id(self, member_id):
+        member = self.members.pop(member_id, None)
+        if member is not None:
+            del self.member_names[member.username]
+            del self.addresses_by_id[int(member_id)]
+            self.addresses = None
+        return member
+
+    def has_member(self, member_id):
+        return member_id in self.members
 
     # returns the ID of a specific member of the group (given its username)
     def find_member_id(self, username):
-        for member in self.members_list:
-            if member.username == username:
-                return member.id
+        return self.member_names.get(username)
+
+    # the distinct UDP addresses of the members of the group, members hosted
+    # in one process may share an address and receive a single copy
+    def get_addresses(self):
+        if self.addresses is None:
+            self.addresses = list(set(self.addresses_by_id.values()))
+        return self.addresses
 
     # list all the active members of the group
     def list_members(self):
-        if not self.members_list:
-            return ""
-        else:
-            users = ", ".join(["(%s)" % member.username for member in self.members_list])
-            return users
-
-    '''    
-    # optional multicast implementation
-    
-    # auto-generate a random multicast address from the range
-    # 224.0.0.0 - 224.255.255.255
+        return ", ".join(["(%s)" % member.username for member in self.members.itervalues()])
+
+    # auto-generate a random multicast address from the administratively
+    # scoped range 239.0.0.0 - 239.255.255.255 that is not routed beyond
+    # the local network
     @staticmethod
     def generate_multicast_addr():
-        multicast = '224.'.join(str(random.randint(0, 255)) for _ in range(3))
-        return multicast
+        return '239.' + '.'.join(str(random.randint(0, 255)) for _ in range(3))
 
     # auto-generate a random port (port 10000 - 50000) that all
     # peers on the specific multicast group will be listening on
     @staticmethod
     def generate_multicast_port():
-        port = random.randint(10000, 50000)
-        return port
-    '''
\ No newline at end of file
+        return random.randint(10000, 50000)
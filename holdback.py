@@ -0,0 +1,543 @@
+import heapq
+
+# default number of out-of-order messages a hold-back queue may keep
+DEFAULT_CAPACITY = 4096
+
+
+class FifoHoldback:
+    """
+    Hold-back queue delivering messages in FIFO order per (sender, group)
+    stream. Out-of-order messages are indexed by their serial number so that the
+    next expected message of a stream is found in O(1) and a whole run of
+    consecutive messages is drained in a single pass.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        # maximum number of messages buffered over all streams
+        self.capacity = capacity
+        # dictionary with key = <(sender-id, group-id)> and
+        # value = <serial number of the last delivered message>
+        self.last_delivered = {}
+        # dictionary with key = <(sender-id, group-id)> and value = dictionary
+        # of buffered messages of that stream keyed by their serial number
+        self.pending = {}
+        # number of messages currently buffered
+        self.depth = 0
+        # highest number of messages ever buffered at the same time
+        self.max_depth = 0
+        # number of messages rejected because the queue was full
+        self.overflows = 0
+        # number of messages rejected because they were already delivered
+        self.duplicates = 0
+
+    def push(self, message):
+        """
+        Insert a received message and return the list of messages that can
+        be delivered in FIFO order as a consequence (possibly empty).
+
+        :param message: the received Message
+        """
+        stream = (message.sender_id, message.group_id)
+        expected = self.last_delivered.get(stream, 0) + 1
+
+        # message already delivered (or a duplicate of a buffered one)
+        if message.serial_no < expected:
+            self.duplicates += 1
+            return []
+
+        # message arrived ahead of its predecessors, so it is held back
+        if message.serial_no > expected:
+            waiting = self.pending.get(stream)
+            if waiting is not None and message.serial_no in waiting:
+                self.duplicates += 1
+            elif self.depth >= self.capacity:
+                self.overflows += 1
+            else:
+                if waiting is None:
+                    waiting = self.pending[stream] = {}
+                waiting[message.serial_no] = message
+                self.depth += 1
+                self.max_depth = max(self.max_depth, self.depth)
+            return []
+
+        # the expected message arrived, so deliver it along with every
+        # consecutive message that was waiting for it
+        return self.drain(stream, expected, [message])
+
+    def start(self, sender_id, group_id, serial_no):
+        """
+        Start delivering the messages of a stream at the given serial number,
+        the earlier ones were sent before this client joined the group.
+        """
+        self.last_delivered[(sender_id, group_id)] = serial_no - 1
+
+    def skip(self, sender_id, group_id, serial_no):
+        """
+        Give up on the next expected message of a stream that was lost for
+        good and return the messages that were waiting for it.
+        """
+        stream = (sender_id, group_id)
+        if serial_no != self.last_delivered.get(stream, 0) + 1:
+            return []
+        return self.drain(stream, serial_no, [])
+
+    def remove_stream(self, sender_id, group_id):
+        """
+        Forget the stream of a sender that has left the group: its buffered
+        messages are dropped, and a sender rejoining under the same ID starts a
+        new stream.
+        """
+        stream = (sender_id, group_id)
+        self.last_delivered.pop(stream, None)
+        self.depth -= len(self.pending.pop(stream, {}))
+
+    # forget the streams of a group this client has left
+    def remove_group(self, group_id):
+        for stream in [stream for stream in self.last_delivered if stream[1] == group_id]:
+            del self.last_delivered[stream]
+        for stream in [stream for stream in self.pending if stream[1] == group_id]:
+            self.depth -= len(self.pending.pop(stream))
+
+    # deliver the run of buffered messages that follows serial number last
+    def drain(self, stream, last, deliverable):
+        waiting = self.pending.get(stream)
+        if waiting:
+            next_serial = last + 1
+            while next_serial in waiting:
+                deliverable.append(waiting.pop(next_serial))
+                next_serial += 1
+            self.depth -= next_serial - last - 1
+            last = next_serial - 1
+            if not waiting:
+                del self.pending[stream]
+        self.last_delivered[stream] = last
+        return deliverable
+
+    def stats(self):
+        return {'holdback_depth': self.depth,
+                'holdback_max_depth': self.max_depth,
+                'holdback_overflows': self.overflows,
+                'holdback_duplicates': self.duplicates}
+
+
+class CausalHoldback:
+    """
+    Hold-back queue delivering messages in causal order with a vector clock per
+    group, which counts the messages delivered from each member. A message
+    depends on the previous message of its sender and on the clock entries it
+    carries, which are the entries of its sender's clock that changed since the
+    sender's previous message in the group (the earlier ones are dependencies
+    of that message already). Held back messages are indexed by each missing
+    dependency, so a delivery only visits the messages that were waiting for it.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        # maximum number of messages held back over all groups
+        self.capacity = capacity
+        # vector clock of every group with key = <group-id> and value =
+        # dictionary with key = <member-id> and value = <messages delivered>
+        self.clocks = {}
+        # members whose entry of the clock of a group changed since this client
+        # last sent a message to it with key = <group-id>
+        self.changed = {}
+        # held back entries [message, number of missing dependencies] with key =
+        # <(group-id, member-id)> and value = dictionary of the entries waiting
+        # for each counter of that member with key = <counter>
+        self.waiting = {}
+        # the same entries with key = <message-id>
+        self.held = {}
+        # highest number of messages ever held back at the same time
+        self.max_depth = 0
+        # number of messages rejected because the queue was full
+        self.overflows = 0
+        # number of messages rejected because they were already delivered
+        self.duplicates = 0
+        # number of dependencies given up on because they never arrived
+        self.skipped = 0
+
+    def dependencies(self, group_id, sender_id):
+        """
+        Return the clock entries a message sent to a group now carries, as
+        (member ID, counter) pairs, the entry of the sender being implied by
+        the serial number of the message.
+        """
+        changed = self.changed.pop(group_id, None)
+        if not changed:
+            return []
+        clock = self.clocks[group_id]
+        return [(member_id, clock[member_id]) for member_id in changed
+                if member_id != sender_id and member_id in clock]
+
+    def push(self, message):
+        """
+        Insert a received message and return the list of messages that can
+        be delivered in causal order as a consequence (possibly empty).
+
+        :param message: the received Message, whose clock is a list of pairs
+        """
+        clock = self.clocks.setdefault(message.group_id, {})
+        msg_id = message.get_id()
+        if message.serial_no <= clock.get(message.sender_id, 0) or msg_id in self.held:
+            self.duplicates += 1
+            return []
+        missing = []
+        if message.serial_no > clock.get(message.sender_id, 0) + 1:
+            missing.append((message.sender_id, message.serial_no - 1))
+        for member_id, counter in message.clock or ():
+            if counter > clock.get(member_id, 0):
+                missing.append((member_id, counter))
+        if not missing:
+            return self.drain([message])
+        if len(self.held) >= self.capacity:
+            self.overflows += 1
+            return []
+        entry = [message, len(missing)]
+        self.held[msg_id] = entry
+        for member_id, counter in missing:
+            self.waiting.setdefault((message.group_id, member_id), {}) \
+                .setdefault(counter, []).append(entry)
+        self.max_depth = max(self.max_depth, len(self.held))
+        return []
+
+    def start(self, sender_id, group_id, serial_no):
+        """
+        Start delivering the messages of a stream at the given serial number,
+        the earlier ones were sent before this client joined the group, and
+        return the messages that were waiting for them.
+        """
+        return self.drain(self.advance(group_id, sender_id, serial_no - 1))
+
+    def skip(self, sender_id, group_id, serial_no):
+        """
+        Give up on the next expected message of a stream that was lost for
+        good and return the messages that were waiting for it.
+        """
+        if (serial_no != self.clocks.get(group_id, {}).get(sender_id, 0) + 1 or
+                (group_id, sender_id, serial_no) in self.held):
+            return []
+        self.skipped += 1
+        return self.drain(self.advance(group_id, sender_id, serial_no))
+
+    def give_up(self, group_id, member_id, counter):
+        """
+        Give up on the messages of a member up to counter that have not been
+        received, e.g. a dependency on a message of a member that has left,
+        and return the messages that became deliverable.
+        """
+        deliverable = []
+        clock = self.clocks.get(group_id, {})
+        while clock.get(member_id, 0) < counter:
+            next_serial = clock.get(member_id, 0) + 1
+            # a received message is delivered once its own dependencies are
+            if (group_id, member_id, next_serial) in self.held:
+                break
+            self.skipped += 1
+            deliverable.extend(self.drain(self.advance(group_id, member_id, next_serial)))
+        return deliverable
+
+    # the (group-id, member-id, counter) dependencies held back messages wait for
+    def missing_dependencies(self):
+        return set((key[0], key[1], counter)
+                   for key, counters in self.waiting.iteritems() for counter in counters)
+
+    def remove_member(self, group_id, member_id):
+        """
+        Compact the clock of a group once a member has left it: the messages of
+        the member that are still held back are dropped and the messages waiting
+        for the member's messages no longer wait for them. Returns the messages
+        that became deliverable.
+        """
+        for msg_id in [msg_id for msg_id in self.held if msg_id[:2] == (group_id, member_id)]:
+            self.release(self.held.pop(msg_id))
+        ready = []
+        for entries in self.waiting.pop((group_id, member_id), {}).itervalues():
+            self.satisfy(entries, ready)
+        self.clocks.get(group_id, {}).pop(member_id, None)
+        self.changed.get(group_id, set()).discard(member_id)
+        return self.drain(ready)
+
+    # forget a group this client has left
+    def remove_group(self, group_id):
+        self.clocks.pop(group_id, None)
+        self.changed.pop(group_id, None)
+        for key in [key for key in self.waiting if key[0] == group_id]:
+            del self.waiting[key]
+        for msg_id in [msg_id for msg_id in self.held if msg_id[0] == group_id]:
+            del self.held[msg_id]
+
+    # withdraw a dropped entry from the dependencies it was waiting for
+    def release(self, entry):
+        message = entry[0]
+        for key, counters in self.waiting.items():
+            if key[0] != message.group_id:
+                continue
+            for counter, entries in counters.items():
+                if entry in entries:
+                    entries.remove(entry)
+                    if not entries:
+                        del counters[counter]
+            if not counters:
+                del self.waiting[key]
+
+    # count the dependencies up to counter of a member as delivered and return
+    # the messages that no longer miss any dependency
+    def advance(self, group_id, member_id, counter):
+        ready = []
+        clock = self.clocks.setdefault(group_id, {})
+        last = clock.get(member_id, 0)
+        if counter <= last:
+            return ready
+        clock[member_id] = counter
+        self.changed.setdefault(group_id, set()).add(member_id)
+        key = (group_id, member_id)
+        counters = self.waiting.get(key)
+        if counters:
+            if counter - last == 1:
+                satisfied = [counter] if counter in counters else []
+            else:
+                satisfied = [waited for waited in counters if waited <= counter]
+            for waited in satisfied:
+                self.satisfy(counters.pop(waited), ready)
+            if not counters:
+                del self.waiting[key]
+        return ready
+
+    def satisfy(self, entries, ready):
+        for entry in entries:
+            entry[1] -= 1
+            if entry[1] == 0:
+                message = entry[0]
+                if self.held.pop(message.get_id(), None) is not None:
+                    ready.append(message)
+
+    # deliver the given messages, and every held back message they were the
+    # last missing dependency of, in causal order
+    def drain(self, ready):
+        deliverable = []
+        while ready:
+            message = ready.pop()
+            deliverable.append(message)
+            ready.extend(self.advance(message.group_id, message.sender_id, message.serial_no))
+        return deliverable
+
+    def stats(self):
+        return {'holdback_depth': len(self.held),
+                'holdback_max_depth': self.max_depth,
+                'holdback_overflows': self.overflows,
+                'holdback_duplicates': self.duplicates,
+                'holdback_dependencies_skipped': self.skipped}
+
+
+class TotalOrderHoldback:
+    """
+    Hold-back queue of a single group implementing the ISIS total ordering
+    protocol. Messages are kept in a heap ordered by their (priority, proposer)
+    pair and the head of the heap is delivered as soon as its priority is final.
+    """
+
+    def __init__(self):
+        # largest agreed priority observed in the group
+        self.agreed = 0
+        # largest priority this client has proposed in the group
+        self.proposed = 0
+        # heap of entries [priority, proposer, message-id, message, deliverable]
+        self.heap = []
+        # dictionary with key = <message-id> and value = <current heap entry>,
+        # entries replaced by a final priority are left in the heap as stale
+        self.entries = {}
+        # highest number of messages ever held back at the same time
+        self.max_depth = 0
+
+    def propose(self, message, proposer):
+        """
+        Hold back a received message and return the priority proposed for it.
+        A message that has already been proposed keeps its initial proposal.
+
+        :param message:  the received Message
+        :param proposer: member ID of the client proposing the priority
+        """
+        msg_id = message.get_id()
+        if msg_id in self.entries:
+            return self.entries[msg_id][0]
+        self.proposed = max(self.agreed, self.proposed) + 1
+        entry = [self.proposed, proposer, msg_id, message, False]
+        self.entries[msg_id] = entry
+        heapq.heappush(self.heap, entry)
+        self.max_depth = max(self.max_depth, len(self.entries))
+        return self.proposed
+
+    def finalize(self, msg_id, priority, proposer):
+        """
+        Mark a message as deliverable with its agreed priority and return the
+        list of messages that can be delivered in total order (possibly empty).
+        """
+        entry = self.entries.get(msg_id)
+        if entry is None or entry[4]:
+            return []
+        self.agreed = max(self.agreed, priority)
+        # the agreed priority is never lower than the proposed one, so the entry
+        # is re-inserted with its final priority and the old one becomes stale
+        final_entry = [priority, proposer, msg_id, entry[3], True]
+        self.entries[msg_id] = final_entry
+        heapq.heappush(self.heap, final_entry)
+        return self.pop_deliverable()
+
+    def discard_sender(self, sender_id):
+        """
+        Drop the messages of a sender that left the group before their priority
+        was agreed and return the messages that became deliverable.
+        """
+        for msg_id, entry in self.entries.items():
+            if msg_id[1] == sender_id and not entry[4]:
+                del self.entries[msg_id]
+        return self.pop_deliverable()
+
+    # the messages held back that are still waiting for their final priority
+    def waiting(self):
+        return [entry[3] for entry in self.entries.itervalues() if not entry[4]]
+
+    def pop_deliverable(self):
+        deliverable = []
+        while self.heap:
+            entry = self.heap[0]
+            # skip entries superseded by their final priority or discarded
+            if self.entries.get(entry[2]) is not entry:
+                heapq.heappop(self.heap)
+            elif entry[4]:
+                heapq.heappop(self.heap)
+                del self.entries[entry[2]]
+                deliverable.append(entry[3])
+            else:
+                break
+        return deliverable
+
+
+class SequencerHoldback:
+    """
+    Hold-back queue of a single group delivering messages in the order of the
+    sequence numbers the sequencer of the group stamps them with. Messages and
+    their stamps (ORDER messages) arrive independently and are kept until the
+    message with the next sequence number and its stamp are both present. The
+    sequence numbers missing below the highest stamp are the gaps to request
+    from the sequencer again.
+    """
+
+    def __init__(self):
+        # next sequence number to deliver, the first stamp received starts the
+        # sequence as the earlier ones were stamped before this client joined
+        self.next_seq = None
+        # highest sequence number stamped
+        self.highest = 0
+        # stamps waiting for delivery with key = <sequence number> and value =
+        # <message-id> (None for a sequence number that delivers no message)
+        self.orders = {}
+        # the same stamps with key = <message-id> and value = <sequence number>
+        self.stamps = {}
+        # received messages waiting for their stamp or their turn with key = <message-id>
+        self.messages = {}
+        # highest number of messages ever held back at the same time
+        self.max_depth = 0
+        # number of sequence numbers given up on
+        self.skipped = 0
+        # number of messages delivered
+        self.delivered = 0
+
+    def add_message(self, message):
+        """
+        Hold back a received message and return the list of messages that can
+        be delivered in sequence order as a consequence (possibly empty).
+        """
+        self.messages[message.get_id()] = message
+        self.max_depth = max(self.max_depth, len(self.messages))
+        return self.drain()
+
+    def add_order(self, seq, msg_id, delivered=False):
+        """
+        Record the sequence number stamped on a message and return the list of
+        messages that can be delivered in sequence order as a consequence.
+
+        :param delivered: whether the message was already delivered, e.g. it was
+                          stamped again by a new sequencer after a failover
+        """
+        if self.next_seq is None:
+            self.next_seq = seq
+        elif seq < self.next_seq and self.delivered == 0 and msg_id in self.messages:
+            # the first stamps of the received messages were lost, the sequence
+            # starts earlier than the first stamp received
+            self.next_seq = seq
+        if seq < self.next_seq or seq in self.orders:
+            # a stamp older than the first one delivered is of a message that is
+            # never delivered, the sequence started after it
+            if msg_id in self.messages and msg_id not in self.stamps:
+                del self.messages[msg_id]
+            return []
+        self.highest = max(self.highest, seq)
+        if msg_id in self.stamps or (delivered and msg_id not in self.messages):
+            self.orders[seq] = None
+        else:
+            self.orders[seq] = msg_id
+            self.stamps[msg_id] = seq
+        return self.drain()
+
+    # the received messages that have not been stamped, each sender's in the
+    # order it sent them
+    def unstamped(self):
+        return sorted((message for msg_id, message in self.messages.iteritems()
+                       if msg_id not in self.stamps),
+                      key=lambda message: (message.sender_id, message.serial_no))
+
+    # the sequence numbers missing below the highest stamp (at most limit)
+    def missing(self, limit=None):
+        seqs = []
+        if self.next_seq is not None:
+            for seq in xrange(self.next_seq, self.highest):
+                if seq not in self.orders:
+                    seqs.append(seq)
+                    if len(seqs) == limit:
+                        break
+        return seqs
+
+    # whether the next sequence number is waiting for its stamp or its message
+    def stalled(self):
+        return self.next_seq is not None and (self.next_seq <= self.highest or
+                                              len(self.messages) > len(self.stamps))
+
+    def skip(self):
+        """
+        Give up on the next sequence number, its stamp or its message was lost
+        for good, and return the messages that became deliverable.
+        """
+        msg_id = self.orders.get(self.next_seq)
+        if msg_id is not None:
+            del self.stamps[msg_id]
+            self.messages.pop(msg_id, None)
+        self.orders[self.next_seq] = None
+        self.highest = max(self.highest, self.next_seq)
+        self.skipped += 1
+        return self.drain()
+
+    def discard_sender(self, sender_id):
+        """
+        Give up on the stamped messages of a sender that left the group before
+        they were received and return the messages that became deliverable.
+        """
+        for seq, msg_id in self.orders.items():
+            if msg_id is not None and msg_id[1] == sender_id and msg_id not in self.messages:
+                del self.stamps[msg_id]
+                self.orders[seq] = None
+        return self.drain()
+
+    def drain(self):
+        deliverable = []
+        while self.next_seq in self.orders:
+            msg_id = self.orders[self.next_seq]
+            if msg_id is not None:
+                message = self.messages.pop(msg_id, None)
+                if message is None:
+                    break
+                del self.stamps[msg_id]
+                deliverable.append(message)
+            del self.orders[self.next_seq]
+            self.next_seq += 1
+        self.delivered += len(deliverable)
+        return deliverable
@@ -0,0 +1,84 @@
+import atexit
+import logging
+import threading
+import Queue
+
+# largest number of records waiting to be written, records logged while the
+# queue is full are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = 10000
+
+
+class QueueHandler(logging.Handler):
+    """
+    Logging handler that passes records to a queue instead of writing them,
+    so that logging never blocks on disk I/O. Messages are formatted by the
+    writer thread, the logging thread only pays for creating the record.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        # records dropped since the queue was last full
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': 'Dropped %d log records, the log queue was full',
+                    'args': (self.dropped,)}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(threading.Thread):
+    """
+    Background thread writing the records of a queue to a handler until
+    stop() is called, the records queued by then are written first.
+    """
+
+    def __init__(self, queue, handler):
+        threading.Thread.__init__(self, name='log-writer')
+        self.daemon = True
+        self.queue = queue
+        self.handler = handler
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handler.handle(record)
+        self.handler.close()
+
+    def stop(self):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+def configure_logging(filename, level, format=None, datefmt=None):
+    """
+    Send the records of the root logger at or above level to filename through
+    a queue written by a background thread, replacing its previous handlers.
+    A process forked after configuring its logging must configure it again,
+    as the writer thread is not forked along.
+
+    :param level: the minimum level, either a number or a name such as 'INFO'
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(format, datefmt))
+    queue = Queue.Queue(LOG_QUEUE_SIZE)
+    root.addHandler(QueueHandler(queue))
+    root.setLevel(level)
+    listener = QueueListener(queue, file_handler)
+    listener.start()
+    # the records still queued are written when the process exits
+    atexit.register(listener.stop)
+    return listener
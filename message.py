@@ -1,13 +1,180 @@
+import struct
 
-class Message:
+# version of the binary wire format, datagrams of other versions are rejected
+WIRE_VERSION = 1
 
-    def __init__(self, message_content, group_name, username, serial_no=0):
+# message types
+DATA = 1
+PROPOSE = 2
+FINAL = 3
+NACK = 4
+BATCH = 5
+# sequence number stamped on a DATA message by the sequencer of its group and
+# negative acknowledgement of missing sequence numbers sent to the sequencer
+ORDER = 6
+ORDER_NACK = 7
+# chunk of a datagram too large to be sent as is (see fragment.py)
+FRAGMENT = 8
+# announcement of the serial number of the last DATA message a sender has sent
+# to a group (in the header), so that receivers detect its loss
+SESSION = 9
+# serial number the stream of a member starts at for a member that joined the
+# group after it (as priority, 0 requests it), sent like a proposal with the ID
+# of the member addressed in the header and the ID of its sender as proposer
+START = 10
+
+# fixed header of every datagram: version, message type, flags, group ID,
+# sender ID, serial number and payload length (network byte order)
+HEADER = struct.Struct('!BBHIqqI')
+HEADER_SIZE = HEADER.size
+# bound methods of the header avoid attribute lookups on the hot path
+pack_header = HEADER.pack
+unpack_header = HEADER.unpack_from
+# payload of PROPOSE, FINAL, ORDER and START messages: priority (the sequence
+# number of an ORDER message) and ID of its proposer (the sequencer)
+PRIORITY = struct.Struct('!qq')
+# payload of NACK and ORDER_NACK messages: the serial numbers (sequence numbers)
+# requested for retransmission
+SERIAL_SIZE = struct.calcsize('!q')
+# flag of DATA messages whose payload starts with a vector clock: the number
+# of entries followed by a (member ID, counter) pair per entry
+CLOCK_FLAG = 0x1
+CLOCK_LENGTH = struct.Struct('!H')
+CLOCK_ENTRY_SIZE = struct.calcsize('!qq')
+
+
+class Message(object):
+
+    # messages are decoded on the hot path and may pile up in hold-back
+    # queues, slots make them faster to create and smaller to keep
+    __slots__ = ('message_content', 'group_name', 'username', 'serial_no', 'msg_type',
+                 'group_id', 'sender_id', 'priority', 'proposer_id', 'missing', 'clock')
+
+    def __init__(self, message_content, group_name, username, serial_no=0, msg_type=DATA,
+                 group_id=0, sender_id=0):
         self.message_content = message_content
         self.group_name = group_name
         self.username = username
         self.serial_no = serial_no
+        self.msg_type = msg_type
+        # interned IDs of the group and the sender carried on the wire
+        # instead of their names
+        self.group_id = group_id
+        self.sender_id = sender_id
+        # priority and proposer ID of PROPOSE and FINAL messages
+        self.priority = 0
+        self.proposer_id = 0
+        # serial numbers of the messages of sender_id a NACK message requests
+        # (the sequence numbers an ORDER_NACK message requests from sender_id)
+        self.missing = None
+        # (member ID, counter) pairs of the vector clock of a DATA message sent
+        # in causal ordering mode (None if it carries no clock)
+        self.clock = None
 
     # return a tuple that uniquely identifies a message sent
     # allowing as to consider it as a UID
     def get_id(self):
-        return self.group_name, self.username, self.serial_no
+        return self.group_id, self.sender_id, self.serial_no
+
+    def encode(self):
+        """
+        Serialize the message to its binary wire format: the fixed header
+        followed by the raw payload bytes, preceded by the vector clock of a
+        DATA message sent in causal ordering mode.
+        """
+        flags = 0
+        if self.msg_type == DATA:
+            payload = self.message_content
+            if self.clock is not None:
+                flags = CLOCK_FLAG
+                entries = [field for entry in self.clock for field in entry]
+                payload = (CLOCK_LENGTH.pack(len(self.clock)) +
+                           struct.pack('!%dq' % len(entries), *entries) + payload)
+        elif self.msg_type == NACK or self.msg_type == ORDER_NACK:
+            payload = struct.pack('!%dq' % len(self.missing), *self.missing)
+        elif self.msg_type == SESSION:
+            payload = ''
+        else:
+            payload = PRIORITY.pack(self.priority, self.proposer_id)
+        return pack_header(WIRE_VERSION, self.msg_type, flags, self.group_id,
+                           self.sender_id, self.serial_no, len(payload)) + payload
+
+    @staticmethod
+    def decode(buf):
+        """
+        Deserialize a message from a str, bytearray or memoryview holding its
+        wire format. The header is unpacked in place and only the payload is
+        copied. Names are not part of the wire format, so group_name and
+        username are left to the receiver to resolve from the IDs.
+
+        :raises ValueError: if the datagram is truncated or of another version
+        """
+        if type(buf) is not memoryview:
+            buf = memoryview(buf)
+        try:
+            version, msg_type, flags, group_id, sender_id, serial_no, length = unpack_header(buf)
+        except struct.error:
+            raise ValueError('truncated message header')
+        end = HEADER_SIZE + length
+        if version != WIRE_VERSION or len(buf) < end:
+            raise ValueError('truncated message or unsupported wire format version %d' % version)
+        if msg_type == DATA:
+            if not flags & CLOCK_FLAG:
+                return Message(buf[HEADER_SIZE:end].tobytes(), None, None, serial_no, msg_type,
+                               group_id, sender_id)
+            try:
+                count = CLOCK_LENGTH.unpack_from(buf, HEADER_SIZE)[0]
+                start = HEADER_SIZE + CLOCK_LENGTH.size + count * CLOCK_ENTRY_SIZE
+                if start > end:
+                    raise ValueError('truncated vector clock')
+                entries = struct.unpack_from('!%dq' % (2 * count), buf,
+                                             HEADER_SIZE + CLOCK_LENGTH.size)
+            except struct.error:
+                raise ValueError('truncated vector clock')
+            message = Message(buf[start:end].tobytes(), None, None, serial_no, msg_type,
+                              group_id, sender_id)
+            message.clock = zip(entries[0::2], entries[1::2])
+            return message
+        message = Message(None, None, None, serial_no, msg_type, group_id, sender_id)
+        # batches and fragments are handled as a whole by the receiver and a
+        # session message has no payload
+        if msg_type == BATCH or msg_type == FRAGMENT or msg_type == SESSION:
+            return message
+        if msg_type == NACK or msg_type == ORDER_NACK:
+            if length % SERIAL_SIZE:
+                raise ValueError('truncated serial number in negative acknowledgement')
+            message.missing = struct.unpack_from('!%dq' % (length // SERIAL_SIZE), buf, HEADER_SIZE)
+            return message
+        if length < PRIORITY.size:
+            raise ValueError('truncated priority')
+        message.priority, message.proposer_id = PRIORITY.unpack_from(buf, HEADER_SIZE)
+        return message
+
+    @staticmethod
+    def encode_batch(group_id, sender_id, datagrams):
+        """
+        Pack encoded DATA messages of a group into a single BATCH datagram: a
+        header followed by the messages, each keeping its own header.
+
+        :param datagrams: list of encoded messages in the order they were sent
+        """
+        payload = ''.join(datagrams)
+        return pack_header(WIRE_VERSION, BATCH, 0, group_id, sender_id, len(datagrams),
+                           len(payload)) + payload
+
+    @staticmethod
+    def split_batch(buf):
+        """
+        Return views of the messages packed in a BATCH datagram (a memoryview),
+        a truncated message ends the batch.
+        """
+        messages = []
+        end = HEADER_SIZE + unpack_header(buf)[6]
+        offset = HEADER_SIZE
+        while offset + HEADER_SIZE <= end:
+            message_end = offset + HEADER_SIZE + unpack_header(buf, offset)[6]
+            if message_end > end:
+                break
+            messages.append(buf[offset:message_end])
+            offset = message_end
+        return messages
@@ -1,4 +1,221 @@
+import os
 import sys
+import time
+from collections import OrderedDict
+
+# kernel table of the UDP sockets of the host (Linux only)
+PROC_NET_UDP = '/proc/net/udp'
+# sub-buckets of each power of two in a latency histogram, the recorded
+# latencies are accurate to 1 / (SUB_BUCKETS / 2) of their value
+SUB_BUCKETS = 128
+# largest latency a histogram tracks in microseconds (larger ones are clamped)
+MAX_LATENCY = 3600 * 10 ** 6
+# most messages waiting for their delivery whose send time is kept
+IN_FLIGHT_CAPACITY = 65536
+# seconds after which a message that has not been delivered is forgotten
+IN_FLIGHT_EXPIRY = 60.0
+# seconds the recent throughput is measured over and the width of its slots
+THROUGHPUT_WINDOW = 10
+THROUGHPUT_SLOT = 1.0
+# percentiles of the latency reported by the performance analytics
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+def read_udp_table():
+    """
+    Return the drops column of /proc/net/udp as a dictionary with key =
+    <socket-inode> and value = <datagrams dropped>, or None if the table is
+    not available.
+    """
+    try:
+        with open(PROC_NET_UDP) as table:
+            lines = table.readlines()[1:]
+    except IOError:
+        return None
+    drops = {}
+    for line in lines:
+        fields = line.split()
+        # sockets are identified by their inode, the drops column is the last one
+        drops[fields[9]] = int(fields[-1])
+    return drops
+
+
+def read_udp_drops(sockets, table=None):
+    """
+    Return the number of datagrams the kernel dropped because the receive
+    buffer of one of the given UDP sockets was full, as reported by the drops
+    column of /proc/net/udp, or None if the table is not available.
+
+    :param sockets: the UDP sockets to sum the drops of
+    :param table:   the table as returned by read_udp_table(), read once for
+                    many calls (read by this call if None)
+    """
+    if not sockets:
+        return 0
+    if table is None:
+        table = read_udp_table()
+        if table is None:
+            return None
+    return sum(table.get(str(os.fstat(sock.fileno()).st_ino), 0) for sock in sockets)
+
+
+class LatencyHistogram:
+    """
+    Fixed-memory histogram of latencies with logarithmic buckets (as in
+    HdrHistogram). Latencies are recorded in microseconds, every power of two
+    is split into SUB_BUCKETS / 2 linear sub-buckets, so percentiles are
+    accurate to about 1.5% whatever the range of the recorded latencies.
+    """
+
+    def __init__(self, max_value=MAX_LATENCY):
+        self.half_sub_buckets = SUB_BUCKETS // 2
+        self.sub_bucket_bits = (SUB_BUCKETS - 1).bit_length()
+        self.max_value = max_value
+        self.counts = [0] * (self.index_of(max_value) + 1)
+        self.total_count = 0
+        # exact sum and extremes of the recorded latencies in microseconds
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    # index of the bucket counting a latency of value microseconds
+    def index_of(self, value):
+        bucket = max(0, value.bit_length() - self.sub_bucket_bits)
+        return bucket * self.half_sub_buckets + (value >> bucket)
+
+    # largest latency counted in the bucket with the given index
+    def highest_value_at(self, index):
+        if index < SUB_BUCKETS:
+            return index
+        bucket = index // self.half_sub_buckets - 1
+        sub_bucket = index - bucket * self.half_sub_buckets
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, latency):
+        """
+        Count a latency given in seconds.
+        """
+        value = min(max(0, int(latency * 10 ** 6)), self.max_value)
+        self.counts[self.index_of(value)] += 1
+        self.total_count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, percentile):
+        """
+        Return the latency in microseconds that the given percentage of the
+        recorded latencies do not exceed (0 if nothing has been recorded).
+        """
+        if self.total_count == 0:
+            return 0
+        target = max(1, int(round(percentile / 100.0 * self.total_count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highest_value_at(index), self.max)
+        return self.max
+
+    def mean(self):
+        if self.total_count == 0:
+            return 0.0
+        return float(self.total) / self.total_count
+
+    # compact representation of the histogram holding only its non-empty buckets
+    def snapshot(self):
+        return {'buckets': [[index, count] for index, count in enumerate(self.counts) if count],
+                'total': self.total,
+                'min': self.min,
+                'max': self.max}
+
+    def merge(self, snapshot):
+        """
+        Add the latencies of a histogram snapshot to this histogram.
+        """
+        for index, count in snapshot['buckets']:
+            if 0 <= index < len(self.counts):
+                self.counts[index] += count
+                self.total_count += count
+        self.total += snapshot['total']
+        self.max = max(self.max, snapshot['max'])
+        if snapshot['min'] is not None and (self.min is None or snapshot['min'] < self.min):
+            self.min = snapshot['min']
+
+
+class InFlightTable:
+    """
+    Send times of the messages waiting for their delivery in insertion order.
+    The table holds at most capacity messages and forgets those older than
+    expiry seconds, so messages that are never delivered (e.g. lost or sent
+    to a group that was left) do not accumulate.
+    """
+
+    def __init__(self, capacity=IN_FLIGHT_CAPACITY, expiry=IN_FLIGHT_EXPIRY):
+        self.capacity = capacity
+        self.expiry = expiry
+        # dictionary with key = <message-id> and value = <send-time>
+        self.send_times = OrderedDict()
+        # number of messages forgotten before their delivery
+        self.expired = 0
+
+    def start(self, message_id, now):
+        self.send_times[message_id] = now
+        while len(self.send_times) > self.capacity:
+            self.send_times.popitem(last=False)
+            self.expired += 1
+        self.expire(now)
+
+    # return the send time of a delivered message or None if it is unknown
+    def finish(self, message_id):
+        return self.send_times.pop(message_id, None)
+
+    def expire(self, now):
+        deadline = now - self.expiry
+        while self.send_times:
+            message_id, send_time = next(self.send_times.iteritems())
+            if send_time >= deadline:
+                break
+            del self.send_times[message_id]
+            self.expired += 1
+
+
+class SlidingWindowRate:
+    """
+    Rate of events over the last window seconds, counted in slots of slot
+    seconds kept in a ring, so the rate follows the recent load with fixed
+    memory instead of averaging over the whole lifetime of the client.
+    """
+
+    def __init__(self, window=THROUGHPUT_WINDOW, slot=THROUGHPUT_SLOT):
+        self.slot = slot
+        self.slots = [0] * int(window / slot)
+        # number of the slot (time / slot) of the last recorded event
+        self.last_slot = None
+
+    def advance(self, now):
+        current = int(now / self.slot)
+        if self.last_slot is None:
+            self.last_slot = current
+        # reset the slots that have gone by since the last event
+        for slot in xrange(self.last_slot + 1, min(current, self.last_slot + len(self.slots)) + 1):
+            self.slots[slot % len(self.slots)] = 0
+        self.last_slot = max(self.last_slot, current)
+        return current
+
+    def record(self, amount=1, now=None):
+        if now is None:
+            now = time.time()
+        current = self.advance(now)
+        self.slots[current % len(self.slots)] += amount
+
+    # events per second over the window
+    def rate(self, now=None):
+        if now is None:
+            now = time.time()
+        self.advance(now)
+        return sum(self.slots) / (len(self.slots) * self.slot)
 
 
 class Metrics:
@@ -8,8 +225,20 @@ class Metrics:
         self.total_messages_received = total_messages_received
         self.start_time = start_time
         self.end_time = end_time
-        # dictionary with key = <message-id> and value = list [<send-time>, <deliver-time]
-        self.latency_list = {}
+        # send times of the messages of this client that have not been delivered
+        self.in_flight = InFlightTable()
+        # latencies between sending and delivering the messages of this client
+        self.latency = LatencyHistogram()
+        # messages sent by the user and messages delivered over the last seconds
+        self.send_rate = SlidingWindowRate()
+        self.delivery_rate = SlidingWindowRate()
+        # dictionary with key = <counter-name> and value = <counter-value> holding
+        # statistics reported by the client's components (e.g. hold-back queues)
+        self.counters = {}
+
+    # add amount to the counter with the given name
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
 
     # calculate throughput by dividing the total messages sent by the time elapsed
     # between the first message and the delivery of the last message
@@ -21,25 +250,42 @@ class Metrics:
             throughput = 0
         return throughput
 
+    # the client has sent a message with the given ID
+    def message_sent(self, message_id):
+        now = time.time()
+        self.in_flight.start(message_id, now)
+        self.send_rate.record(1, now)
+
+    # the client has delivered a message, its latency is recorded if the
+    # message was sent by this client
+    def message_delivered(self, message_id=None):
+        now = time.time()
+        self.total_messages_received += 1
+        self.delivery_rate.record(1, now)
+        if message_id is not None:
+            send_time = self.in_flight.finish(message_id)
+            if send_time is not None:
+                self.latency.record(now - send_time)
+
     # calculate system's average latency in milliseconds
     def calculate_avg_latency(self):
-        total_latency = 0.0
-        for tup in self.latency_list.values():
-            latency = tup[1] - tup[0]
-            total_latency = total_latency + latency
-        total_latency = total_latency
-        if len(self.latency_list) != 0:
-            avg_latency = total_latency / len(self.latency_list)
-        else:
-            avg_latency = 0
-        # return average latency in milliseconds
-        return avg_latency * (10 ** 3)
+        return self.latency.mean() / 10 ** 3
+
+    # cumulative metrics of the client pushed periodically to the tracker
+    def snapshot(self):
+        return {'sent': self.total_messages_sent,
+                'received': self.total_messages_received,
+                'send_rate': self.send_rate.rate(),
+                'delivery_rate': self.delivery_rate.rate(),
+                'in_flight': len(self.in_flight.send_times),
+                'counters': self.counters,
+                'latency': self.latency.snapshot()}
 
     def print_info(self, output_fd=sys.stdout):
         """
         Print the following metrics to evaluate messenger system's performance:
-        System throughput - how many messages are served over time
-        System latency - average message delivery time
+        System throughput - how many messages are served over time (overall and recent)
+        System latency - average and percentiles of the message delivery time
         Messages cost - total messages sent/received
 
         :param output_fd: file descriptor to output performance data
@@ -49,7 +295,123 @@ class Metrics:
         total_messages = self.total_messages_sent + self.total_messages_received
         output_fd.write('\n\n-----Performance analytics -----\n')
         output_fd.write('System throughput = %.2f messages/sec\n' % throughput)
+        output_fd.write('Recent throughput = %.2f sent/sec, %.2f delivered/sec (last %d sec)\n' % (
+            self.send_rate.rate(), self.delivery_rate.rate(), THROUGHPUT_WINDOW))
         output_fd.write('System latency = %.3f ms\n' % avg_latency)
+        percentiles = ', '.join('p%g = %.3f ms' % (percentile, self.latency.percentile(percentile) / 10.0 ** 3)
+                                for percentile in PERCENTILES)
+        output_fd.write('Latency percentiles: %s, max = %.3f ms (%d messages)\n' % (
+            percentiles, self.latency.max / 10.0 ** 3, self.latency.total_count))
+        output_fd.write('Messages in flight = %d (%d expired)\n' % (
+            len(self.in_flight.send_times), self.in_flight.expired))
         output_fd.write('Messages sent = %d\n' % self.total_messages_sent)
         output_fd.write('Messages received = %d\n' % self.total_messages_received)
         output_fd.write('Total messages = %d\n' % total_messages)
+        for name in sorted(self.counters):
+            output_fd.write('%s = %d\n' % (name, self.counters[name]))
+
+
+class MetricsAggregator:
+    """
+    Latest metric snapshots pushed by the clients, merged on demand into the
+    metrics of each group and of the whole cluster: counters and rates are
+    summed and latency histograms are merged bucket by bucket, so cluster
+    percentiles are as accurate as those of a single client. Snapshots are
+    cumulative, so a lost or late snapshot is made up for by the next one.
+    """
+
+    def __init__(self):
+        # dictionary with key = <member-id> and value = <latest snapshot>
+        self.snapshots = {}
+
+    def update(self, member_id, snapshot):
+        self.snapshots[member_id] = snapshot
+
+    def remove(self, member_id):
+        self.snapshots.pop(member_id, None)
+
+    def aggregate(self, member_ids):
+        """
+        Merge the snapshots of the given members into a single snapshot.
+        """
+        latency = LatencyHistogram()
+        merged = {'members': 0, 'sent': 0, 'received': 0, 'send_rate': 0.0,
+                  'delivery_rate': 0.0, 'in_flight': 0, 'counters': {}}
+        for member_id in member_ids:
+            snapshot = self.snapshots.get(member_id)
+            if snapshot is None:
+                continue
+            merged['members'] += 1
+            for name in ('sent', 'received', 'send_rate', 'delivery_rate', 'in_flight'):
+                merged[name] += snapshot[name]
+            for name, value in snapshot['counters'].iteritems():
+                merged['counters'][name] = merged['counters'].get(name, 0) + value
+            latency.merge(snapshot['latency'])
+        merged['latency'] = latency
+        return merged
+
+    def report(self, groups):
+        """
+        Return the merged metrics of the cluster and of each group.
+
+        :param groups: dictionary of the groups with key = <group-name>
+        """
+        return {'cluster': self.aggregate(self.snapshots.keys()),
+                'groups': dict((name, self.aggregate(group.members.keys()))
+                               for name, group in groups.iteritems())}
+
+    def render_json(self, groups):
+        report = self.report(groups)
+        scopes = [report['cluster']] + report['groups'].values()
+        for merged in scopes:
+            latency = merged.pop('latency')
+            merged['latency_ms'] = dict(('p%g' % percentile, latency.percentile(percentile) / 10.0 ** 3)
+                                        for percentile in PERCENTILES)
+            merged['latency_ms']['max'] = latency.max / 10.0 ** 3
+            merged['latency_ms']['mean'] = latency.mean() / 10 ** 3
+            merged['latency_ms']['count'] = latency.total_count
+        report['time'] = time.time()
+        return report
+
+    def render_prometheus(self, groups):
+        """
+        Return the merged metrics in the Prometheus text exposition format,
+        cluster-wide series are prefixed with messenger_cluster_ and per group
+        series with messenger_group_ and labelled with the group name.
+        """
+        report = self.report(groups)
+        # dictionary with key = <metric family> and value = [<type>, <sample lines>]
+        families = OrderedDict()
+        self.render_scope(families, 'messenger_cluster_', '', report['cluster'])
+        for name in sorted(report['groups']):
+            self.render_scope(families, 'messenger_group_', 'group="%s"' % name, report['groups'][name])
+        lines = []
+        for family, (metric_type, samples) in families.iteritems():
+            lines.append('# TYPE %s %s' % (family, metric_type))
+            lines.extend(samples)
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def render_scope(families, prefix, labels, merged):
+        def sample(name, value, metric_type='gauge', suffix='', extra_label=None):
+            label_list = [label for label in (labels, extra_label) if label]
+            label_text = '{%s}' % ','.join(label_list) if label_list else ''
+            family = families.setdefault(prefix + name, [metric_type, []])
+            family[1].append('%s%s%s%s %r' % (prefix, name, suffix, label_text, float(value)))
+
+        sample('members', merged['members'])
+        sample('messages_sent_total', merged['sent'], 'counter')
+        sample('messages_received_total', merged['received'], 'counter')
+        sample('send_rate', merged['send_rate'])
+        sample('delivery_rate', merged['delivery_rate'])
+        sample('messages_in_flight', merged['in_flight'])
+        latency = merged['latency']
+        for percentile in PERCENTILES:
+            sample('latency_seconds', latency.percentile(percentile) / 10.0 ** 6, 'summary',
+                   extra_label='quantile="%g"' % (percentile / 100.0))
+        sample('latency_seconds', latency.total / 10.0 ** 6, 'summary', '_sum')
+        sample('latency_seconds', latency.total_count, 'summary', '_count')
+        sample('latency_max_seconds', latency.max / 10.0 ** 6)
+        for name in sorted(merged['counters']):
+            sample(name, merged['counters'][name])
@@ -0,0 +1,144 @@
+# number of serial numbers past the last gap-free one a receive window tracks
+WINDOW_SIZE = 4096
+# number of sent datagrams of a group kept for retransmission
+RETRANSMIT_CAPACITY = 1024
+# seconds a receiver waits for a missing message before asking for it,
+# a short delay lets messages that are merely reordered arrive meanwhile
+NACK_DELAY = 0.02
+# seconds between two negative acknowledgements of the same gap
+NACK_INTERVAL = 0.1
+# negative acknowledgements sent for a gap before giving up on it
+NACK_RETRIES = 5
+# largest number of missing serial numbers requested by a single NACK
+MAX_NACK_SERIALS = 64
+# seconds between two announcements of the last message sent to a group, a
+# lost message is only detected once a later one of its stream arrives
+TAIL_INTERVAL = 0.2
+# announcements of the last message sent to a group while the sender is idle,
+# a receiver that has missed all of them misses the message for good
+TAIL_ROUNDS = 5
+
+
+class RetransmitRing:
+    """
+    Bounded ring of the most recent datagrams a client has sent to a group,
+    indexed by serial number. Once the ring is full a new datagram overwrites
+    the oldest one, so a datagram can be retransmitted for as long as fewer
+    than capacity newer datagrams have been sent.
+    """
+
+    def __init__(self, capacity=RETRANSMIT_CAPACITY):
+        self.capacity = capacity
+        # slots of (serial number, datagram) tuples, None if never filled
+        self.slots = [None] * capacity
+        # serial number of the most recent datagram
+        self.last_serial = 0
+
+    def store(self, serial_no, datagram):
+        self.slots[serial_no % self.capacity] = (serial_no, datagram)
+        self.last_serial = max(self.last_serial, serial_no)
+
+    # return the datagram with the given serial number or None if it has
+    # already been overwritten
+    def get(self, serial_no):
+        slot = self.slots[serial_no % self.capacity]
+        if slot is not None and slot[0] == serial_no:
+            return slot[1]
+        return None
+
+
+class ReceiveWindow:
+    """
+    Sliding window over the serial numbers received from a (sender, group)
+    stream. Every serial number up to base has been received (or given up on)
+    and bit i of the received bitmap is set if serial number base + 1 + i has
+    been received, so duplicates are detected in O(1) with bounded memory and
+    the gaps between base and the highest serial number are the lost messages.
+    """
+
+    __slots__ = ('base', 'received', 'highest', 'address', 'nack_timer',
+                 'nack_attempts', 'nack_base')
+
+    def __init__(self):
+        self.base = 0
+        self.received = 0
+        # highest serial number received (or announced)
+        self.highest = 0
+        # address the stream is received from, negative acknowledgements are sent to it
+        self.address = None
+        # timer of the next negative acknowledgement (None if no gap is pending)
+        self.nack_timer = None
+        # negative acknowledgements sent since base last advanced
+        self.nack_attempts = 0
+        self.nack_base = 0
+
+    def accept(self, serial_no):
+        """
+        Record the receipt of a message and return whether it is new. Messages
+        received before and messages beyond the window are rejected.
+        """
+        offset = serial_no - self.base - 1
+        if offset < 0 or offset >= WINDOW_SIZE:
+            return False
+        bit = 1 << offset
+        if self.received & bit:
+            return False
+        self.received |= bit
+        if serial_no > self.highest:
+            self.highest = serial_no
+        # slide the window over the run of messages received without gaps
+        if offset == 0:
+            received = self.received
+            shift = (~received & (received + 1)).bit_length() - 1
+            self.received = received >> shift
+            self.base += shift
+        return True
+
+    def announce(self, serial_no):
+        """
+        Record that a message is on its way without having received it, e.g.
+        some of its fragments have arrived, so that it is requested if it does
+        not arrive. Returns whether it is missing.
+        """
+        offset = serial_no - self.base - 1
+        if offset < 0 or offset >= WINDOW_SIZE or self.received & (1 << offset):
+            return False
+        if serial_no > self.highest:
+            self.highest = serial_no
+        return True
+
+    def forget(self, serial_no):
+        """
+        Clear the receipt of a message dropped after it was accepted, e.g. by
+        a full hold-back queue, so that it is missing and requested again.
+        """
+        offset = serial_no - self.base - 1
+        if 0 <= offset < WINDOW_SIZE:
+            self.received &= ~(1 << offset)
+
+    def in_window(self, serial_no):
+        return serial_no - self.base <= WINDOW_SIZE
+
+    def has_gap(self):
+        return self.highest > self.base
+
+    # the serial numbers missing up to the highest one (at most limit)
+    def missing(self, limit=None):
+        serials = []
+        received = self.received
+        for offset in xrange(self.highest - self.base):
+            if not (received >> offset) & 1:
+                serials.append(self.base + 1 + offset)
+                if len(serials) == limit:
+                    break
+        return serials
+
+    def give_up(self):
+        """
+        Consider the missing messages lost for good, slide the window past
+        them and return their serial numbers.
+        """
+        skipped = self.missing()
+        self.base = self.highest
+        self.received = 0
+        return skipped
@@ -0,0 +1,176 @@
+import errno
+import socket
+
+from client import Client, MAX_DATAGRAMS_PER_WAKEUP, RECEIVE_BUFFER_SIZE, SOCKET_RCVBUF, \
+    SOCKET_SNDBUF, METRICS_INTERVAL
+from event_loop import EventLoop
+from fragment import Reassembler
+from message import PROPOSE, NACK, ORDER_NACK, FRAGMENT, START, HEADER_SIZE, unpack_header
+from metrics import read_udp_drops, read_udp_table
+
+
+class ClientRuntime:
+    """
+    Hosts many clients in a single process on one event loop, e.g. to load
+    test the messenger or to simulate a large group from a single host. Every
+    client keeps its own control connection to the tracker, ordering state and
+    metrics, while the loop and the receive buffer are shared.
+
+    With shared_socket the clients also share a single UDP socket and register
+    its address with the tracker. The runtime reads the socket and passes each
+    datagram to its recipients: proposals, NACKs and stream starts to the hosted
+    member whose ID they carry (the sender of the message or stamp they refer
+    to, the member a stream start is addressed to), every other message to the
+    hosted members of its group. Senders send a single copy of a group message
+    to each distinct address, so the members hosted by a runtime receive it
+    once. Fragmented messages are reassembled once by the
+    runtime and then routed as a whole.
+
+    The runtime pushes the metrics of its clients to the tracker, reading the
+    kernel table of the UDP sockets once for all of them.
+    """
+
+    def __init__(self, ip, udp_port=0, shared_socket=False, rcvbuf=SOCKET_RCVBUF,
+                 sndbuf=SOCKET_SNDBUF):
+        self.ip = ip
+        self.loop = EventLoop()
+        # hosted clients with key = <sender-id>
+        self.clients = {}
+        self.receive_buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.receive_view = memoryview(self.receive_buffer)
+        # datagrams the shared socket could not receive or route
+        self.receive_errors = 0
+        self.unrouted_datagrams = 0
+        self.reassembler = Reassembler()
+        self.udp_socket = None
+        if shared_socket:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind((ip, udp_port))
+            self.udp_socket.setblocking(0)
+            if rcvbuf is not None:
+                self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            if sndbuf is not None:
+                self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+            self.loop.add_reader(self.udp_socket, self.handle_udp_message)
+        self.metrics_timer = self.loop.call_every(METRICS_INTERVAL, self.push_metrics)
+
+
+    def add_client(self, server_ip, server_port, username, mode='FIFO', **options):
+        """
+        Register a new client hosted by the runtime and return it, the client
+        is then driven by its headless API (join(), select(), send(), ...)
+        :param options:     further arguments of the Client, e.g. transport
+        :raises ValueError: if the username is invalid or already taken
+        :raises socket.error: if the tracker is unreachable or does not reply
+        """
+        if self.udp_socket is not None:
+            client = Client(self.ip, self.udp_socket.getsockname()[1], mode, loop=self.loop,
+                            udp_socket=self.udp_socket, receive_buffer=self.receive_buffer,
+                            metrics_interval=None, **options)
+        else:
+            client = Client(self.ip, 0, mode, loop=self.loop, receive_buffer=self.receive_buffer,
+                            metrics_interval=None, **options)
+        try:
+            client.connect(server_ip, server_port, username)
+        except (ValueError, socket.error):
+            # the sockets opened before the registration was refused
+            if client.control is not None:
+                client.control.on_close = None
+                client.control.close()
+            for control in client.shard_controls:
+                if control is not None:
+                    control.close()
+            if client.owns_udp_socket and client.udp_socket is not None:
+                client.udp_socket.close()
+            raise
+        self.clients[client.sender_id] = client
+        # a client closed by a failure, e.g. the tracker being unreachable for
+        # too long, is no longer hosted while the other clients keep running
+        client.add_close_callback(lambda error: self.clients.pop(client.sender_id, None))
+        return client
+
+
+    # quit the messenger with a hosted client
+    def remove_client(self, client):
+        if self.clients.pop(client.sender_id, None) is not None:
+            client.close()
+
+
+    # the shared udp socket has available data to read, every datagram queued
+    # on it is read in a single wakeup and passed to its recipients
+    def handle_udp_message(self):
+        for _ in xrange(MAX_DATAGRAMS_PER_WAKEUP):
+            try:
+                nbytes, address = self.udp_socket.recvfrom_into(self.receive_buffer)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                self.receive_errors += 1
+                continue
+            self.route_datagram(self.receive_view[:nbytes], address)
+
+
+    def route_datagram(self, datagram, address):
+        if len(datagram) < HEADER_SIZE:
+            self.unrouted_datagrams += 1
+            return
+        header = unpack_header(datagram)
+        msg_type, group_id, sender_id = header[1], header[3], header[4]
+        if msg_type == FRAGMENT:
+            try:
+                datagram = self.reassembler.add(datagram)
+            except ValueError:
+                self.unrouted_datagrams += 1
+                return
+            if datagram is not None:
+                self.route_datagram(datagram, address)
+            return
+        if (msg_type == PROPOSE or msg_type == NACK or msg_type == ORDER_NACK or
+                msg_type == START):
+            client = self.clients.get(sender_id)
+            if client is None:
+                self.unrouted_datagrams += 1
+                return
+            client.handle_datagram(datagram, address)
+            return
+        routed = False
+        for client in self.clients.itervalues():
+            if group_id in client.groups_by_id:
+                client.handle_datagram(datagram, address)
+                routed = True
+        if not routed:
+            self.unrouted_datagrams += 1
+
+
+    def push_metrics(self):
+        udp_table = read_udp_table()
+        for client in self.clients.values():
+            client.push_metrics(udp_table)
+
+
+    # datagrams dropped by the kernel on the shared socket because the hosted
+    # clients did not read them fast enough (None if not available)
+    def udp_drops(self):
+        if self.udp_socket is None:
+            return None
+        return read_udp_drops([self.udp_socket])
+
+
+    # serve the hosted clients until close() is called
+    def run(self):
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.close()
+
+
+    # quit the messenger with every hosted client and stop the event loop
+    def close(self):
+        self.metrics_timer.cancel()
+        for client in self.clients.values():
+            self.remove_client(client)
+        if self.udp_socket is not None:
+            self.loop.remove_reader(self.udp_socket)
+            self.udp_socket.close()
+            self.udp_socket = None
+        self.loop.stop()
@@ -0,0 +1,294 @@
+import logging
+import multiprocessing
+import socket
+
+from channel import ControlChannel, FramedConnection, PUSH_REQUEST_ID
+from group import Group
+from member import Member
+from log_queue import configure_logging, QueueHandler
+from tracker import Tracker, logger, LOGGING_FILE, LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT, \
+    METRICS_PORT, SNAPSHOT_FILE
+
+# group commands, they are served by the shard owning the group
+GROUP_COMMANDS = ('!j', '!lm', '!e')
+
+
+def run_shard(index, shards, sock, listening_socket, inherited_sockets):
+    # the front end's ends of the shard connections are inherited on fork and
+    # would keep this shard's connection open after the front end exits, as
+    # are the listening sockets of the other shards
+    for inherited_socket in inherited_sockets:
+        inherited_socket.close()
+    # the log writer thread of the front end is not forked along, a shard
+    # writes its log with a thread of its own
+    root = logging.getLogger()
+    listener = None
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        listener = configure_logging(LOGGING_FILE, root.level, LOG_FORMAT, LOG_DATE_FORMAT)
+    try:
+        TrackerShard(index, shards, sock, listening_socket).connect()
+    finally:
+        # shard processes exit without running the exit handlers
+        if listener is not None:
+            listener.stop()
+
+
+class TrackerShard(Tracker):
+    """
+    Worker process of a sharded tracker owning the groups whose name hashes
+    to its index. Members connect to the shard directly and attach their
+    connection ('attach <member-info>'), over which they send the commands of
+    the shard's groups and receive their change notifications, so neither
+    goes through the front end. The front end announces every member
+    registration ('member <member-info>') and quit ('quit <member-id>') over
+    a framed connection, so that each shard keeps a consistent copy of the
+    registered members, and forwards the group commands of the members that
+    have not attached, whose notifications are pushed back to it as
+    '<member-id> <notifications>'. Every change of the shard's groups is
+    pushed to the front end as 'join <member-id> <group-name>' or
+    'leave <member-id> <group-name>'.
+    """
+
+    def __init__(self, index, shards, sock, listening_socket):
+        Tracker.__init__(self, None, None)
+        self.index = index
+        self.shards = shards
+        # socket listening for the connections of the members, bound by the
+        # front end so that it knows the address of the shard
+        self.socket = listening_socket
+        # framed connection to the front end
+        self.front_end_socket = sock
+        self.front_end = None
+
+
+    def connect(self):
+        self.front_end = FramedConnection(self.front_end_socket, self.loop,
+                                          self.handle_front_end_request, self.front_end_closed)
+        self.socket.setblocking(0)
+        self.loop.add_reader(self.socket, self.serve_client)
+        logger.info('Tracker shard %d started listening on port %s', self.index,
+                    self.socket.getsockname()[1])
+        self.loop.run()
+
+
+    # the front end has exited, so has the tracker
+    def front_end_closed(self, connection):
+        self.loop.stop()
+
+
+    def handle_front_end_request(self, connection, request_id, message):
+        if message[0:7] == 'member\t':
+            member_info = message[7:].split(',')
+            self.members_dict[member_info[0]] = Member(*member_info)
+        elif message[0:5] == 'quit\t':
+            member = self.members_dict.get(message[5:])
+            if member is not None:
+                self.member_quit(member)
+        else:
+            Tracker.handle_request(self, connection, request_id, message)
+
+
+    # a member attaches its connection to the shard before sending commands
+    # over it, the registration it carries may arrive before the front end
+    # announces it
+    def handle_request(self, connection, request_id, message):
+        if message[0:7] == 'attach\t':
+            member = Member(*message[7:].split(','))
+            member = self.members_dict.setdefault(member.id, member)
+            self.connections[member.id] = connection
+            connection.member_id = member.id
+            self.send_message(connection, request_id, 'ATTACH OK')
+        else:
+            Tracker.handle_request(self, connection, request_id, message)
+
+
+    # a member is only removed once the front end announces it has quit
+    def connection_closed(self, connection):
+        member_id = getattr(connection, 'member_id', None)
+        if self.connections.get(member_id) is connection:
+            del self.connections[member_id]
+
+
+    # the multicast addresses of the shards are disjoint, a shard only
+    # assigns the addresses that hash to its own index
+    def assign_multicast_addr(self, group):
+        multicast_addr = Group.generate_multicast_addr()
+        while (multicast_addr in self.multicast_addrs or
+               Group.shard_of(multicast_addr, self.shards) != self.index):
+            multicast_addr = Group.generate_multicast_addr()
+        self.multicast_addrs.add(multicast_addr)
+        group.multicast_addr = multicast_addr
+        group.multicast_port = Group.generate_multicast_port()
+
+
+    # the front end mirrors the memberships of the groups, only the changes
+    # actually applied are logged and thus pushed to it
+    def log_state(self, *fields):
+        if fields[0] == 'join' or fields[0] == 'leave':
+            self.front_end.send(PUSH_REQUEST_ID, '\t'.join(fields))
+
+
+    # notifications are pushed to the members over their connection to the
+    # shard, those of the members that have not attached through the front end
+    def flush_notifications(self):
+        self.notification_timer = None
+        pending, self.pending_notifications = self.pending_notifications, {}
+        for member_id, notifications in pending.iteritems():
+            batch = '\n'.join(notifications)
+            connection = self.connections.get(member_id)
+            if connection is not None:
+                connection.send(PUSH_REQUEST_ID, batch)
+            else:
+                self.front_end.send(PUSH_REQUEST_ID, member_id + '\t' + batch)
+
+
+class ShardedTracker(Tracker):
+    """
+    Front end of a tracker whose groups are partitioned across shards, each
+    shard being a separate process listening on a port of its own. The front
+    end owns the registrations, health checks and metrics, and tells the
+    clients where the shards are ('!sh'), so that each client sends the
+    commands of a group straight to the shard owning it and receives the
+    notifications of the group from there. The joins, leaves and
+    notifications of different groups are thus served on different cores
+    without going through the front end. The group commands of clients that
+    do not connect to the shards are forwarded to them by the front end.
+
+    The front end keeps a mirror of the group memberships, updated with the
+    changes pushed by the shards, it serves '!lg' and resumes reconnecting
+    members from it, merges per group metrics and tells a quitting member's
+    shards to remove it from its groups.
+    """
+
+    def __init__(self, host, port, shards=None, max_listen=128, metrics_port=None,
+                 snapshot_file=None, shard_port=None):
+        Tracker.__init__(self, host, port, max_listen, metrics_port, snapshot_file)
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+        self.shard_count = shards
+        # port the first shard listens on, the others listen on the following
+        # ports (None lets every shard listen on any free port)
+        self.shard_port = shard_port
+        # control channels to the shards and the '<ip>,<port>' addresses the
+        # shards listen on, indexed by shard
+        self.shards = []
+        self.shard_addresses = []
+        self.shard_processes = []
+
+
+    def connect(self):
+        # the shards are started before the listening socket is created,
+        # so that they do not inherit it
+        pairs = [socket.socketpair() for _ in range(self.shard_count)]
+        front_end_sockets = [pair[0] for pair in pairs]
+        listening_sockets = [self.listen_shard(index) for index in range(self.shard_count)]
+        for index, (front_end_socket, shard_socket) in enumerate(pairs):
+            inherited_sockets = front_end_sockets + listening_sockets[:index] + listening_sockets[index + 1:]
+            process = multiprocessing.Process(target=run_shard,
+                                              args=(index, self.shard_count, shard_socket,
+                                                    listening_sockets[index], inherited_sockets))
+            process.daemon = True
+            process.start()
+            shard_socket.close()
+            self.shard_processes.append(process)
+            self.shards.append(ControlChannel(front_end_socket, self.loop, self.handle_shard_push,
+                                              self.shard_closed))
+        for listening_socket in listening_sockets:
+            listening_socket.close()
+        logger.info('Started %d tracker shards', self.shard_count)
+        Tracker.connect(self)
+
+
+    # bind the socket a shard listens on for the connections of the members
+    def listen_shard(self, index):
+        listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        port = self.shard_port + index if self.shard_port is not None else 0
+        listening_socket.bind((self.host, port))
+        listening_socket.listen(self.max_listen)
+        self.shard_addresses.append('%s,%d' % (self.host, listening_socket.getsockname()[1]))
+        return listening_socket
+
+
+    # a shard has exited and the groups it owned are lost
+    def shard_closed(self, connection):
+        logger.error('Tracker shard %d exited', self.shards.index(connection))
+        self.loop.stop()
+
+
+    def list_shards(self):
+        return "\t".join(self.shard_addresses)
+
+
+    # the group commands of members that have not connected to the shards
+    # are forwarded to the shard owning the group, which replies through us
+    def handle_request(self, connection, request_id, message):
+        command = message.split('\t', 2)
+        if (len(command) == 3 and command[1] in GROUP_COMMANDS and
+                command[0] in self.members_dict):
+            if getattr(connection, 'member_id', None) is not None:
+                self.failure_detector.heartbeat(connection.member_id)
+            logger.debug('Client [%s] issued command "%s"', connection.peer, message)
+            shard = self.shards[Group.shard_of(command[2], self.shard_count)]
+            shard.request(message, lambda reply: self.send_message(connection, request_id, reply))
+        else:
+            Tracker.handle_request(self, connection, request_id, message)
+
+
+    # a shard pushes every change of its groups ('join <member-id> <group-name>'
+    # or 'leave <member-id> <group-name>'), applied to the mirror of the groups,
+    # and the notifications of the members that have not connected to it
+    # ('<member-id> <notifications>'), relayed to the member
+    def handle_shard_push(self, payload):
+        fields = payload.split('\t', 2)
+        if fields[0] == 'join' or fields[0] == 'leave':
+            member = self.members_dict.get(fields[1])
+            # the member may have quit in the meantime
+            if member is None:
+                return
+            if fields[0] == 'join':
+                self.join_group(member, fields[2])
+            else:
+                self.leave_group(member, fields[2])
+            return
+        member_id, notifications = payload.split('\t', 1)
+        connection = self.connections.get(member_id)
+        if connection is not None:
+            connection.send(PUSH_REQUEST_ID, notifications)
+            logger.debug('Tracker sent "%s" to client [%s].', notifications, connection.peer)
+
+
+    def client_register(self, connection, request_id, message):
+        Tracker.client_register(self, connection, request_id, message)
+        member = self.members_dict.get(getattr(connection, 'member_id', None))
+        if member is not None:
+            for shard in self.shards:
+                shard.send(PUSH_REQUEST_ID, 'member\t' + str(member))
+
+
+    # the mirror groups are never assigned a multicast address, the shard
+    # owning a group assigns it
+    def assign_multicast_addr(self, group):
+        pass
+
+
+    # the shards owning the groups of the member remove it from them and
+    # notify their members, the others drop their copy of the registration
+    def member_quit(self, member):
+        for group_name in list(self.member_groups.get(member.id, ())):
+            self.leave_group(member, group_name)
+        for shard in self.shards:
+            shard.send(PUSH_REQUEST_ID, 'quit\t' + member.id)
+        del self.members_dict[member.id]
+        self.usernames.pop(member.username, None)
+        self.member_groups.pop(member.id, None)
+        self.connections.pop(member.id, None)
+        self.failure_detector.remove(member.id)
+        self.metrics.remove(member.id)
+
+
+if __name__ == "__main__":
+    configure_logging(LOGGING_FILE, LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT)
+    server = ShardedTracker(host="10.0.1.6", port=50000, metrics_port=METRICS_PORT,
+                            snapshot_file=SNAPSHOT_FILE)
+    server.connect()
@@ -0,0 +1,91 @@
+import logging
+import os
+
+logger = logging.getLogger('tracker')
+
+# suffix of the write-ahead log next to the snapshot of the tracker state
+LOG_SUFFIX = '.wal'
+
+
+class StateLog:
+    """
+    Write-ahead log of the membership changes of the tracker, compacted into
+    a snapshot of the whole state every now and then. Both files hold one
+    tab delimited record per line:
+
+    'register   <member-info>'
+    'group  <group-name>    <multicast-addr>    <multicast-port>'
+    'join   <member-id>     <group-name>'
+    'leave  <member-id>     <group-name>'
+    'quit   <member-id>'
+
+    and a snapshot is simply the shortest log rebuilding the state, so the
+    state is recovered by replaying the snapshot followed by the log. Records
+    are flushed to the kernel as they are appended, so they survive a crash
+    of the tracker (though not of its host).
+    """
+
+    def __init__(self, path):
+        self.snapshot_path = path
+        self.log_path = path + LOG_SUFFIX
+        self.log_file = None
+        # records appended since the last snapshot
+        self.records = 0
+
+    def recover(self):
+        """
+        Return the records of the snapshot followed by those of the log, each
+        as a list of fields, and open the log for appending.
+        """
+        records = self.read_records(self.snapshot_path)
+        log_records = self.read_records(self.log_path)
+        self.records = len(log_records)
+        self.log_file = open(self.log_path, 'a')
+        return records + log_records
+
+    # a record torn by a crash while it was written ends the file and is
+    # truncated, so that the records appended next start on a line of their own
+    @staticmethod
+    def read_records(path):
+        records = []
+        if not os.path.exists(path):
+            return records
+        valid_length = 0
+        with open(path, 'r+') as state_file:
+            for line in state_file:
+                if not line.endswith('\n'):
+                    logger.warning('Ignoring torn record at the end of %s', path)
+                    state_file.truncate(valid_length)
+                    break
+                valid_length += len(line)
+                records.append(line[:-1].split('\t'))
+        return records
+
+    def append(self, *fields):
+        self.log_file.write('\t'.join(fields) + '\n')
+        self.log_file.flush()
+        self.records += 1
+
+    def compact(self, records):
+        """
+        Replace the snapshot with the given records of the current state and
+        empty the log. The snapshot is written to a temporary file first, so
+        a crash leaves a complete snapshot, at worst followed by the old log
+        whose records are then replayed a second time (applying a record
+        again must not change the state).
+        """
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as snapshot:
+            for fields in records:
+                snapshot.write('\t'.join(fields) + '\n')
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.rename(temporary_path, self.snapshot_path)
+        self.log_file.close()
+        self.log_file = open(self.log_path, 'w')
+        self.records = 0
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import unittest
+
+from client import Client
+from event_loop import EventLoop
+from tracker import Tracker
+
+HOST = '127.0.0.1'
+# seconds a step may take before the test fails
+STEP_TIMEOUT = 5.0
+
+
+def find_free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind((HOST, 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def run_tracker(port):
+    sys.stdout = open(os.devnull, 'w')
+    Tracker(host=HOST, port=port).connect()
+
+
+class RejoinTest(unittest.TestCase):
+    """
+    A member that leaves a group and comes back under the same username (so
+    with the same member ID) starts its stream over at serial number 1, the
+    members that stayed deliver its new messages.
+    """
+
+    def setUp(self):
+        self.port = find_free_port()
+        self.tracker = multiprocessing.Process(target=run_tracker, args=(self.port,))
+        self.tracker.start()
+        time.sleep(0.5)
+        self.loop = EventLoop()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.tracker.terminate()
+        self.tracker.join()
+
+    def add_client(self, mode, username):
+        client = Client(HOST, 0, mode, loop=self.loop, metrics_interval=None)
+        client.connect(HOST, self.port, username)
+        client.join('g')
+        self.clients.append(client)
+        return client
+
+    # run the event loop until condition() holds
+    def run_until(self, condition):
+        deadline = time.time() + STEP_TIMEOUT
+        while not condition() and time.time() < deadline:
+            self.loop.run_once(0.05)
+        self.assertTrue(condition())
+
+    def check_rejoin(self, mode, leave):
+        bob = self.add_client(mode, 'bob')
+        delivered = []
+        bob.add_delivery_callback(lambda message: delivered.append(message.message_content))
+        alice = self.add_client(mode, 'alice')
+        self.run_until(lambda: len(bob.group_list['g'].members) == 2)
+        for i in range(3):
+            alice.send('first-%d' % i, 'g')
+        self.run_until(lambda: len(delivered) == 3)
+
+        alice = leave(alice, mode)
+        self.run_until(lambda: len(bob.group_list['g'].members) == 2)
+        for i in range(3):
+            alice.send('second-%d' % i, 'g')
+        self.run_until(lambda: len(delivered) == 6)
+        self.assertEqual(delivered, ['first-0', 'first-1', 'first-2',
+                                     'second-0', 'second-1', 'second-2'])
+        # the new stream started at 1, so no message was given up on
+        self.assertEqual(bob.metrics.counters.get('nack_gaps_skipped', 0), 0)
+
+    # the client quits and a new one registers under the same username
+    def restart(self, alice, mode):
+        self.clients.remove(alice)
+        alice.close()
+        bob = self.clients[0]
+        self.run_until(lambda: len(bob.group_list['g'].members) == 1)
+        return self.add_client(mode, 'alice')
+
+    # the client leaves the group and joins it again
+    def leave_and_join(self, alice, mode):
+        alice.leave('g')
+        bob = self.clients[0]
+        self.run_until(lambda: len(bob.group_list['g'].members) == 1)
+        alice.join('g')
+        return alice
+
+    def test_restart_fifo(self):
+        self.check_rejoin('FIFO', self.restart)
+
+    def test_restart_sequencer(self):
+        self.check_rejoin('SEQUENCER', self.restart)
+
+    def test_restart_total_order(self):
+        self.check_rejoin('TOTAL_ORDER', self.restart)
+
+    def test_leave_and_join_fifo(self):
+        self.check_rejoin('FIFO', self.leave_and_join)
+
+    def test_leave_and_join_total_order(self):
+        self.check_rejoin('TOTAL_ORDER', self.leave_and_join)
+
+
+if __name__ == '__main__':
+    unittest.main()
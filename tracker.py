@@ -1,101 +1,195 @@
+import json
+import os
 import socket
-import select
 import logging
 import time
 
+from channel import FramedConnection, PUSH_REQUEST_ID
+from event_loop import EventLoop
+from exporter import MetricsExporter
+from failure_detector import PhiAccrualFailureDetector
 from group import Group
+from log_queue import configure_logging
 from member import Member
+from metrics import MetricsAggregator
+from state_log import StateLog
 
 LOGGING_FILE = 'tracker.log'
-
-# Configure a custom logger for debugging purposes
-logging.basicConfig(
-        filename=LOGGING_FILE,
-        format='%(asctime)s %(levelname)-8s %(message)s',
-        level=logging.DEBUG,
-        datefmt='%d-%m-%Y %H:%M:%S')
+# seconds between two consecutive health checks of the registered members
+HEALTH_CHECK_INTERVAL = 1
+# seconds group change notifications are held back to be batched together
+NOTIFICATION_DELAY = 0.005
+# local port scrapers read the merged metrics of the clients from
+METRICS_PORT = 9464
+# file the merged metrics are written to, along with its rotated copies
+SNAPSHOT_FILE = 'cluster_metrics.json'
+SNAPSHOT_INTERVAL = 10
+SNAPSHOT_BACKUPS = 5
+# file the members and groups are written to, along with a write-ahead log
+# of their changes, so that a restarted tracker resumes where it stopped
+STATE_FILE = 'tracker_state'
+# seconds between two compactions of the write-ahead log into a snapshot
+STATE_SNAPSHOT_INTERVAL = 30
+# seconds the members restored after a restart are given to reconnect
+RESTORE_GRACE_PERIOD = 10
+
+# verbosity of the log, every command, reply and notification is logged at
+# DEBUG level, overridden by the TRACKER_LOG_LEVEL environment variable
+LOG_LEVEL = os.environ.get('TRACKER_LOG_LEVEL', 'INFO')
+LOG_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
+LOG_DATE_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+# records are only written once the process configures its logging, see
+# configure_logging()
+logger = logging.getLogger('tracker')
+logger.addHandler(logging.NullHandler())
 
 
 class Tracker:
 
-    def __init__(self, host, port, max_listen=1):
+    def __init__(self, host, port, max_listen=128, metrics_port=None, snapshot_file=None,
+                 state_file=None):
         self.host = host
         self.port = port
-        # the number of max clients server will be listening on
+        # the number of pending connections the server socket will queue
         self.max_listen = max_listen
         # tracker's socket listening for incoming connections
         self.socket = None
         # dictionary with (key, value) = (group, list with member IDs of key group)
         self.groups = {}
-        # list keeping track of the active sockets connected
-        self.sockets_list = []
+        # multicast addresses assigned to the active groups
+        self.multicast_addrs = set()
+        # dictionary with key = <group-id> and value = <group-name> of the
+        # active groups, clients key their state by the ID of a group, so a
+        # name whose ID collides with an active group is rejected
+        self.group_ids = {}
+        # event loop dispatching client connections, requests and periodic jobs
+        self.loop = EventLoop()
         # dictionary keeping connection info for each user connected
         # to our service based on his unique ID
         self.members_dict = {}
+        # dictionary with key = <username> and value = <member-id> of every
+        # registered member, usernames are checked for uniqueness in O(1)
+        self.usernames = {}
+        # dictionary with key = <member-id> and value = <set of the names of
+        # the groups the member belongs to>, a quitting member is removed
+        # from its own groups without scanning every group
+        self.member_groups = {}
+        # dictionary with key = <member-id> and value = <control connection of the member>
+        self.connections = {}
+        # group change notifications waiting to be pushed to each member, with
+        # key = <member-id> and value = <list of notification lines>
+        self.pending_notifications = {}
+        # timer flushing the pending notifications (None if nothing is pending)
+        self.notification_timer = None
+        # suspicion level of every registered member based on its heartbeats
+        self.failure_detector = PhiAccrualFailureDetector()
+        # latest metric snapshots pushed by the members, merged per group and
+        # cluster-wide, exported on metrics_port and written to snapshot_file
+        # every SNAPSHOT_INTERVAL seconds (None disables either of them)
+        self.metrics = MetricsAggregator()
+        self.metrics_port = metrics_port
+        self.snapshot_file = snapshot_file
+        self.exporter = None
+        # write-ahead log of the membership changes (None if the state is not
+        # persisted), restored when the tracker starts
+        self.state_log = StateLog(state_file) if state_file is not None else None
 
 
     def connect(self):
+        if self.state_log is not None:
+            self.restore_state()
+            self.loop.call_every(STATE_SNAPSHOT_INTERVAL, self.compact_state)
         # create non-blocking TCP socket to listen for all the clients
         # and ensure reliable connection for control messages
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setblocking(0)
+        # a restarted tracker binds its port while connections of its previous
+        # run are still in TIME_WAIT
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.host, self.port))
         self.socket.listen(self.max_listen)
-        self.sockets_list.append(self.socket)
-
-        logging.info('Chat server started listening on port ' + str(self.port))
-
-        last_failed_check = time.time()
-        while True:
-            if time.time() - last_failed_check > 7:
-                self.remove_failed_users()
-                last_failed_check = time.time()
-
-            # wait for time completion
-            readers, writers, errors = select.select(self.sockets_list, [], [], 0)
-            for sock in readers:
-                # new connection established
-                if sock == self.socket:
-                    self.serve_client()
-                # command issued by member
-                else:
-                    self.handle_request(sock)
-
-
+        # new connections are served when the listening socket is readable
+        self.loop.add_reader(self.socket, self.serve_client)
+        # periodic jobs are scheduled as timers of the event loop
+        self.loop.call_every(HEALTH_CHECK_INTERVAL, self.remove_failed_users)
+        if self.metrics_port is not None:
+            # the endpoint is only reachable from the tracker's host
+            self.exporter = MetricsExporter(self.loop, '127.0.0.1', self.metrics_port,
+                                            self.render_prometheus, self.render_json)
+        if self.snapshot_file is not None:
+            self.loop.call_every(SNAPSHOT_INTERVAL, self.write_metrics_snapshot)
+
+        logger.info('Chat server started listening on port %s', self.port)
+
+        # block until a connection or a command arrives or a timer is due
+        self.loop.run()
+
+
+    # remove the members that the failure detector suspects, members send
+    # heartbeats over their control connection so checking them does not
+    # involve any network round trip and never blocks the tracker
     def remove_failed_users(self):
-        del_list = []
-        for mem in self.members_dict:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.members_dict[mem].ip, int(self.members_dict[mem].tcp_port)))
-                sock.close()
-            except socket.error:
-                del_list.append(self.members_dict[mem])
-
-        for mem in del_list:
+        for member_id in self.failure_detector.suspects():
+            mem = self.members_dict.get(member_id)
+            if mem is None:
+                self.failure_detector.remove(member_id)
+                continue
+            logger.warning('Client %s suspected to have failed %s', mem.username,
+                           self.failure_detector.stats(member_id))
             print 'client with username: ' + mem.username + ' disconnected'
+            connection = self.connections.get(member_id)
             self.member_quit(mem)
+            if connection is not None:
+                connection.close()
 
 
     def serve_client(self):
-        # accept a client incoming connection
+        # accept a client incoming connection, the connection is kept open and
+        # carries all the (framed) commands of the client along with replies
         sockfd, addr = self.socket.accept()
-        # set the client socket to non-blocking
-        sockfd.setblocking(0)
-        self.sockets_list.append(sockfd)
-        logging.debug('TCP connection with client [' + str(addr) + '] established successfully.')
+        sockfd.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        FramedConnection(sockfd, self.loop, self.handle_request, self.connection_closed)
+        logger.debug('TCP connection with client [%s] established successfully.', addr)
+
+
+    # a member whose control connection is closed without quitting has crashed
+    def connection_closed(self, connection):
+        member_id = getattr(connection, 'member_id', None)
+        if self.connections.get(member_id) is connection:
+            del self.connections[member_id]
+            mem = self.members_dict[member_id]
+            print 'client with username: ' + mem.username + ' disconnected'
+            self.member_quit(mem)
+        logger.debug('TCP connection with client [%s] terminated successfully.', connection.peer)
 
 
-    def handle_request(self, socket):
-        message = socket.recv(4096)
+    # handle a command of a client, the reply is tagged with the
+    # request ID of the command so that clients can pipeline commands
+    def handle_request(self, connection, request_id, message):
+        # every frame of a registered member is a sign of life
+        member_id = getattr(connection, 'member_id', None)
+        if member_id is not None:
+            self.failure_detector.heartbeat(member_id)
+            if message == 'heartbeat':
+                return
+            # periodic metrics of the member, 'metrics <json-snapshot>'
+            if message[0:8] == 'metrics\t':
+                self.update_member_metrics(member_id, message[8:])
+                return
+
         if message:
             # debug message to print the message sent by a specific client
-            logging.info('Client [' + str(socket.getpeername()) + '] issued command "' + str(message) + '"')
+            logger.debug('Client [%s] issued command "%s"', connection.peer, message)
 
             # if  message starts with 'register' word then a client
             # wants to register to our service
             if message[0:8] == 'register':
-                self.client_register(socket, message)
+                self.client_register(connection, request_id, message)
+
+            # a registered member has reconnected, e.g. after a restart of the tracker
+            elif message[0:7] == 'resume\t':
+                self.client_resume(connection, request_id, message)
 
             # a client command is issued by a specific member
             else:
@@ -103,47 +197,60 @@ class Tracker:
                 # and they are tab delimited
                 command = message.split("\t")
                 member_id = command[0]
-                if member_id in self.members_dict.keys():
+                if member_id in self.members_dict:
                     member = self.members_dict[member_id]
                 else:
                     print 'Invalid member ID issued command'
+                    self.send_message(connection, request_id, "invalid member")
                     return
 
                 # command "!q" informs the tracker that the member
                 # that issued the command want to quit
                 if command[1] == '!q':
                     self.member_quit(member)
-                    self.send_message(socket, "QUIT OK")
+                    self.send_message(connection, request_id, "QUIT OK")
 
                 # command "!lg", user requests the list of all active groups
                 elif command[1] == '!lg':
-                    self.send_message(socket, self.list_groups())
+                    self.send_message(connection, request_id, self.list_groups())
+
+                # command "!sh", the client asks where to send the group commands
+                elif command[1] == '!sh':
+                    self.send_message(connection, request_id, self.list_shards())
 
                 # command "!j <group-name>", user requests from tracker
                 # to participate in the specified group
                 elif command[1] == '!j':
                     group = self.join_group(member, command[2])
-                    reply = "\t".join([str(member) for member in group.members_list])
-                    self.send_message(socket, reply)
+                    if group is None:
+                        self.send_message(connection, request_id, "group id taken")
+                        return
+                    # the members of the group followed by its multicast address
+                    reply = "\t".join([str(member) for member in group.members.itervalues()])
+                    reply += "\n%s,%d" % (group.multicast_addr, group.multicast_port)
+                    self.send_message(connection, request_id, reply)
                     self.notify_group(group, member, 'add')
                 
                 # command "!lm <group-name>", user requests the list of all
                 # active members in the specified group
                 elif command[1] == '!lm':
-                    group = self.groups[command[2]]
-                    self.send_message(socket, group.list_members())
+                    group = self.groups.get(command[2])
+                    if group is None:
+                        self.send_message(connection, request_id, "")
+                    else:
+                        self.send_message(connection, request_id, group.list_members())
 
                 # command "!e <group-name>", user requests to leave from
                 # the specified group
                 elif command[1] == '!e':
-                    group_name = command[2]
-                    self.leave_group(member, group_name)
-                    group = self.groups[group_name]
-                    self.notify_group(group, member, 'remove')
-                    self.send_message(socket, "EXIT_GROUP OK")
+                    group = self.leave_group(member, command[2])
+                    if group is not None:
+                        self.notify_group(group, member, 'remove')
+                    self.send_message(connection, request_id, "EXIT_GROUP OK")
 
                 else:
-                    logging.warning('Unrecognised command request')
+                    logger.warning('Unrecognised command request')
+                    self.send_message(connection, request_id, "unrecognised command")
                     return
 
 
@@ -152,27 +259,61 @@ class Tracker:
         return active_groups
 
 
+    # the '<ip>,<port>' addresses of the shards serving the group commands, tab
+    # delimited and empty since this tracker serves them itself
+    def list_shards(self):
+        return ""
+
+
     # member quits the application
     def member_quit(self, member):
         # remove member from every group that it belongs
-        for group in self.groups.values():
-            if member in group.members_list:
-                group.remove_member(member)
+        for group_name in list(self.member_groups.get(member.id, ())):
+            group = self.leave_group(member, group_name)
+            self.notify_group(group, member, 'remove')
         # remove member from the dictionary that tracker keeps
         # for all of the connected members
         del self.members_dict[member.id]
+        self.usernames.pop(member.username, None)
+        self.member_groups.pop(member.id, None)
+        self.connections.pop(member.id, None)
+        self.pending_notifications.pop(member.id, None)
+        self.log_state('quit', member.id)
+        self.failure_detector.remove(member.id)
+        self.metrics.remove(member.id)
 
 
-    # add a new member to the requested group
+    # add a new member to the requested group, returns the group (None if
+    # its ID is the ID of another active group)
     def join_group(self, member, group_name):
         # if the group name the user requested to join doesn't exist
         # then create a new group with that name
         if group_name not in self.groups:
             new_group = Group(group_name)
+            if new_group.id in self.group_ids:
+                return None
+            self.assign_multicast_addr(new_group)
             self.groups[group_name] = new_group
+            self.group_ids[new_group.id] = group_name
+            self.log_state('group', group_name, new_group.multicast_addr, str(new_group.multicast_port))
+        group = self.groups[group_name]
         # add the requesting member to the group he requested
-        self.groups[group_name].add_member(member)
-        return self.groups[group_name]
+        if not group.has_member(member.id):
+            group.add_member(member)
+            self.member_groups.setdefault(member.id, set()).add(group_name)
+            self.log_state('join', member.id, group_name)
+        return group
+
+
+    # assign a multicast address that no other group uses to a new group,
+    # clients that support multicast send their messages to it
+    def assign_multicast_addr(self, group):
+        multicast_addr = Group.generate_multicast_addr()
+        while multicast_addr in self.multicast_addrs:
+            multicast_addr = Group.generate_multicast_addr()
+        self.multicast_addrs.add(multicast_addr)
+        group.multicast_addr = multicast_addr
+        group.multicast_port = Group.generate_multicast_port()
 
 
     # notify all members in the group that a member has been added
@@ -180,75 +321,220 @@ class Tracker:
     # group for the important changes in the following manner:
     # 'add  <group-name>    <member-info>' -> for new member
     # 'remove   <group-name>    <member-info>'  -> for leaving group
+    # notifications are pushed over the control connection of each member and
+    # those issued within NOTIFICATION_DELAY are batched in a single message
     def notify_group(self, group, member, operation):
         notification = "\t".join([operation, group.name, str(member)])
-        for client in group.members_list:
+        for client in group.members.itervalues():
             # no need to notify the new member or the member leaving the group
             if member == client:
                 continue
-            # create socket for each member and send notification message
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((client.ip, int(client.tcp_port)))
-            sock.send(notification)
-            addr = sock.getpeername()
-            logging.info('Tracker sent "' + notification + '" to client [' + str(addr) + '].')
-            sock.close()
-            logging.debug('TCP connection with client [' + str(addr) + '] terminated successfully.')
-
+            self.pending_notifications.setdefault(client.id, []).append(notification)
+        if self.pending_notifications and self.notification_timer is None:
+            self.notification_timer = self.loop.call_later(NOTIFICATION_DELAY, self.flush_notifications)
+
+
+    # push the batched notifications to every member, one line per change
+    def flush_notifications(self):
+        self.notification_timer = None
+        pending, self.pending_notifications = self.pending_notifications, {}
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for member_id, notifications in pending.iteritems():
+            connection = self.connections.get(member_id)
+            if connection is None:
+                continue
+            batch = "\n".join(notifications)
+            connection.send(PUSH_REQUEST_ID, batch)
+            if debug:
+                logger.debug('Tracker sent "%s" to client [%s].', batch, connection.peer)
 
 
-    # remove a member from a group
+    # remove a member from a group, returns the group (None if the member
+    # did not belong to it) so that its remaining members can be notified
     def leave_group(self, member, group_name):
-        if group_name in self.groups.keys():
-            group = self.groups[group_name]
-            group.remove_member(member)
+        group = self.groups.get(group_name)
+        if group is None or group.remove_member_by_id(member.id) is None:
+            return None
+        self.member_groups[member.id].discard(group_name)
+        self.log_state('leave', member.id, group_name)
         # if last member left the group then delete group
-        if len(self.groups.keys()) == 1:
+        if not group.members:
             del self.groups[group_name]
+            del self.group_ids[group.id]
+            self.multicast_addrs.discard(group.multicast_addr)
+        return group
 
 
     # handle the new member registration by creating a new member
     # entry and by generating a unique ID for the new member
-    def client_register(self, socket, message):
+    def client_register(self, connection, request_id, message):
         register_info = message.split('\t')
         client_ip = register_info[1]
         client_port = register_info[2]
         client_l_port = register_info[3]
         client_username = register_info[4]
         # check if an active member already uses that username
-        for member in self.members_dict.values():
-            if member.username == client_username:
-                self.send_message(socket, "username taken")
-                return
+        if client_username in self.usernames:
+            self.send_message(connection, request_id, "username taken")
+            return
         # generate a unique ID for each client
         client_id = str(hash(client_username))
         # create a member object for the new member
         new_member = Member(client_id, client_username, client_ip, client_port, client_l_port)
         # add a dictionary entry for new member based on his unique ID
         self.members_dict[client_id] = new_member
+        self.usernames[client_username] = client_id
+        self.log_state('register', str(new_member))
+        # group change notifications are pushed over this connection
+        self.connections[client_id] = connection
+        connection.member_id = client_id
+        self.failure_detector.heartbeat(client_id)
         # send the unique ID to the client
-        self.send_message(socket, new_member.id)
-
-
-    # this function sends the desired response to user's control message
-    # and terminates the TCP connection to ensure resources preservation
-    def send_message(self, socket, message):
-        socket.send(message)
-        addr = socket.getpeername()
-        logging.info('Tracker sent "' + message + '" to client [' + str(addr) + '].')
-        self.sockets_list.remove(socket)
-        socket.close()
-        logging.debug('TCP connection with client [' + str(addr) + '] terminated successfully.')
-
-
-server = Tracker(host="10.0.1.6", port=50000)
-server.connect()
-
-
-
-
-
-
-
-
-
+        self.send_message(connection, request_id, new_member.id)
+
+
+    # a member reconnects with 'resume <ip> <udp-port> <tcp-port> <username> <member-id>'
+    # after losing its control connection, its registration and groups are kept and
+    # the reply lists after 'RESUME OK' the current members of each of its groups,
+    # one group per line, so that it catches up with the changes it has missed
+    def client_resume(self, connection, request_id, message):
+        resume_info = message.split('\t')
+        member = self.members_dict.get(resume_info[5])
+        if member is None or member.username != resume_info[4]:
+            # the member has been removed meanwhile, so it registers again
+            self.client_register(connection, request_id, message)
+            return
+        previous_connection = self.connections.get(member.id)
+        self.connections[member.id] = connection
+        connection.member_id = member.id
+        if previous_connection is not None and previous_connection is not connection:
+            previous_connection.close()
+        self.failure_detector.heartbeat(member.id)
+        reply = ['RESUME OK']
+        for group_name in self.member_groups.get(member.id, ()):
+            members = self.groups[group_name].members.itervalues()
+            reply.append("\t".join([group_name] + [str(group_member) for group_member in members]))
+        self.send_message(connection, request_id, "\n".join(reply))
+
+
+    # append a membership change to the write-ahead log of the state
+    def log_state(self, *fields):
+        if self.state_log is not None:
+            self.state_log.append(*fields)
+
+
+    # the records rebuilding the current members and groups
+    def state_records(self):
+        for member in self.members_dict.itervalues():
+            yield 'register', str(member)
+        for group in self.groups.itervalues():
+            yield 'group', group.name, group.multicast_addr, str(group.multicast_port)
+            for member_id in group.members:
+                yield 'join', member_id, group.name
+
+
+    # rebuild the members and groups from the snapshot and the write-ahead log,
+    # restored members are expected to reconnect and resume their registration
+    # within RESTORE_GRACE_PERIOD seconds before the failure detector suspects them
+    def restore_state(self):
+        start = time.time()
+        # the replayed changes are not appended to the log again
+        state_log, self.state_log = self.state_log, None
+        records = state_log.recover()
+        for record in records:
+            self.restore_record(record)
+        self.state_log = state_log
+        for member_id in self.members_dict:
+            self.failure_detector.restore(member_id, RESTORE_GRACE_PERIOD)
+        self.compact_state()
+        logger.info('Restored %d members and %d groups from %d records in %.3f ms',
+                    len(self.members_dict), len(self.groups), len(records),
+                    (time.time() - start) * 10 ** 3)
+
+
+    # apply a record of the state, records applied twice leave the state unchanged
+    def restore_record(self, record):
+        operation = record[0]
+        if operation == 'register':
+            member = Member(*record[1].split(','))
+            self.members_dict[member.id] = member
+            self.usernames[member.username] = member.id
+        elif operation == 'group':
+            if record[1] not in self.groups:
+                group = Group(record[1])
+                group.multicast_addr = record[2]
+                group.multicast_port = int(record[3])
+                self.groups[record[1]] = group
+                self.group_ids[group.id] = record[1]
+                self.multicast_addrs.add(group.multicast_addr)
+        elif operation in ('join', 'leave', 'quit'):
+            member = self.members_dict.get(record[1])
+            if member is None:
+                return
+            if operation == 'join':
+                self.join_group(member, record[2])
+            elif operation == 'leave':
+                self.leave_group(member, record[2])
+            else:
+                self.member_quit(member)
+        else:
+            logger.warning('Ignoring unknown state record "%s"', '\t'.join(record))
+
+
+    # replace the snapshot of the state with the current one and empty the log
+    def compact_state(self):
+        if self.state_log.records == 0:
+            return
+        try:
+            self.state_log.compact(self.state_records())
+        except (IOError, OSError) as e:
+            logger.error('Failed to write state snapshot: %s', e)
+
+
+    # store the latest metric snapshot pushed by a member
+    def update_member_metrics(self, member_id, payload):
+        try:
+            self.metrics.update(member_id, json.loads(payload))
+        except ValueError:
+            logger.warning('Malformed metrics snapshot from member %s', member_id)
+
+
+    def render_prometheus(self):
+        return self.metrics.render_prometheus(self.groups)
+
+
+    def render_json(self):
+        return json.dumps(self.metrics.render_json(self.groups), sort_keys=True)
+
+
+    # write the merged metrics to the snapshot file, the previous snapshots
+    # are kept as <file>.1 (the most recent) up to <file>.SNAPSHOT_BACKUPS
+    def write_metrics_snapshot(self):
+        temporary_file = self.snapshot_file + '.tmp'
+        try:
+            with open(temporary_file, 'w') as snapshot:
+                snapshot.write(self.render_json())
+            for index in range(SNAPSHOT_BACKUPS - 1, 0, -1):
+                backup = '%s.%d' % (self.snapshot_file, index)
+                if os.path.exists(backup):
+                    os.rename(backup, '%s.%d' % (self.snapshot_file, index + 1))
+            if os.path.exists(self.snapshot_file):
+                os.rename(self.snapshot_file, self.snapshot_file + '.1')
+            # the snapshot replaces the file at once, readers never see it partially written
+            os.rename(temporary_file, self.snapshot_file)
+        except (IOError, OSError) as e:
+            logger.error('Failed to write metrics snapshot: %s', e)
+
+
+    # this function sends the desired response to user's control message,
+    # the connection stays open for the following commands of the client
+    def send_message(self, connection, request_id, message):
+        connection.send(request_id, message)
+        logger.debug('Tracker sent "%s" to client [%s].', message, connection.peer)
+
+
+if __name__ == "__main__":
+    configure_logging(LOGGING_FILE, LOG_LEVEL, LOG_FORMAT, LOG_DATE_FORMAT)
+    server = Tracker(host="10.0.1.6", port=50000, metrics_port=METRICS_PORT, snapshot_file=SNAPSHOT_FILE,
+                     state_file=STATE_FILE)
+    server.connect()